@@ -0,0 +1,300 @@
+import gzip
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+Record = Dict[str, Any] # A location as stored (LocationModel.model_dump(mode="json"))
+
+# A change to some fields of one stored location, evaluated against the record as it is when the
+# change is applied (not as the writer last saw it):
+#   {"id": ..., "set": {field: value}, "fill": {field: value}, "merge": {field: {key: value}}, "expect": {field: value}}
+# "set" overwrites fields, "fill" sets its fields together only if one of them is still null,
+# "merge" adds keys to dict fields, and "expect" skips the whole patch unless the record still has
+# those values. A patch for a location that no longer exists does nothing.
+Patch = Dict[str, Any]
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class PreconditionFailedError(Exception):
+    """Raised when a conditional write loses against a concurrent writer."""
+
+
+class ChangeResult:
+    """Versions of the stored data immediately before and after a successful write."""
+
+    def __init__(self, previous_version: Optional[str], version: Optional[str]):
+        self.previous_version = previous_version
+        self.version = version
+
+
+def apply_patch_to_record(record: Record, patch: Patch) -> Record:
+    """Returns the record with the patch applied, or the record itself if its "expect" doesn't hold."""
+    if any(record.get(field) != value for field, value in patch.get("expect", {}).items()):
+        return record
+    patched = dict(record)
+    patched.update(patch.get("set", {}))
+    fill = patch.get("fill", {})
+    if any(patched.get(field) is None for field in fill):
+        patched.update(fill)
+    for field, entries in patch.get("merge", {}).items():
+        patched[field] = {**(patched.get(field) or {}), **entries}
+    return patched
+
+
+def apply_changes_to_records(records: List[Record], upserts: Iterable[Record], deletes: Iterable[str], patches: Iterable[Patch] = ()) -> List[Record]:
+    """Returns a new record list with upserts (replace in place, or append), patches (in order) and deletes applied."""
+    positions = {str(record["id"]): i for i, record in enumerate(records)}
+    result = list(records)
+    for record in upserts:
+        position = positions.get(str(record["id"]))
+        if position is None:
+            positions[str(record["id"])] = len(result)
+            result.append(record)
+        else:
+            result[position] = record
+    for patch in patches:
+        position = positions.get(str(patch["id"]))
+        if position is not None: # Never recreates a location deleted in the meantime
+            result[position] = apply_patch_to_record(result[position], patch)
+    deleted = {str(location_id) for location_id in deletes}
+    if deleted:
+        result = [record for record in result if str(record["id"]) not in deleted]
+    return result
+
+
+def decode_document(data: bytes) -> Any:
+    """Parses a stored JSON document, transparently gunzipping it if it was stored compressed."""
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    return json.loads(data)
+
+
+def decode_snapshot(data: Optional[bytes]) -> Tuple[List[Record], int]:
+    """Decodes a snapshot document into (records, last log sequence folded into it).
+
+    Accepts the original plain-list format as well as {"log_seq": n, "locations": [...]},
+    either as plain JSON or gzipped.
+    """
+    if not data:
+        return [], 0
+    document = decode_document(data)
+    if isinstance(document, list):
+        return document, 0
+    if isinstance(document, dict) and isinstance(document.get("locations"), list):
+        return document["locations"], int(document.get("log_seq", 0))
+    raise ValueError(f"Invalid snapshot format: expected a list of locations, found {type(document)}")
+
+
+def encode_json(document: Any, compress: bool = False) -> bytes:
+    data = json.dumps(document, separators=(",", ":")).encode("utf-8")
+    # Level 6 gets nearly all of the size win of 9 at a fraction of the CPU
+    return gzip.compress(data, compresslevel=6, mtime=0) if compress else data
+
+
+def content_type_for(data: bytes) -> str:
+    return "application/gzip" if data[:2] == GZIP_MAGIC else "application/json"
+
+
+def retry_on_precondition(operation, max_attempts: int, description: str):
+    """Runs operation(), retrying with jittered exponential backoff while it raises PreconditionFailedError."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return operation()
+        except PreconditionFailedError:
+            if attempt == max_attempts:
+                logger.error(f"{description}: giving up after {attempt} conflicting attempts.")
+                raise
+            delay = 0.05 * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.info(f"{description}: concurrent write detected, retrying in {delay:.3f}s (attempt {attempt}/{max_attempts}).")
+            time.sleep(delay)
+
+
+class LocationStorageBackend(ABC):
+    """Where and how the location catalogue is persisted.
+
+    Versions are opaque strings that change whenever the stored data changes (None means nothing
+    is stored yet), which lets callers cache parsed data and revalidate it cheaply.
+    """
+
+    supports_append = False # True if append_changes() is implemented
+
+    @abstractmethod
+    def describe(self) -> str:
+        """Human readable location of the data, for log messages."""
+
+    @abstractmethod
+    def get_version(self) -> Optional[str]:
+        """Current version of the stored data, using metadata only."""
+
+    @abstractmethod
+    def read(self) -> Tuple[List[Record], Optional[str]]:
+        """Reads all records and the version they correspond to."""
+
+    @abstractmethod
+    def write_snapshot(self, records: List[Record], if_version_match: Optional[str] = None) -> Optional[str]:
+        """Replaces the stored data with records and returns the new version.
+
+        The write only succeeds if the stored version still equals if_version_match (None meaning
+        "nothing stored"); otherwise PreconditionFailedError is raised.
+        """
+
+    def append_changes(self, upserts: List[Record], deletes: List[str], patches: List[Patch] = ()) -> ChangeResult:
+        """Durably records a set of changes without rewriting the whole catalogue.
+
+        Patches are stored as patches and applied when the log is read, so they see every change
+        logged before them.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support appending changes")
+
+    def compact(self) -> bool:
+        """Folds pending changes into a new snapshot. Returns True if anything was compacted."""
+        return False
+
+    @abstractmethod
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        """Reads an auxiliary document stored next to the data, or None if it doesn't exist."""
+
+    @abstractmethod
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        """Stores an auxiliary document next to the data."""
+
+
+class LogStructuredBackend(LocationStorageBackend):
+    """Snapshot + append-only change log, on top of a few object-store primitives.
+
+    Each mutation is stored as its own small log entry with a sequential number, created with a
+    "must not exist" precondition so concurrent writers can never overwrite each other; a writer
+    that loses the race simply takes the next number. The snapshot records the last sequence
+    number folded into it. Compaction rewrites the snapshot (guarded by its generation) and then
+    deletes the folded entries. The version is "<snapshot generation>.<last sequence number>".
+    """
+
+    supports_append = True
+
+    def __init__(self, max_attempts: int = 5, compress: bool = False):
+        self.max_attempts = max_attempts
+        self.compress = compress # gzip snapshots (log entries are small and stay plain JSON)
+        self._compaction_lock = threading.Lock()
+
+    # --- Primitives implemented by concrete backends ---
+
+    @abstractmethod
+    def _snapshot_info(self) -> Tuple[int, int]:
+        """(snapshot generation, last folded sequence number); (0, 0) if there is no snapshot."""
+
+    @abstractmethod
+    def _read_snapshot(self, generation: int) -> Optional[bytes]:
+        """Reads the snapshot; raises PreconditionFailedError if its generation changed."""
+
+    @abstractmethod
+    def _write_snapshot(self, data: bytes, log_seq: int, if_generation_match: int) -> int:
+        """Writes the snapshot if its generation still equals if_generation_match (0: "must not exist") and returns the new generation."""
+
+    @abstractmethod
+    def _list_log(self) -> List[int]:
+        """Sequence numbers of the log entries currently stored, ascending."""
+
+    @abstractmethod
+    def _read_log_entry(self, seq: int) -> Optional[bytes]:
+        """Reads a log entry, or None if it no longer exists."""
+
+    @abstractmethod
+    def _create_log_entry(self, seq: int, data: bytes) -> None:
+        """Creates a log entry; raises PreconditionFailedError if it already exists."""
+
+    @abstractmethod
+    def _delete_log_entry(self, seq: int) -> None:
+        """Deletes a log entry, ignoring entries that are already gone."""
+
+    # --- Generic log logic ---
+
+    @staticmethod
+    def _version(generation: int, last_seq: int) -> Optional[str]:
+        if generation == 0 and last_seq == 0:
+            return None
+        return f"{generation}.{last_seq}"
+
+    def get_version(self) -> Optional[str]:
+        generation, snapshot_seq = self._snapshot_info()
+        seqs = self._list_log()
+        return self._version(generation, max([snapshot_seq] + seqs))
+
+    def _read_once(self) -> Tuple[List[Record], Optional[str], int, int]:
+        generation, _ = self._snapshot_info()
+        records, snapshot_seq = decode_snapshot(self._read_snapshot(generation) if generation else None)
+        seqs = [seq for seq in self._list_log() if seq > snapshot_seq]
+        last_seq = snapshot_seq
+        for seq in seqs:
+            data = self._read_log_entry(seq)
+            if data is None or seq != last_seq + 1:
+                # Entries were compacted away (or are still being written) under us: start over
+                raise PreconditionFailedError(f"Log changed while reading (expected entry {last_seq + 1}, got {seq})")
+            entry = decode_document(data)
+            records = apply_changes_to_records(records, entry.get("upserts", []), entry.get("deletes", []), entry.get("patches", []))
+            last_seq = seq
+        return records, self._version(generation, last_seq), generation, last_seq
+
+    def read(self) -> Tuple[List[Record], Optional[str]]:
+        records, version, _, _ = retry_on_precondition(self._read_once, self.max_attempts, f"Reading {self.describe()}")
+        return records, version
+
+    def write_snapshot(self, records: List[Record], if_version_match: Optional[str] = None) -> Optional[str]:
+        generation, snapshot_seq = self._snapshot_info()
+        seqs = self._list_log()
+        last_seq = max([snapshot_seq] + seqs)
+        if self._version(generation, last_seq) != if_version_match:
+            raise PreconditionFailedError(f"{self.describe()} changed (expected version {if_version_match})")
+        # Fold everything logged so far into (i.e. overwrite with) the new snapshot
+        new_generation = self._write_snapshot(encode_json({"log_seq": last_seq, "locations": records}, self.compress), last_seq, generation)
+        for seq in seqs:
+            self._delete_log_entry(seq)
+        return self._version(new_generation, last_seq)
+
+    def append_changes(self, upserts: List[Record], deletes: List[str], patches: List[Patch] = ()) -> ChangeResult:
+        entry = {"upserts": upserts, "deletes": [str(location_id) for location_id in deletes]}
+        if patches:
+            entry["patches"] = list(patches)
+        data = encode_json(entry)
+
+        def attempt() -> ChangeResult:
+            generation, snapshot_seq = self._snapshot_info()
+            last_seq = max([snapshot_seq] + self._list_log())
+            seq = last_seq + 1
+            self._create_log_entry(seq, data)
+            # A compaction racing us could have folded (and deleted) entries up to or past our number,
+            # freeing the name we just created. Our entry would then be ignored, so take it back and retry.
+            current_generation, current_snapshot_seq = self._snapshot_info()
+            if current_snapshot_seq >= seq:
+                self._delete_log_entry(seq)
+                raise PreconditionFailedError(f"Log entry {seq} was superseded by a compaction")
+            if current_generation != generation:
+                return ChangeResult(None, self._version(current_generation, seq))
+            return ChangeResult(self._version(generation, last_seq), self._version(generation, seq))
+
+        return retry_on_precondition(attempt, self.max_attempts, f"Appending to {self.describe()}")
+
+    def compact(self) -> bool:
+        if not self._compaction_lock.acquire(blocking=False):
+            return False # Another thread in this process is already compacting
+        try:
+            def attempt() -> bool:
+                records, _, generation, last_seq = self._read_once()
+                folded = [seq for seq in self._list_log() if seq <= last_seq]
+                _, snapshot_seq = self._snapshot_info()
+                if last_seq == snapshot_seq and not folded:
+                    return False
+                self._write_snapshot(encode_json({"log_seq": last_seq, "locations": records}, self.compress), last_seq, generation)
+                for seq in folded:
+                    self._delete_log_entry(seq)
+                logger.info(f"Compacted {len(folded)} log entries into a new snapshot of {self.describe()} ({len(records)} locations, log_seq {last_seq}).")
+                return True
+            return retry_on_precondition(attempt, self.max_attempts, f"Compacting {self.describe()}")
+        finally:
+            self._compaction_lock.release()
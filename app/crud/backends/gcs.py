@@ -0,0 +1,162 @@
+from typing import List, Optional, Tuple
+from google.api_core import exceptions as gcs_exceptions
+from google.cloud import storage
+from app.metrics import count
+from .base import LocationStorageBackend, LogStructuredBackend, PreconditionFailedError, Record, content_type_for, decode_snapshot, encode_json, retry_on_precondition
+import logging
+
+logger = logging.getLogger(__name__)
+
+_LOG_SEQ_METADATA_KEY = "log_seq"
+_READ_ATTEMPTS = 5 # A blob replaced between its metadata lookup and download is read again
+
+
+def _download(blob: storage.Blob, **kwargs) -> bytes:
+    data = blob.download_as_bytes(**kwargs)
+    count("storage_bytes_read", len(data), backend="gcs")
+    return data
+
+
+def _download_current(bucket: storage.Bucket, name: str) -> Optional[Tuple[bytes, int]]:
+    # (data, generation) of the blob, or None if it doesn't exist. The download is pinned to the
+    # generation just looked up, so data and version always agree; if another writer replaces
+    # (or deletes) the blob in between, the pair is retried.
+    def attempt() -> Optional[Tuple[bytes, int]]:
+        blob = bucket.get_blob(name)
+        if blob is None:
+            return None
+        try:
+            return _download(blob, if_generation_match=blob.generation), blob.generation
+        except (gcs_exceptions.PreconditionFailed, gcs_exceptions.NotFound) as e:
+            raise PreconditionFailedError(str(e)) from e
+    return retry_on_precondition(attempt, _READ_ATTEMPTS, f"Reading gs://{bucket.name}/{name}")
+
+
+def _upload(blob: storage.Blob, data: bytes, **kwargs) -> None:
+    blob.upload_from_string(data, content_type=content_type_for(data), **kwargs)
+    count("storage_bytes_written", len(data), backend="gcs")
+
+
+class _GCSSidecars:
+    """Auxiliary documents stored as blobs in the same bucket as the data."""
+
+    bucket: storage.Bucket
+
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        current = _download_current(self.bucket, name)
+        return current[0] if current is not None else None
+
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        _upload(self.bucket.blob(name), data)
+
+
+class GCSSnapshotBackend(_GCSSidecars, LocationStorageBackend):
+    """The whole catalogue as a single JSON blob, rewritten on every change.
+
+    Conditional writes use the blob generation (if_generation_match), so concurrent writers on
+    different instances can no longer silently overwrite each other. With compress set the blob
+    is gzipped; reads detect the format, so either kind of blob can be read back.
+    """
+
+    def __init__(self, client: storage.Client, bucket_name: str, blob_name: str, compress: bool = False):
+        self.bucket = client.bucket(bucket_name)
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+        self.compress = compress
+
+    def describe(self) -> str:
+        return f"gs://{self.bucket_name}/{self.blob_name}"
+
+    def get_version(self) -> Optional[str]:
+        # get_blob is a single metadata-only request; it returns None if the blob doesn't exist.
+        blob = self.bucket.get_blob(self.blob_name)
+        return str(blob.generation) if blob is not None else None
+
+    def read(self) -> Tuple[List[Record], Optional[str]]:
+        current = _download_current(self.bucket, self.blob_name)
+        if current is None:
+            logger.info(f"Data blob {self.blob_name} not found in bucket {self.bucket_name}.")
+            return [], None
+        data, generation = current
+        records, _ = decode_snapshot(data)
+        return records, str(generation)
+
+    def write_snapshot(self, records: List[Record], if_version_match: Optional[str] = None) -> Optional[str]:
+        blob = self.bucket.blob(self.blob_name)
+        # Keep the original plain-list document format for this backend (compact, not pretty-printed)
+        data = encode_json(records, self.compress)
+        try:
+            _upload(blob, data, if_generation_match=int(if_version_match or 0))
+        except gcs_exceptions.PreconditionFailed as e:
+            raise PreconditionFailedError(str(e)) from e
+        return str(blob.generation)
+
+
+class GCSLogBackend(_GCSSidecars, LogStructuredBackend):
+    """Snapshot blob plus one small blob per change under "<blob name>.log/".
+
+    The last sequence number folded into the snapshot is kept in the snapshot's custom metadata,
+    so it can be read with the same metadata-only request as the generation.
+    """
+
+    def __init__(self, client: storage.Client, bucket_name: str, blob_name: str, max_attempts: int = 5, compress: bool = False):
+        super().__init__(max_attempts, compress)
+        self.client = client
+        self.bucket = client.bucket(bucket_name)
+        self.bucket_name = bucket_name
+        self.blob_name = blob_name
+        self.log_prefix = f"{blob_name}.log/"
+
+    def describe(self) -> str:
+        return f"gs://{self.bucket_name}/{self.blob_name} (+ {self.log_prefix})"
+
+    def _log_blob_name(self, seq: int) -> str:
+        return f"{self.log_prefix}{seq:012d}.json"
+
+    def _snapshot_info(self) -> Tuple[int, int]:
+        blob = self.bucket.get_blob(self.blob_name)
+        if blob is None:
+            return 0, 0
+        return blob.generation, int((blob.metadata or {}).get(_LOG_SEQ_METADATA_KEY, 0))
+
+    def _read_snapshot(self, generation: int) -> Optional[bytes]:
+        try:
+            return _download(self.bucket.blob(self.blob_name), if_generation_match=generation)
+        except (gcs_exceptions.PreconditionFailed, gcs_exceptions.NotFound) as e:
+            raise PreconditionFailedError(str(e)) from e
+
+    def _write_snapshot(self, data: bytes, log_seq: int, if_generation_match: int) -> int:
+        blob = self.bucket.blob(self.blob_name)
+        blob.metadata = {_LOG_SEQ_METADATA_KEY: str(log_seq)}
+        try:
+            _upload(blob, data, if_generation_match=if_generation_match)
+        except gcs_exceptions.PreconditionFailed as e:
+            raise PreconditionFailedError(str(e)) from e
+        return blob.generation
+
+    def _list_log(self) -> List[int]:
+        seqs = []
+        for blob in self.client.list_blobs(self.bucket, prefix=self.log_prefix):
+            name = blob.name[len(self.log_prefix):]
+            if name.endswith(".json") and name[:-len(".json")].isdigit():
+                seqs.append(int(name[:-len(".json")]))
+        return sorted(seqs)
+
+    def _read_log_entry(self, seq: int) -> Optional[bytes]:
+        try:
+            return _download(self.bucket.blob(self._log_blob_name(seq)))
+        except gcs_exceptions.NotFound:
+            return None
+
+    def _create_log_entry(self, seq: int, data: bytes) -> None:
+        try:
+            # if_generation_match=0: only succeeds if no entry with this number exists yet
+            _upload(self.bucket.blob(self._log_blob_name(seq)), data, if_generation_match=0)
+        except gcs_exceptions.PreconditionFailed as e:
+            raise PreconditionFailedError(f"Log entry {seq} already exists") from e
+
+    def _delete_log_entry(self, seq: int) -> None:
+        try:
+            self.bucket.delete_blob(self._log_blob_name(seq))
+        except gcs_exceptions.NotFound:
+            pass
@@ -0,0 +1,127 @@
+import fcntl
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from app.metrics import count
+from .base import LogStructuredBackend, PreconditionFailedError
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LocalLogBackend(LogStructuredBackend):
+    """Snapshot + change log in a local directory, for development and tests without GCS.
+
+    Layout under the data directory:
+        <blob name>                 snapshot document
+        <blob name>.meta.json       {"generation": n, "log_seq": n} for the snapshot
+        <blob name>.log/<seq>.json  one file per change
+        <sidecar name>              auxiliary documents (geocode cache, travel times, ...)
+
+    Log entries are created with os.link, which fails if the target exists, giving the same
+    create-only semantics as a GCS if_generation_match=0 upload. Snapshot swaps happen under an
+    exclusive flock so the snapshot and its metadata always change together across processes.
+    """
+
+    def __init__(self, data_dir: str, blob_name: str, max_attempts: int = 5, compress: bool = False):
+        super().__init__(max_attempts, compress)
+        self.data_dir = data_dir
+        self.blob_name = blob_name
+        self.snapshot_path = os.path.join(data_dir, blob_name)
+        self.meta_path = os.path.join(data_dir, f"{blob_name}.meta.json")
+        self.log_dir = os.path.join(data_dir, f"{blob_name}.log")
+        self.lock_path = os.path.join(data_dir, f".{blob_name}.lock")
+        os.makedirs(self.log_dir, exist_ok=True)
+
+    def describe(self) -> str:
+        return f"{self.snapshot_path} (+ {self.log_dir}/)"
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        count("storage_bytes_written", len(data), backend="local")
+
+    def _read_file(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        count("storage_bytes_read", len(data), backend="local")
+        return data
+
+    def _read_meta(self) -> Tuple[int, int]:
+        try:
+            with open(self.meta_path, "rb") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return 0, 0
+        return int(meta["generation"]), int(meta["log_seq"])
+
+    def _log_path(self, seq: int) -> str:
+        return os.path.join(self.log_dir, f"{seq:012d}.json")
+
+    def _snapshot_info(self) -> Tuple[int, int]:
+        with self._locked(exclusive=False):
+            return self._read_meta()
+
+    def _read_snapshot(self, generation: int) -> Optional[bytes]:
+        with self._locked(exclusive=False):
+            if self._read_meta()[0] != generation:
+                raise PreconditionFailedError(f"Snapshot {self.snapshot_path} changed (expected generation {generation})")
+            return self._read_file(self.snapshot_path)
+
+    def _write_snapshot(self, data: bytes, log_seq: int, if_generation_match: int) -> int:
+        with self._locked(exclusive=True):
+            generation, _ = self._read_meta()
+            if generation != if_generation_match:
+                raise PreconditionFailedError(f"Snapshot {self.snapshot_path} is at generation {generation}, expected {if_generation_match}")
+            new_generation = generation + 1
+            self._write_atomic(self.snapshot_path, data)
+            self._write_atomic(self.meta_path, json.dumps({"generation": new_generation, "log_seq": log_seq}).encode("utf-8"))
+            return new_generation
+
+    def _list_log(self) -> List[int]:
+        return sorted(int(name[:-len(".json")]) for name in os.listdir(self.log_dir) if name.endswith(".json") and name[:-len(".json")].isdigit())
+
+    def _read_log_entry(self, seq: int) -> Optional[bytes]:
+        return self._read_file(self._log_path(seq))
+
+    def _create_log_entry(self, seq: int, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.log_dir, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.link(tmp_path, self._log_path(seq)) # Atomic, fails if the entry exists
+            count("storage_bytes_written", len(data), backend="local")
+        except FileExistsError as e:
+            raise PreconditionFailedError(f"Log entry {seq} already exists") from e
+        finally:
+            os.unlink(tmp_path)
+
+    def _delete_log_entry(self, seq: int) -> None:
+        try:
+            os.unlink(self._log_path(seq))
+        except FileNotFoundError:
+            pass
+
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        return self._read_file(os.path.join(self.data_dir, name))
+
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        path = os.path.join(self.data_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True) # Names may contain "/" (e.g. travel_times/<origin>.json)
+        self._write_atomic(path, data)
@@ -0,0 +1,171 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from .storage import load_sidecar_json, save_sidecar_json
+import logging
+
+logger = logging.getLogger(__name__)
+
+LatLng = Tuple[float, float]
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_COMMA_RE = re.compile(r"\s*,\s*")
+
+
+def normalise_address(address: str) -> str:
+    """Normalises an address for use as a cache key ("12  Main St ,Wellington." -> "12 main st, wellington")."""
+    normalised = unicodedata.normalize("NFKC", address).casefold()
+    normalised = _WHITESPACE_RE.sub(" ", normalised)
+    normalised = _COMMA_RE.sub(", ", normalised)
+    return normalised.strip(" ,.;")
+
+
+def _get_max_entries() -> int:
+    return int(os.environ.get("GEOCODE_CACHE_MAX_ENTRIES", "10000"))
+
+def _get_ttl_seconds() -> float:
+    return float(os.environ.get("GEOCODE_CACHE_TTL_SECONDS", str(30 * 24 * 3600))) # 30 days
+
+def _get_blob_name() -> str:
+    return os.environ.get("GCS_GEOCODE_CACHE_BLOB_NAME", "geocode_cache.json")
+
+def _get_local_path() -> Optional[str]:
+    # When set, the persisted tier is a local file instead of a blob next to locations.json
+    return os.environ.get("GEOCODE_CACHE_PATH") or None
+
+
+class GeocodeCache:
+    """Two-tier geocode cache: an in-memory LRU backed by a persisted JSON document.
+
+    Entries are keyed by normalise_address() and expire after a TTL. The persisted tier is
+    loaded lazily on first use and written back by flush() when new entries were added.
+    Only successful geocodes are cached, so a temporarily unresolvable address is retried.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, blob_name: str, local_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.blob_name = blob_name
+        self.local_path = local_path
+        self._entries: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict() # key -> (lat, lng, stored_at)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One read-merge-write at a time, so an older copy never lands last
+        self._loaded = False
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def _read_persisted(self) -> Dict[str, List[float]]:
+        if self.local_path:
+            if not os.path.exists(self.local_path):
+                return {}
+            with open(self.local_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return load_sidecar_json(self.blob_name) or {}
+
+    def _write_persisted(self, data: Dict[str, List[float]]) -> None:
+        if self.local_path:
+            # A unique temp file per write: flushes from several storage threads can overlap
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.local_path)), prefix=".tmp-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.local_path)
+        else:
+            save_sidecar_json(self.blob_name, data)
+
+    def _merge(self, persisted: Dict[str, List[float]]) -> None:
+        # Caller holds the lock. Newer entries win; oldest entries go first when trimming.
+        now = time.time()
+        for key, (lat, lng, stored_at) in sorted(persisted.items(), key=lambda item: item[1][2]):
+            if now - stored_at > self.ttl_seconds:
+                continue
+            current = self._entries.get(key)
+            if current is None or current[2] < stored_at:
+                self._entries[key] = (lat, lng, stored_at)
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def ensure_loaded(self) -> None:
+        """Loads the persisted tier (once). Does blocking I/O, so async callers run it in a thread."""
+        if self._loaded:
+            return
+        try:
+            persisted = self._read_persisted()
+        except Exception as e:
+            logger.error(f"Error loading persisted geocode cache: {e}", exc_info=True)
+            persisted = {}
+        with self._lock:
+            if not self._loaded:
+                self._merge(persisted)
+                self._loaded = True
+                logger.info(f"Loaded {len(self._entries)} geocode cache entries.")
+
+    def get(self, address: str) -> Optional[LatLng]:
+        self.ensure_loaded()
+        key = normalise_address(address)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry[2] > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, address: str, coords: LatLng) -> None:
+        self.ensure_loaded()
+        key = normalise_address(address)
+        with self._lock:
+            self._entries[key] = (coords[0], coords[1], time.time())
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+
+    def flush(self) -> None:
+        """Writes the cache to the persisted tier if anything was added since the last flush."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        try:
+            with self._flush_lock:
+                # Merge with what other instances may have persisted in the meantime
+                persisted = self._read_persisted()
+                with self._lock:
+                    self._merge(persisted)
+                    data = {key: [lat, lng, stored_at] for key, (lat, lng, stored_at) in self._entries.items()}
+                self._write_persisted(data)
+            logger.info(f"Persisted {len(data)} geocode cache entries.")
+        except Exception as e:
+            with self._lock:
+                self._dirty = True
+            logger.error(f"Error persisting geocode cache: {e}", exc_info=True)
+
+
+_geocode_cache: Optional[GeocodeCache] = None
+_geocode_cache_lock = threading.Lock()
+
+def get_geocode_cache() -> GeocodeCache:
+    global _geocode_cache
+    if _geocode_cache is None:
+        with _geocode_cache_lock:
+            if _geocode_cache is None:
+                _geocode_cache = GeocodeCache(_get_max_entries(), _get_ttl_seconds(), _get_blob_name(), _get_local_path())
+    return _geocode_cache
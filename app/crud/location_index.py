@@ -0,0 +1,112 @@
+import math
+import os
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from app.models.location import LocationModel
+from app.services.prefilter import EARTH_RADIUS_KM
+
+LatLng = Tuple[float, float]
+
+
+def _get_cell_degrees() -> float:
+    # Spatial grid cell size; 0.1 degrees is ~11 km north-south
+    return float(os.environ.get("LOCATION_INDEX_CELL_DEGREES", "0.1"))
+
+
+def distance_km(a: LatLng, b: LatLng) -> float:
+    """Great-circle (haversine) distance between two lat/lng points."""
+    lat1, lat2 = math.radians(a[0]), math.radians(b[0])
+    h = math.sin((lat2 - lat1) / 2.0) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(b[1] - a[1]) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, h)))
+
+
+def _lng_in_range(lng: float, west: float, east: float) -> bool:
+    # west > east means the range crosses the antimeridian (e.g. 170 -> -175)
+    return west <= lng <= east if west <= east else lng >= west or lng <= east
+
+
+class LocationIndex:
+    """Read-only indexes over one version of the location catalogue.
+
+    by_id is a UUID -> location hash index. Located records are also bucketed into a uniform
+    lat/lng grid (LOCATION_INDEX_CELL_DEGREES), so radius and bounding-box queries only look at
+    the cells that overlap the query area. Longitude cells wrap at the antimeridian.
+    A new index is built for every catalogue version, so it never goes stale.
+    """
+
+    def __init__(self, locations: Sequence[LocationModel], cell_degrees: Optional[float] = None):
+        self.cell_degrees = cell_degrees or _get_cell_degrees()
+        self._lng_cell_count = math.ceil(360.0 / self.cell_degrees)
+        self.by_id: Dict[uuid.UUID, LocationModel] = {}
+        self._cells: Dict[Tuple[int, int], List[LocationModel]] = defaultdict(list)
+        self._located: List[LocationModel] = []
+        for loc in locations:
+            self.by_id[loc.id] = loc
+            if loc.latitude is not None and loc.longitude is not None:
+                self._cells[self._cell(loc.latitude, loc.longitude)].append(loc)
+                self._located.append(loc)
+        self._cells = dict(self._cells)
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def get(self, location_id: uuid.UUID) -> Optional[LocationModel]:
+        return self.by_id.get(location_id)
+
+    def _lat_cell(self, lat: float) -> int:
+        return math.floor((lat + 90.0) / self.cell_degrees)
+
+    def _lng_cell(self, lng: float) -> int:
+        return math.floor((lng + 180.0) / self.cell_degrees) % self._lng_cell_count
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return self._lat_cell(lat), self._lng_cell(lng)
+
+    def _candidates(self, south: float, west: float, north: float, east: float) -> Iterable[LocationModel]:
+        # Locations in every grid cell overlapping the box (west > east wraps the antimeridian)
+        lat_cells = range(self._lat_cell(max(-90.0, south)), self._lat_cell(min(90.0, north)) + 1)
+        first_lng, last_lng = self._lng_cell(west), self._lng_cell(east)
+        lng_span = (last_lng - first_lng) % self._lng_cell_count + 1
+        if west <= east and east - west >= 360.0 - self.cell_degrees:
+            lng_span = self._lng_cell_count
+        if len(lat_cells) * lng_span > len(self._cells):
+            return self._located # Fewer occupied cells than cells to probe: just scan everything
+        lng_cells = [(first_lng + i) % self._lng_cell_count for i in range(lng_span)]
+        return (loc for lat_cell in lat_cells for lng_cell in lng_cells for loc in self._cells.get((lat_cell, lng_cell), ()))
+
+    def within_radius(self, center: LatLng, radius_km: float, limit: Optional[int] = None) -> List[Tuple[LocationModel, float]]:
+        """Locations within radius_km of center as (location, distance km), nearest first."""
+        angular = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(angular)
+        south, north = center[0] - dlat, center[0] + dlat
+        cos_lat = math.cos(math.radians(center[0]))
+        if south <= -90.0 or north >= 90.0 or math.sin(angular) >= cos_lat:
+            west, east = -180.0, 180.0 # Circle reaches a pole or spans every longitude
+        else:
+            dlng = math.degrees(math.asin(math.sin(angular) / cos_lat))
+            west = (center[1] - dlng + 180.0) % 360.0 - 180.0
+            east = (center[1] + dlng + 180.0) % 360.0 - 180.0
+
+        matches = []
+        for loc in self._candidates(south, west, north, east):
+            distance = distance_km(center, (loc.latitude, loc.longitude))
+            if distance <= radius_km:
+                matches.append((loc, distance))
+        matches.sort(key=lambda match: match[1])
+        return matches[:limit] if limit is not None else matches
+
+    def within_bbox(self, south: float, west: float, north: float, east: float, center: Optional[LatLng] = None, limit: Optional[int] = None) -> List[Tuple[LocationModel, float]]:
+        """Locations inside the box as (location, distance km from center), nearest first.
+
+        center defaults to the middle of the box. west > east selects a box across the antimeridian.
+        """
+        if center is None:
+            width = (east - west) % 360.0 if west != east else 0.0
+            center = ((south + north) / 2.0, (west + width / 2.0 + 180.0) % 360.0 - 180.0)
+        matches = []
+        for loc in self._candidates(south, west, north, east):
+            if south <= loc.latitude <= north and _lng_in_range(loc.longitude, west, east):
+                matches.append((loc, distance_km(center, (loc.latitude, loc.longitude))))
+        matches.sort(key=lambda match: match[1])
+        return matches[:limit] if limit is not None else matches
@@ -1,15 +1,37 @@
 import uuid
-from typing import List, Optional
-from app.models.location import LocationModel, LocationCreate, LocationUpdate
-from .storage import load_locations_from_gcs, save_locations_to_gcs
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from app.models.location import LocationModel, LocationCreate, LocationUpdate, LocationBatchUpdate
+from .location_index import LocationIndex
+from app.services.prefilter import CoordinateTable
+from .storage import apply_location_changes_async, load_location_coordinates_async, load_location_index_async, load_locations_async, load_locations_with_version_async, run_storage_io
+from .travel_times import get_travel_time_store
 import logging
 
 logger = logging.getLogger(__name__)
 
-def create_location(location_data: LocationCreate) -> LocationModel:
-    locations = load_locations_from_gcs()
+# Changing any of these moves the location, so stored driving times to it are no longer valid
+_ROUTING_FIELDS = {"latitude", "longitude", "address"}
 
-    new_location = LocationModel(
+def _invalidate_travel_times_sync(location_ids: Iterable[uuid.UUID]) -> None:
+    travel_times = get_travel_time_store()
+    for location_id in location_ids:
+        travel_times.invalidate_location(location_id)
+    travel_times.flush()
+
+async def _invalidate_travel_times(*location_ids: uuid.UUID) -> None:
+    if not location_ids:
+        return
+    try:
+        await run_storage_io(_invalidate_travel_times_sync, location_ids)
+    except Exception as e:
+        logger.error(f"Error invalidating stored travel times for location IDs {list(location_ids)}: {e}", exc_info=True)
+
+def _patch(location_id: uuid.UUID, **changes: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    # A field patch for apply_location_changes (see backends.base.Patch); empty parts are left out
+    return {"id": str(location_id), **{part: fields for part, fields in changes.items() if fields}}
+
+def _new_location(location_data: LocationCreate) -> LocationModel:
+    return LocationModel(
         id=uuid.uuid4(), # Generate new ID here
         name=location_data.name,
         address=location_data.address,
@@ -19,64 +41,169 @@ def create_location(location_data: LocationCreate) -> LocationModel:
         enrichment_data={} # Initialize empty enrichment data
     )
 
-    locations.append(new_location)
-    save_locations_to_gcs(locations)
+async def create_location(location_data: LocationCreate) -> LocationModel:
+    new_location = _new_location(location_data)
+
+    await apply_location_changes_async(upserts=[new_location])
     logger.info(f"Created new location with ID: {new_location.id} and name: {new_location.name}")
     return new_location
 
-def get_all_locations() -> List[LocationModel]:
+async def get_all_locations() -> List[LocationModel]:
     logger.debug("Fetching all locations.")
-    return load_locations_from_gcs()
-
-def get_location_by_id(location_id: uuid.UUID) -> Optional[LocationModel]:
-    locations = load_locations_from_gcs()
-    for loc in locations:
-        if loc.id == location_id:
-            logger.debug(f"Found location with ID: {location_id}")
-            return loc
+    return await load_locations_async()
+
+async def get_all_locations_with_version() -> Tuple[List[LocationModel], Optional[str]]:
+    """All locations plus the storage version they were read at (None if nothing is stored yet)."""
+    logger.debug("Fetching all locations with storage version.")
+    return await load_locations_with_version_async()
+
+async def get_location_index() -> LocationIndex:
+    """The id hash index and spatial grid over the current catalogue version."""
+    return await load_location_index_async()
+
+async def get_location_coordinates() -> CoordinateTable:
+    """Coordinates of the located records in the current catalogue version, packed for the prefilter."""
+    return await load_location_coordinates_async()
+
+async def get_location_by_id(location_id: uuid.UUID) -> Optional[LocationModel]:
+    loc = (await load_location_index_async()).get(location_id)
+    if loc is not None:
+        logger.debug(f"Found location with ID: {location_id}")
+        return loc
     logger.debug(f"Location with ID: {location_id} not found.")
     return None
 
-def update_location(location_id: uuid.UUID, location_update_data: LocationUpdate) -> Optional[LocationModel]:
-    locations = load_locations_from_gcs()
-    location_to_update = None
-    updated = False
-
-    for i, loc in enumerate(locations):
-        if loc.id == location_id:
-            location_to_update = loc
-            # Pydantic's model_copy(update=...) is great for this
-            update_data_dict = location_update_data.model_dump(exclude_unset=True)
-            if update_data_dict: # Check if there's anything to update
-                locations[i] = location_to_update.model_copy(update=update_data_dict)
-                updated = True
-                logger.info(f"Updating location with ID: {location_id}. Changes: {update_data_dict}")
-            else:
-                logger.info(f"No update data provided for location ID: {location_id}.")
-            break
-
-    if location_to_update and updated:
-        save_locations_to_gcs(locations)
-        logger.info(f"Successfully updated location with ID: {location_id}")
-        return locations[i] # Return the updated model
-    elif location_to_update and not updated:
+async def update_location(location_id: uuid.UUID, location_update_data: LocationUpdate) -> Optional[LocationModel]:
+    location_to_update = (await load_location_index_async()).get(location_id)
+    if location_to_update is None:
+        logger.warning(f"Update failed: Location with ID {location_id} not found.")
+        return None
+
+    update_data_dict = location_update_data.model_dump(mode="json", exclude_unset=True)
+    if not update_data_dict: # Check if there's anything to update
         logger.info(f"Location with ID: {location_id} found, but no update data provided.")
         return location_to_update # Return the original model if no changes were made
 
-    logger.warning(f"Update failed: Location with ID {location_id} not found.")
-    return None
-
-def delete_location(location_id: uuid.UUID) -> bool:
-    locations = load_locations_from_gcs()
-    initial_count = len(locations)
-
-    # Filter out the location to be deleted
-    locations_after_deletion = [loc for loc in locations if loc.id != location_id]
+    logger.info(f"Updating location with ID: {location_id}. Changes: {update_data_dict}")
+    # Only the changed fields are written, onto the record as stored at write time
+    updated_location = (await apply_location_changes_async(patches=[_patch(location_id, set=update_data_dict)])).get(location_id)
+    if updated_location is None:
+        logger.warning(f"Update failed: Location with ID {location_id} was deleted concurrently.")
+        return None
+    if _ROUTING_FIELDS & update_data_dict.keys():
+        await _invalidate_travel_times(location_id)
+    logger.info(f"Successfully updated location with ID: {location_id}")
+    return updated_location
 
-    if len(locations_after_deletion) < initial_count:
-        save_locations_to_gcs(locations_after_deletion)
+async def delete_location(location_id: uuid.UUID) -> bool:
+    if (await load_location_index_async()).get(location_id) is not None:
+        await apply_location_changes_async(deletes=[location_id])
+        await _invalidate_travel_times(location_id)
         logger.info(f"Successfully deleted location with ID: {location_id}")
         return True
 
     logger.warning(f"Delete failed: Location with ID {location_id} not found.")
     return False
+
+async def set_location_coordinates(coordinates: Dict[uuid.UUID, Tuple[float, float]]) -> int:
+    """Writes resolved coordinates back for many locations as a single change.
+
+    Only locations that still have no coordinates are touched, so coordinates set by a user
+    in the meantime are never overwritten. Returns the number of locations updated.
+    """
+    if not coordinates:
+        return 0
+
+    # The cached index only skips pointless writes; the "still missing" check is part of the patch
+    index = await load_location_index_async()
+    patches = []
+    for location_id, coords in coordinates.items():
+        loc = index.get(location_id)
+        if loc is None or (loc.latitude is not None and loc.longitude is not None):
+            continue
+        patches.append(_patch(location_id, fill={"latitude": coords[0], "longitude": coords[1]}))
+    if not patches:
+        return 0
+
+    stored = await apply_location_changes_async(patches=patches)
+    updated = sum(1 for location_id, loc in stored.items() if (loc.latitude, loc.longitude) == tuple(coordinates[location_id]))
+    logger.info(f"Saved resolved coordinates for {updated} locations.")
+    return updated
+
+async def apply_enrichment_results(results: Dict[uuid.UUID, Tuple[str, Optional[Tuple[float, float]], Dict[str, Any]]]) -> int:
+    """Writes background enrichment results back for many locations as a single change.
+
+    `results` maps location id -> (address the work was done for, coordinates or None,
+    enrichment_data entries to merge). Results for a location whose address has changed since
+    are dropped, and, as in set_location_coordinates, coordinates are only set if still missing.
+    Returns the number of locations updated.
+    """
+    if not results:
+        return 0
+
+    # As in set_location_coordinates, the conditions are part of the patches and checked at write time
+    index = await load_location_index_async()
+    patches = []
+    for location_id, (address, coords, enrichment) in results.items():
+        loc = index.get(location_id)
+        if loc is None or loc.address != address:
+            continue
+        fill = {"latitude": coords[0], "longitude": coords[1]} if coords is not None else None
+        if fill or enrichment:
+            patches.append(_patch(location_id, fill=fill, merge={"enrichment_data": enrichment} if enrichment else None, expect={"address": address}))
+    if not patches:
+        return 0
+
+    stored = await apply_location_changes_async(patches=patches)
+    updated = sum(1 for location_id, loc in stored.items() if loc.address == results[location_id][0])
+    logger.info(f"Saved enrichment results for {updated} locations.")
+    return updated
+
+async def create_locations(locations_data: List[LocationCreate]) -> List[LocationModel]:
+    """Creates many locations as a single storage write."""
+    new_locations = [_new_location(location_data) for location_data in locations_data]
+    await apply_location_changes_async(upserts=new_locations)
+    logger.info(f"Created {len(new_locations)} new locations in one batch.")
+    return new_locations
+
+async def update_locations(updates: List[LocationBatchUpdate]) -> List[Optional[LocationModel]]:
+    """Applies many partial updates with one read and one write.
+
+    Returns, per input item, the location as stored after the batch, or None if the ID wasn't found
+    (or the location was deleted concurrently). Several updates to the same ID are applied in order.
+    """
+    current = (await load_location_index_async()).by_id
+    patches = []
+    moved = set()
+    for update in updates:
+        update_data_dict = update.model_dump(mode="json", exclude_unset=True, exclude={"id"})
+        if update.id in current and update_data_dict:
+            patches.append(_patch(update.id, set=update_data_dict))
+            if _ROUTING_FIELDS & update_data_dict.keys():
+                moved.add(update.id)
+
+    stored = await apply_location_changes_async(patches=patches) if patches else {}
+    patched_ids = {uuid.UUID(patch["id"]) for patch in patches}
+    results = [stored.get(update.id) if update.id in patched_ids else current.get(update.id) for update in updates]
+    if patches:
+        await _invalidate_travel_times(*(location_id for location_id in moved if location_id in stored))
+    logger.info(f"Batch update: {len(stored)} locations changed, {results.count(None)} IDs not found.")
+    return results
+
+async def delete_locations(location_ids: List[uuid.UUID]) -> List[bool]:
+    """Deletes many locations with one read and one write. Returns, per input ID, whether it was deleted."""
+    existing = set((await load_location_index_async()).by_id)
+    results = []
+    to_delete = []
+    for location_id in location_ids:
+        found = location_id in existing
+        results.append(found)
+        if found:
+            existing.discard(location_id) # A repeated ID is only deleted once
+            to_delete.append(location_id)
+
+    if to_delete:
+        await apply_location_changes_async(deletes=to_delete)
+        await _invalidate_travel_times(*to_delete)
+    logger.info(f"Batch delete: {len(to_delete)} locations deleted, {len(location_ids) - len(to_delete)} not found.")
+    return results
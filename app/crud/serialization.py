@@ -0,0 +1,28 @@
+from typing import Any, Dict, List, Optional, Sequence, Set
+from pydantic import TypeAdapter
+from app.metrics import timed
+from app.models.location import LocationModel
+
+Record = Dict[str, Any]
+
+# One adapter for the whole list: pydantic-core validates / serialises it in a single call
+# instead of a Python-level loop over model_validate / model_dump.
+_locations_adapter = TypeAdapter(List[LocationModel])
+
+
+def locations_from_records(records: List[Record]) -> List[LocationModel]:
+    """Validates stored records into LocationModels in bulk."""
+    with timed("parse"):
+        return _locations_adapter.validate_python(records)
+
+
+def locations_to_records(locations: Sequence[LocationModel]) -> List[Record]:
+    """JSON-compatible records for storage, in bulk (UUIDs as strings etc.)."""
+    with timed("serialize"):
+        return _locations_adapter.dump_python(list(locations), mode="json")
+
+
+def locations_to_json(locations: Sequence[LocationModel], include: Optional[Set[str]] = None) -> bytes:
+    """Serialises locations straight to a JSON array, optionally projected to some fields."""
+    with timed("serialize"):
+        return _locations_adapter.dump_json(list(locations), include={"__all__": include} if include else None)
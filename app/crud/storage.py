@@ -1,20 +1,76 @@
-import json
 import os
-from typing import List, Dict, Any
-from google.cloud import storage
+import threading
+import time
+import uuid
+from functools import partial
+from typing import TYPE_CHECKING, Callable, List, Dict, Any, Iterable, Optional, Tuple, TypeVar
+import anyio
 from app.models.location import LocationModel
+from app.metrics import count, timed
+from app.singleflight import SingleFlight
+from app.services.prefilter import CoordinateTable
+from .location_index import LocationIndex
+from .serialization import locations_from_records, locations_to_records
+from .backends.base import LocationStorageBackend, Patch, PreconditionFailedError, apply_patch_to_record, decode_document, encode_json, retry_on_precondition
 import logging
 
+if TYPE_CHECKING:
+    from google.cloud import storage # Imported when the first client is created (keeps cold starts fast)
+
 logger = logging.getLogger(__name__)
 
 _gcs_client = None
 
-def _get_gcs_client() -> storage.Client:
+def _get_gcs_http_pool_size() -> int:
+    return int(os.environ.get("GCS_HTTP_POOL_SIZE", "32"))
+
+def _get_read_coalesce_timeout_seconds() -> float:
+    # Upper bound on a shared snapshot read (see _load_snapshot_async)
+    return float(os.environ.get("SINGLEFLIGHT_STORAGE_TIMEOUT_SECONDS", "30"))
+
+def _get_storage_io_concurrency() -> int:
+    # Blocking storage calls run on their own bounded worker threads, not Starlette's shared pool
+    return int(os.environ.get("STORAGE_IO_CONCURRENCY", "16"))
+
+def _create_gcs_client() -> "storage.Client":
+    # A long-lived authorized session whose connection pool is sized for the storage worker
+    # threads (requests' default of 10 connections would otherwise serialise them).
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    credentials, project = google.auth.default(scopes=["https://www.googleapis.com/auth/devstorage.read_write"])
+    session = AuthorizedSession(credentials)
+    pool_size = _get_gcs_http_pool_size()
+    session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return storage.Client(project=os.environ.get("GCP_PROJECT_ID") or project, credentials=credentials, _http=session)
+
+def _get_gcs_client() -> "storage.Client":
     global _gcs_client
     if _gcs_client is None:
-        _gcs_client = storage.Client()
+        _gcs_client = _create_gcs_client()
     return _gcs_client
 
+def close_gcs_client() -> None:
+    """Closes the pooled GCS HTTP session (called on shutdown)."""
+    global _gcs_client
+    if _gcs_client is not None:
+        _gcs_client.close()
+        _gcs_client = None
+        logger.info("Closed GCS client.")
+
+_io_limiter: Optional[anyio.CapacityLimiter] = None
+
+T = TypeVar("T")
+
+async def run_storage_io(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Runs a blocking storage call on the dedicated storage worker threads."""
+    global _io_limiter
+    if _io_limiter is None:
+        _io_limiter = anyio.CapacityLimiter(_get_storage_io_concurrency())
+    return await anyio.to_thread.run_sync(partial(func, *args, **kwargs), limiter=_io_limiter)
+
 def _get_bucket_name() -> str:
     bucket_name = os.environ.get("GCS_BUCKET_NAME")
     if not bucket_name:
@@ -29,55 +85,366 @@ def _get_data_blob_name() -> str:
         raise ValueError("GCS_DATA_BLOB_NAME not set effectively")
     return blob_name
 
-def load_locations_from_gcs() -> List[LocationModel]:
-    client = _get_gcs_client()
-    bucket_name = _get_bucket_name()
-    blob_name = _get_data_blob_name()
+def _get_backend_name() -> str:
+    # "gcs": single JSON blob (default) | "gcs-log": snapshot + change log in GCS | "local-log": same, on local disk
+    return os.environ.get("LOCATIONS_STORAGE_BACKEND", "gcs")
+
+def _get_local_data_dir() -> str:
+    return os.environ.get("LOCAL_STORAGE_DIR", "./data")
+
+def _get_write_max_attempts() -> int:
+    return int(os.environ.get("LOCATIONS_WRITE_MAX_ATTEMPTS", "5"))
+
+def _get_compact_threshold() -> int:
+    # Number of appended changes after which a background compaction is started
+    return int(os.environ.get("LOCATIONS_LOG_COMPACT_THRESHOLD", "100"))
+
+def _get_storage_format() -> str:
+    # "json" (default) or "json-gzip"; reads auto-detect either, so this can be switched at any time
+    return os.environ.get("LOCATIONS_STORAGE_FORMAT", "json").lower()
+
+def _compress_storage() -> bool:
+    storage_format = _get_storage_format()
+    if storage_format not in ("json", "json-gzip"):
+        raise ValueError(f"Unknown LOCATIONS_STORAGE_FORMAT: {storage_format}")
+    return storage_format == "json-gzip"
+
+def _get_cache_ttl_seconds() -> float:
+    # How long a cached snapshot is trusted before a (metadata-only) version check.
+    # 0 means revalidate on every read; a negative value disables the cache entirely.
+    return float(os.environ.get("LOCATIONS_CACHE_TTL_SECONDS", "5"))
+
+
+_backend: Optional[LocationStorageBackend] = None
+_backend_lock = threading.Lock()
+
+def _create_backend() -> LocationStorageBackend:
+    backend_name = _get_backend_name()
+    max_attempts = _get_write_max_attempts()
+    if backend_name == "gcs":
+        from .backends.gcs import GCSSnapshotBackend
+        return GCSSnapshotBackend(_get_gcs_client(), _get_bucket_name(), _get_data_blob_name(), _compress_storage())
+    if backend_name == "gcs-log":
+        from .backends.gcs import GCSLogBackend
+        return GCSLogBackend(_get_gcs_client(), _get_bucket_name(), _get_data_blob_name(), max_attempts, _compress_storage())
+    if backend_name == "local-log":
+        from .backends.local import LocalLogBackend
+        return LocalLogBackend(_get_local_data_dir(), _get_data_blob_name(), max_attempts, _compress_storage())
+    logger.error(f"Unknown LOCATIONS_STORAGE_BACKEND: {backend_name}")
+    raise ValueError(f"Unknown LOCATIONS_STORAGE_BACKEND: {backend_name}")
+
+def get_storage_backend() -> LocationStorageBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+                logger.info(f"Using location storage backend {type(_backend).__name__}: {_backend.describe()}")
+    return _backend
+
+def set_storage_backend(backend: Optional[LocationStorageBackend]) -> None:
+    """Replaces the storage backend (None: recreate from the environment on next use)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    invalidate_locations_cache()
+
+
+class _LocationSnapshot:
+    """Parsed locations together with the backend version they came from."""
+
+    def __init__(self, backend: LocationStorageBackend, locations: List[LocationModel], version: Optional[str]):
+        self.backend = backend
+        self.locations = locations
+        self.version = version # None means nothing is stored yet (empty catalogue)
+        self.checked_at = time.monotonic()
+        self._index: Optional[LocationIndex] = None
+        self._coordinates: Optional[CoordinateTable] = None
+
+    @property
+    def index(self) -> LocationIndex:
+        # Built on first use and shared by every reader of this version; a write creates a new snapshot
+        if self._index is None:
+            started = time.monotonic()
+            self._index = LocationIndex(self.locations)
+            logger.debug(f"Built location index over {len(self.locations)} locations in {(time.monotonic() - started) * 1000:.1f}ms.")
+        return self._index
+
+    @property
+    def coordinates(self) -> CoordinateTable:
+        # Located records as one contiguous array for the vectorised prefilter; built on first use like the index
+        if self._coordinates is None:
+            located = [loc for loc in self.locations if loc.latitude is not None and loc.longitude is not None]
+            self._coordinates = CoordinateTable([loc.id for loc in located], [(loc.latitude, loc.longitude) for loc in located])
+        return self._coordinates
+
+
+_snapshot: Optional[_LocationSnapshot] = None
+_snapshot_epoch = 0 # Bumped by every write, so a slow reader can't replace a newer snapshot
+_snapshot_lock = threading.Lock()
+_appends_since_compaction = 0
+# Serialises this process's single-blob read-modify-writes; the generation precondition then only
+# has to resolve conflicts with other instances instead of every concurrent request here.
+_write_lock = threading.Lock()
+
+
+def snapshot_epoch() -> int:
+    """Number of local writes (and invalidations) so far; results computed before a write carry an older value."""
+    with _snapshot_lock:
+        return _snapshot_epoch
+
+
+def invalidate_locations_cache() -> None:
+    global _snapshot, _snapshot_epoch
+    with _snapshot_lock:
+        _snapshot = None
+        _snapshot_epoch += 1
+    logger.debug("Location snapshot cache invalidated.")
+
 
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
+def _store_snapshot(backend: LocationStorageBackend, locations: List[LocationModel], version: Optional[str], read_epoch: Optional[int] = None) -> _LocationSnapshot:
+    global _snapshot, _snapshot_epoch
+    snapshot = _LocationSnapshot(backend, locations, version)
+    with _snapshot_lock:
+        if read_epoch is None:
+            _snapshot_epoch += 1
+        elif read_epoch != _snapshot_epoch:
+            return snapshot # A write happened while we were reading; keep the writer's snapshot
+        _snapshot = snapshot
+    return snapshot
+
+
+def _count(stat: str) -> None:
+    count("locations_cache", result=stat)
+
+
+def _load_snapshot() -> _LocationSnapshot:
+    backend = get_storage_backend()
+    ttl = _get_cache_ttl_seconds()
+
+    with _snapshot_lock:
+        snapshot = _snapshot if ttl >= 0 else None
+        read_epoch = _snapshot_epoch
+    if snapshot is not None and snapshot.backend is not backend:
+        snapshot = None
+
+    if snapshot is not None:
+        if time.monotonic() - snapshot.checked_at < ttl:
+            _count("hits")
+            return snapshot
+        with timed("storage_version_check"):
+            version = backend.get_version()
+        _count("revalidations")
+        if version == snapshot.version:
+            snapshot.checked_at = time.monotonic()
+            _count("hits")
+            logger.debug(f"Location snapshot for {backend.describe()} still current (version {version}).")
+            return snapshot
+
+    _count("misses")
+    with timed("storage_read"):
+        records, version = backend.read()
+    locations = locations_from_records(records)
+    logger.info(f"Successfully loaded {len(locations)} locations from {backend.describe()} (version {version})")
+    return _store_snapshot(backend, locations, version, read_epoch)
+
+
+def _fresh_snapshot() -> Optional[_LocationSnapshot]:
+    # The cached snapshot if it can be served without contacting the backend at all
+    with _snapshot_lock:
+        snapshot = _snapshot
+    ttl = _get_cache_ttl_seconds()
+    if snapshot is not None and snapshot.backend is _backend and time.monotonic() - snapshot.checked_at < ttl:
+        _count("hits")
+        return snapshot
+    return None
+
+_snapshot_reads = SingleFlight("storage_read")
+
+async def _load_snapshot_async() -> _LocationSnapshot:
+    # Concurrent cache misses for the same storage object share one download and parse. The write
+    # epoch is part of the key, so a caller never joins a read that started before a write it saw.
+    with _snapshot_lock:
+        key = (_backend.describe() if _backend is not None else None, _snapshot_epoch)
+    return await _snapshot_reads.do(key, lambda: run_storage_io(_load_snapshot), timeout=_get_read_coalesce_timeout_seconds())
+
+async def load_locations_async() -> List[LocationModel]:
+    """Returns the stored locations, served from the in-process snapshot whenever possible.
+
+    A fresh snapshot is returned straight from memory on the event loop; only when the backend
+    actually has to be contacted does the work move to a storage worker thread. Read errors are
+    logged and give an empty list.
+
+    The returned list is a fresh shallow copy, so callers may append/remove items freely,
+    but the LocationModel instances are shared with the cache and must not be mutated in place
+    (use model_copy instead, as the CRUD layer already does).
+    """
+    snapshot = _fresh_snapshot()
+    if snapshot is None:
+        try:
+            snapshot = await _load_snapshot_async()
+        except Exception as e:
+            logger.error(f"Error loading locations: {e}", exc_info=True)
+            return [] # For robustness against transient storage errors
+    return list(snapshot.locations)
+
+async def load_location_index_async() -> LocationIndex:
+    """The id / spatial index for the current catalogue version (see LocationIndex).
+
+    Read errors propagate, so a failed read is never mistaken for an empty catalogue.
+    """
+    snapshot = _fresh_snapshot() or await _load_snapshot_async()
+    return snapshot.index
+
+async def load_location_coordinates_async() -> CoordinateTable:
+    """Coordinates of the located records in the current catalogue version (see CoordinateTable).
+
+    Read errors propagate, like load_location_index_async.
+    """
+    snapshot = _fresh_snapshot() or await _load_snapshot_async()
+    return snapshot.coordinates
+
+async def load_locations_with_version_async() -> Tuple[List[LocationModel], Optional[str]]:
+    """Returns (locations, storage version they were read at), e.g. to derive an ETag.
+
+    The version is None while nothing has been stored yet. Unlike load_locations_async,
+    read errors propagate instead of turning into an empty list.
+    """
+    snapshot = _fresh_snapshot() or await _load_snapshot_async()
+    return list(snapshot.locations), snapshot.version
+
+def _apply_to_locations(locations: List[LocationModel], upserts: List[LocationModel], deletes: Iterable[uuid.UUID], patches: Iterable[Patch] = ()) -> List[LocationModel]:
+    # Same semantics as apply_changes_to_records, on models
+    positions = {loc.id: i for i, loc in enumerate(locations)}
+    result = list(locations)
+    for loc in upserts:
+        position = positions.get(loc.id)
+        if position is None:
+            positions[loc.id] = len(result)
+            result.append(loc)
+        else:
+            result[position] = loc
+    for patch in patches:
+        position = positions.get(uuid.UUID(str(patch["id"])))
+        if position is None:
+            continue
+        record = result[position].model_dump(mode="json")
+        patched = apply_patch_to_record(record, patch)
+        if patched is not record:
+            result[position] = LocationModel.model_validate(patched)
+    deleted = set(deletes)
+    if deleted:
+        result = [loc for loc in result if loc.id not in deleted]
+    return result
+
+
+def _patched_locations(locations: List[LocationModel], patches: List[Patch]) -> Dict[uuid.UUID, LocationModel]:
+    patched_ids = {uuid.UUID(str(patch["id"])) for patch in patches}
+    return {loc.id: loc for loc in locations if loc.id in patched_ids}
+
+
+def apply_location_changes(upserts: Iterable[LocationModel] = (), deletes: Iterable[uuid.UUID] = (), patches: Iterable[Patch] = ()) -> Dict[uuid.UUID, LocationModel]:
+    """Durably applies record-level changes: upserts (by id), field patches and deletes.
+
+    Patches (see backends.base.Patch) are applied to the stored record as it is at write time,
+    so they keep concurrent changes to other fields and never bring back a deleted location.
+    Returns the patched locations as stored after the write; ones that no longer exist are missing.
+
+    Log-structured backends append a single small change record. The single-blob backend does a
+    read-modify-write guarded by the blob generation and retries when another instance got there
+    first, re-applying the changes to what it re-read, so concurrent changes are never lost.
+    Writes from this process take turns (_write_lock), so they don't conflict with each other.
+    """
+    global _appends_since_compaction
+    upserts = list(upserts)
+    deletes = list(deletes)
+    patches = list(patches)
+    if not upserts and not deletes and not patches:
+        return {}
+    backend = get_storage_backend()
+
+    if backend.supports_append:
+        try:
+            with timed("storage_write"):
+                result = backend.append_changes(locations_to_records(upserts), [str(location_id) for location_id in deletes], patches)
+        except Exception as e:
+            logger.error(f"Error appending {len(upserts)} upserts / {len(patches)} patches / {len(deletes)} deletes to {backend.describe()}: {e}", exc_info=True)
+            invalidate_locations_cache()
+            raise
+        with _snapshot_lock:
+            snapshot = _snapshot
+        if snapshot is not None and snapshot.backend is backend and snapshot.version == result.previous_version:
+            # Nobody else wrote in between, so the cached snapshot plus our changes is the new state
+            new_locations = _apply_to_locations(snapshot.locations, upserts, deletes, patches)
+            _store_snapshot(backend, new_locations, result.version)
+        else:
+            invalidate_locations_cache()
+            # Patches were applied to whatever the log held before them; read back what they produced
+            new_locations = _load_snapshot().locations if patches else []
+        logger.info(f"Appended {len(upserts)} upserts / {len(patches)} patches / {len(deletes)} deletes to {backend.describe()} (version {result.version})")
+
+        with _snapshot_lock:
+            _appends_since_compaction += 1
+            should_compact = _appends_since_compaction >= _get_compact_threshold()
+            if should_compact:
+                _appends_since_compaction = 0
+        if should_compact:
+            threading.Thread(target=compact_locations_log, name="locations-compaction", daemon=True).start()
+        return _patched_locations(new_locations, patches)
+
+    def attempt() -> List[LocationModel]:
+        snapshot = _load_snapshot()
+        new_locations = _apply_to_locations(snapshot.locations, upserts, deletes, patches)
+        try:
+            with timed("storage_write"):
+                version = backend.write_snapshot(locations_to_records(new_locations), if_version_match=snapshot.version)
+        except PreconditionFailedError:
+            invalidate_locations_cache() # Our copy is stale; the retry re-reads and re-applies the changes
+            raise
+        _store_snapshot(backend, new_locations, version)
+        return new_locations
 
     try:
-        if not blob.exists():
-            logger.info(f"Data blob {blob_name} not found in bucket {bucket_name}. Returning empty list.")
-            return []
-
-        json_data = blob.download_as_string()
-        if not json_data: # Handle empty file case
-             logger.info(f"Data blob {blob_name} is empty. Returning empty list.")
-             return []
-
-        data = json.loads(json_data)
-        # Ensure data is a list before parsing
-        if not isinstance(data, list):
-            logger.error(f"Data in {blob_name} is not a list. Found: {type(data)}")
-            # Depending on desired robustness, either raise error or return empty / try to recover
-            return [] # Or raise ValueError("Invalid data format: expected a list of locations")
-
-        locations = [LocationModel.model_validate(item) for item in data]
-        logger.info(f"Successfully loaded {len(locations)} locations from GCS: gs://{bucket_name}/{blob_name}")
-        return locations
+        with _write_lock:
+            new_locations = retry_on_precondition(attempt, _get_write_max_attempts(), f"Updating {backend.describe()}")
+        logger.info(f"Saved {len(upserts)} upserts / {len(patches)} patches / {len(deletes)} deletes to {backend.describe()}")
+        return _patched_locations(new_locations, patches)
     except Exception as e:
-        logger.error(f"Error loading locations from GCS (gs://{bucket_name}/{blob_name}): {e}", exc_info=True)
-        # Depending on desired behavior, could raise error or return empty list
-        # For robustness in a system that might have transient GCS issues or malformed data:
-        return [] # Or re-raise the exception if it's critical path and should halt
+        logger.error(f"Error saving location changes to {backend.describe()}: {e}", exc_info=True)
+        invalidate_locations_cache()
+        raise
 
-def save_locations_to_gcs(locations: List[LocationModel]) -> None:
-    client = _get_gcs_client()
-    bucket_name = _get_bucket_name()
-    blob_name = _get_data_blob_name()
 
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
+async def apply_location_changes_async(upserts: Iterable[LocationModel] = (), deletes: Iterable[uuid.UUID] = (), patches: Iterable[Patch] = ()) -> Dict[uuid.UUID, LocationModel]:
+    """Async variant of apply_location_changes (the write runs on a storage worker thread)."""
+    return await run_storage_io(apply_location_changes, list(upserts), list(deletes), list(patches))
 
-    # Serialize with Pydantic's model_dump for proper handling of UUIDs, etc.
-    data_to_save = [loc.model_dump(mode='json') for loc in locations]
-    json_data = json.dumps(data_to_save, indent=2)
 
+def compact_locations_log() -> bool:
+    """Folds the change log into a new snapshot (no-op for backends without a log)."""
+    backend = get_storage_backend()
+    if not backend.supports_append:
+        return False
     try:
-        blob.upload_from_string(json_data, content_type="application/json")
-        logger.info(f"Successfully saved {len(locations)} locations to GCS: gs://{bucket_name}/{blob_name}")
+        return backend.compact()
     except Exception as e:
-        logger.error(f"Error saving locations to GCS (gs://{bucket_name}/{blob_name}): {e}", exc_info=True)
-        raise # Re-raise after logging, as saving is often a critical path
+        logger.error(f"Error compacting {backend.describe()}: {e}", exc_info=True)
+        return False
+
+
+def load_sidecar_json(name: str) -> Optional[Any]:
+    """Loads an auxiliary JSON document stored next to the location data. Returns None if it doesn't exist."""
+    with timed("storage_sidecar_read"):
+        data = get_storage_backend().read_sidecar(name)
+    if data is None:
+        logger.info(f"Sidecar document {name} not found.")
+        return None
+    return decode_document(data) if data else None
+
+
+def save_sidecar_json(name: str, data: Any) -> None:
+    """Stores an auxiliary JSON document next to the location data (compact, gzipped per LOCATIONS_STORAGE_FORMAT)."""
+    encoded = encode_json(data, _compress_storage())
+    with timed("storage_sidecar_write"):
+        get_storage_backend().write_sidecar(name, encoded)
+    logger.info(f"Saved sidecar document {name}")
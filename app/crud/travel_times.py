@@ -0,0 +1,258 @@
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .storage import load_sidecar_json, run_storage_io, save_sidecar_json
+import logging
+
+logger = logging.getLogger(__name__)
+
+LatLng = Tuple[float, float]
+
+ORIGIN_PRECISION = 3 # decimal places of lat/lng in origin keys (~100m)
+
+
+def origin_key(coords: LatLng) -> str:
+    return f"{round(coords[0], ORIGIN_PRECISION):.{ORIGIN_PRECISION}f},{round(coords[1], ORIGIN_PRECISION):.{ORIGIN_PRECISION}f}"
+
+
+def _get_prefix() -> str:
+    # Each origin's times are a separate document named <prefix><origin key>.json
+    return os.environ.get("GCS_TRAVEL_TIMES_PREFIX", "travel_times/")
+
+def _get_max_origins() -> int:
+    return int(os.environ.get("TRAVEL_TIME_STORE_MAX_ORIGINS", "200"))
+
+
+class _OriginTravelTimes:
+    """Driving times from one origin. Each entry remembers the destination coordinates it was
+    computed for, so a result is only reused while the location is still at the same place."""
+
+    def __init__(self):
+        self.durations: Dict[str, Tuple[int, float, float]] = {} # location id -> (seconds, lat, lng)
+        self.unreachable: Dict[str, Tuple[float, float]] = {} # location id -> (lat, lng)
+        self._sorted_seconds: Optional[List[int]] = None
+        self._sorted_ids: Optional[List[str]] = None
+
+    def _ensure_sorted(self) -> None:
+        if self._sorted_seconds is None:
+            ordered = sorted((seconds, location_id) for location_id, (seconds, _, _) in self.durations.items())
+            self._sorted_seconds = [seconds for seconds, _ in ordered]
+            self._sorted_ids = [location_id for _, location_id in ordered]
+
+    def changed(self) -> None:
+        self._sorted_seconds = None
+        self._sorted_ids = None
+
+    def within(self, max_seconds: int) -> List[Tuple[str, int]]:
+        self._ensure_sorted()
+        end = bisect_right(self._sorted_seconds, max_seconds)
+        return list(zip(self._sorted_ids[:end], self._sorted_seconds[:end]))
+
+    def merge(self, other: "_OriginTravelTimes") -> None:
+        # Adds entries only the other copy has (e.g. routed by another instance); for the rest ours are current
+        for location_id, entry in other.durations.items():
+            if location_id not in self.durations and location_id not in self.unreachable:
+                self.durations[location_id] = entry
+        for location_id, coords in other.unreachable.items():
+            if location_id not in self.durations and location_id not in self.unreachable:
+                self.unreachable[location_id] = coords
+        self.changed()
+
+    def to_json(self) -> Dict:
+        return {
+            "durations": {location_id: list(entry) for location_id, entry in self.durations.items()},
+            "unreachable": {location_id: list(coords) for location_id, coords in self.unreachable.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "_OriginTravelTimes":
+        origin_times = cls()
+        origin_times.durations = {location_id: (int(s), lat, lng) for location_id, (s, lat, lng) in data.get("durations", {}).items()}
+        origin_times.unreachable = {location_id: (lat, lng) for location_id, (lat, lng) in data.get("unreachable", {}).items()}
+        return origin_times
+
+
+class TravelTimeStore:
+    """Persisted origin -> location driving-time matrix.
+
+    Origins are keyed by their rounded coordinates (see origin_key). Per origin the durations
+    are kept sorted, so "everything within N seconds" is a binary search and re-running a filter
+    with another threshold (or sorting by driving time) needs no Maps calls. The least recently
+    used origins are dropped from memory beyond TRAVEL_TIME_STORE_MAX_ORIGINS.
+
+    Each origin is persisted as its own sidecar document, loaded by ensure_loaded() the first
+    time the origin is used; lookup(), within() and record() only touch memory, so they are safe
+    to call on the event loop. flush() only rewrites origins that changed, merging with the
+    persisted copy first so instances routing from the same origin don't drop each other's times.
+    """
+
+    def __init__(self, prefix: str, max_origins: int):
+        self.prefix = prefix
+        self.max_origins = max_origins
+        self._origins: "OrderedDict[str, _OriginTravelTimes]" = OrderedDict() # Loaded origins only
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One read-merge-write at a time, so an older copy never lands last
+        self._dirty: Set[str] = set() # Origin keys changed since the last flush
+
+    def _sidecar_name(self, key: str) -> str:
+        return f"{self.prefix}{key}.json"
+
+    def _read_origin(self, key: str) -> Optional[_OriginTravelTimes]:
+        try:
+            data = load_sidecar_json(self._sidecar_name(key))
+        except Exception as e:
+            logger.error(f"Error loading persisted travel times for origin {key}: {e}", exc_info=True)
+            return None
+        return _OriginTravelTimes.from_json(data) if data else None
+
+    def _evict(self) -> None:
+        # Caller holds the lock. Origins with unflushed changes stay until flush() has written them.
+        excess = len(self._origins) - self.max_origins
+        for key in [key for key in self._origins if key not in self._dirty][:max(0, excess)]:
+            del self._origins[key]
+
+    def is_loaded(self, origin: LatLng) -> bool:
+        return origin_key(origin) in self._origins
+
+    async def ensure_loaded(self, origins: Iterable[LatLng]) -> None:
+        """Loads the origins that are not in memory on a storage worker thread."""
+        missing = [origin for origin in origins if not self.is_loaded(origin)]
+        if missing:
+            await run_storage_io(self.load_origins, missing)
+
+    def load_origins(self, origins: Iterable[LatLng]) -> None:
+        """Loads the persisted times of origins not in memory yet. Does blocking I/O (see ensure_loaded)."""
+        for key in {origin_key(origin) for origin in origins}:
+            if key in self._origins:
+                continue
+            persisted = self._read_origin(key)
+            with self._lock:
+                origin_times = self._origins.get(key)
+                if origin_times is None:
+                    self._origins[key] = persisted or _OriginTravelTimes()
+                    self._evict()
+                elif persisted is not None:
+                    origin_times.merge(persisted) # Recorded by another thread while we were reading
+            if persisted is not None:
+                logger.info(f"Loaded travel times for origin {key} ({len(persisted.durations)} locations).")
+
+    def _get_origin(self, origin: LatLng) -> Optional[_OriginTravelTimes]:
+        # Caller holds the lock
+        key = origin_key(origin)
+        origin_times = self._origins.get(key)
+        if origin_times is not None:
+            self._origins.move_to_end(key)
+        return origin_times
+
+    def lookup(self, origin: LatLng, destinations: Dict[uuid.UUID, LatLng]) -> Tuple[Dict[uuid.UUID, Optional[int]], List[uuid.UUID]]:
+        """Splits destinations into known results and ones that still need routing.
+
+        Returns ({location id: seconds, or None if known to be unroutable}, [ids to route]).
+        An origin that isn't loaded (see ensure_loaded) has no known results.
+        """
+        known: Dict[uuid.UUID, Optional[int]] = {}
+        missing: List[uuid.UUID] = []
+        with self._lock:
+            origin_times = self._get_origin(origin)
+            for location_id, (lat, lng) in destinations.items():
+                key = str(location_id)
+                entry = origin_times.durations.get(key) if origin_times else None
+                if entry is not None and entry[1] == lat and entry[2] == lng:
+                    known[location_id] = entry[0]
+                elif origin_times and origin_times.unreachable.get(key) == (lat, lng):
+                    known[location_id] = None
+                else:
+                    missing.append(location_id)
+        return known, missing
+
+    def within(self, origin: LatLng, max_seconds: int) -> List[Tuple[uuid.UUID, int]]:
+        """All stored (location id, seconds) from origin with seconds <= max_seconds, fastest first.
+
+        Entries are not checked against current coordinates here; use lookup() for that.
+        """
+        with self._lock:
+            origin_times = self._get_origin(origin)
+            if origin_times is None:
+                return []
+            return [(uuid.UUID(location_id), seconds) for location_id, seconds in origin_times.within(max_seconds)]
+
+    def record(self, origin: LatLng, durations: Dict[uuid.UUID, int], unreachable: Dict[uuid.UUID, LatLng], destinations: Dict[uuid.UUID, LatLng]) -> None:
+        """Stores routed durations (and definitively unroutable destinations) for an origin."""
+        if not durations and not unreachable:
+            return
+        key = origin_key(origin)
+        with self._lock:
+            origin_times = self._origins.get(key)
+            if origin_times is None: # Evicted since it was loaded; flush() merges with the persisted copy
+                origin_times = self._origins[key] = _OriginTravelTimes()
+                self._evict()
+            self._origins.move_to_end(key)
+            for location_id, seconds in durations.items():
+                lat, lng = destinations[location_id]
+                origin_times.durations[str(location_id)] = (seconds, lat, lng)
+                origin_times.unreachable.pop(str(location_id), None)
+            for location_id, (lat, lng) in unreachable.items():
+                origin_times.unreachable[str(location_id)] = (lat, lng)
+                origin_times.durations.pop(str(location_id), None)
+            origin_times.changed()
+            self._dirty.add(key)
+
+    def invalidate_location(self, location_id: uuid.UUID) -> None:
+        """Forgets every stored route to a location (e.g. after its coordinates changed).
+
+        Only the loaded origins are updated, and nothing is rewritten: persisted entries carry the
+        destination coordinates they were computed for, so lookup() never serves them for the
+        location's new coordinates anyway.
+        """
+        key = str(location_id)
+        with self._lock:
+            for origin_times in self._origins.values():
+                removed = origin_times.durations.pop(key, None) is not None
+                removed = origin_times.unreachable.pop(key, None) is not None or removed
+                if removed:
+                    origin_times.changed()
+
+    def flush(self) -> None:
+        """Persists the origins that changed since the last flush (one document each)."""
+        with self._lock:
+            dirty = list(self._dirty)
+            self._dirty.clear()
+        if not dirty:
+            return
+        started = time.monotonic()
+        persisted_count = 0
+        for key in dirty:
+            try:
+                with self._flush_lock:
+                    # Merge with what other instances may have persisted for this origin in the meantime
+                    persisted = self._read_origin(key)
+                    with self._lock:
+                        origin_times = self._origins.get(key)
+                        if origin_times is None:
+                            continue # Evicted; its times were persisted when recorded or are lost with it
+                        if persisted is not None:
+                            origin_times.merge(persisted)
+                        data = origin_times.to_json()
+                    save_sidecar_json(self._sidecar_name(key), data)
+                persisted_count += 1
+            except Exception as e:
+                with self._lock:
+                    self._dirty.add(key)
+                logger.error(f"Error persisting travel times for origin {key}: {e}", exc_info=True)
+        logger.info(f"Persisted travel times for {persisted_count} origins in {time.monotonic() - started:.3f}s.")
+
+
+_travel_time_store: Optional[TravelTimeStore] = None
+_travel_time_store_lock = threading.Lock()
+
+def get_travel_time_store() -> TravelTimeStore:
+    global _travel_time_store
+    if _travel_time_store is None:
+        with _travel_time_store_lock:
+            if _travel_time_store is None:
+                _travel_time_store = TravelTimeStore(_get_prefix(), _get_max_origins())
+    return _travel_time_store
@@ -0,0 +1,29 @@
+import os
+import logging
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+_google_maps_api_key = None
+
+def _get_google_maps_api_key() -> str:
+    global _google_maps_api_key
+    if _google_maps_api_key:
+        return _google_maps_api_key
+
+    secret_name = os.environ.get("GOOGLE_MAPS_API_KEY_SECRET_NAME")
+    if not secret_name:
+        logger.error("GOOGLE_MAPS_API_KEY_SECRET_NAME environment variable is not set.")
+        raise HTTPException(status_code=500, detail="Server configuration error: Maps API key secret name not set.")
+
+    try:
+        # Imported on first use: the Secret Manager client library alone adds ~0.3s to a cold start
+        from google.cloud import secretmanager
+        client = secretmanager.SecretManagerServiceClient()
+        response = client.access_secret_version(name=secret_name)
+        _google_maps_api_key = response.payload.data.decode("UTF-8")
+        logger.info("Successfully retrieved Google Maps API key from Secret Manager.")
+        return _google_maps_api_key
+    except Exception as e:
+        logger.error(f"Failed to retrieve Google Maps API key from Secret Manager ({secret_name}): {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Server configuration error: Could not access Maps API key. Error: {e}")
@@ -1,8 +1,15 @@
 import os
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException
-from google.cloud import secretmanager
-from app.routers import locations, filters # Will create these router files next
+import time
+import anyio
+_import_started = time.perf_counter() # For the cold-start report (/ready): time spent importing the app
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.dependencies import _get_google_maps_api_key # Lives outside main so routers can import it without a circular import
+from app.metrics import MetricsMiddleware, registry as metrics_registry
+from app.routers import locations, filters, enrichment # Will create these router files next
+from app.startup import record_import_time, report as startup_report, start_warmup
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
@@ -14,62 +21,106 @@ app = FastAPI(
     version="0.1.0"
 )
 
-_google_maps_api_key = None
+# Make the API key available to other modules if needed (e.g. routers)
+# A common way is to add it to app.state or use dependency injection.
+# For simplicity in this step, routers can import this function or app instance.
+app.state.get_google_maps_api_key = _get_google_maps_api_key
+
+# Per-request timings (Server-Timing header) and process-wide histograms for /metrics
+app.add_middleware(MetricsMiddleware)
 
-def _get_google_maps_api_key() -> str:
-    global _google_maps_api_key
-    if _google_maps_api_key:
-        return _google_maps_api_key
 
-    secret_name = os.environ.get("GOOGLE_MAPS_API_KEY_SECRET_NAME")
-    if not secret_name:
-        logger.error("GOOGLE_MAPS_API_KEY_SECRET_NAME environment variable is not set.")
-        raise HTTPException(status_code=500, detail="Server configuration error: Maps API key secret name not set.")
+async def _background_maps_client():
+    # Same client the filter endpoint gets, including a test / benchmark dependency override
+    override = app.dependency_overrides.get(filters.get_maps_client)
+    if override is not None:
+        return override()
+    api_key = await anyio.to_thread.run_sync(_get_google_maps_api_key) # Blocking Secret Manager call on first use
+    return filters.get_maps_client(api_key)
 
+
+async def _backfill_enrichment(worker):
     try:
-        client = secretmanager.SecretManagerServiceClient()
-        response = client.access_secret_version(name=secret_name)
-        _google_maps_api_key = response.payload.data.decode("UTF-8")
-        logger.info("Successfully retrieved Google Maps API key from Secret Manager.")
-        return _google_maps_api_key
+        await worker.submit() # Every location still missing coordinates or enrichment data
     except Exception as e:
-        logger.error(f"Failed to retrieve Google Maps API key from Secret Manager ({secret_name}): {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Server configuration error: Could not access Maps API key. Error: {e}")
+        logger.error(f"Could not queue enrichment backfill: {e}", exc_info=True)
 
-# Make the API key available to other modules if needed (e.g. routers)
-# A common way is to add it to app.state or use dependency injection.
-# For simplicity in this step, routers can import this function or app instance.
-app.state.get_google_maps_api_key = _get_google_maps_api_key
+
+async def _compact_locations_log_periodically(interval_seconds: float):
+    from app.crud.storage import compact_locations_log, run_storage_io
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await run_storage_io(compact_locations_log) # Logs its own errors
 
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("Application startup...")
-    # You can preload the key on startup if desired, or let it load on first request.
-    # For now, it loads on first request to _get_google_maps_api_key.
+    hook_started = time.perf_counter()
+    # Long-lived, connection-pooled HTTP clients shared by all requests (closed on shutdown)
+    from app.services.maps import init_http_client
+    init_http_client()
+    # The Maps key (and the location snapshot) are preloaded by the warm-up phase at the end of this hook.
     # Test GCS connectivity (optional, but good for early failure detection)
     try:
-        from app.crud.storage import _get_bucket_name # To check env var
-        _get_bucket_name()
-        logger.info(f"GCS_BUCKET_NAME is set.")
-    except ValueError as e:
+        from app.crud.storage import get_storage_backend, run_storage_io # To check env vars
+        backend = await run_storage_io(get_storage_backend) # Creates the pooled GCS client if needed
+        logger.info(f"Location storage backend configured: {backend.describe()}")
+        if backend.supports_append:
+            interval = float(os.environ.get("LOCATIONS_LOG_COMPACT_INTERVAL_SECONDS", "300"))
+            if interval > 0:
+                app.state.compaction_task = asyncio.create_task(_compact_locations_log_periodically(interval))
+    except Exception as e:
         logger.error(f"Startup check failed: {e}", exc_info=True)
         # Depending on policy, you might want to prevent startup if essential config is missing
         # For now, just log it. The app will fail later if GCS is actually used without config.
 
-    # Test Secret Manager connectivity (optional)
-    # try:
-    #     _get_google_maps_api_key()
-    # except HTTPException as e:
-    #    logger.error(f"Startup check failed: Could not retrieve Maps API Key. {e.detail}")
-    # Calling it here would make it fail startup if not configured, which can be good.
-    # However, some environments might not have access during build/initial startup tests.
+    # Background geocoding / enrichment, so new locations are filter-ready without work on the request path
+    from app.services.enrichment import start_enrichment_worker
+    worker = start_enrichment_worker(_background_maps_client)
+    if worker is not None and os.environ.get("ENRICHMENT_BACKFILL_ON_STARTUP", "true").lower() in ("1", "true", "yes"):
+        app.state.enrichment_backfill_task = asyncio.create_task(_backfill_enrichment(worker))
+
+    startup_report.startup_hook_seconds = round(time.perf_counter() - hook_started, 4)
+    # Fetch the Maps key and load the data concurrently, so the first request doesn't pay for it (STARTUP_WARMUP)
+    app.state.warmup_task = await start_warmup()
     logger.info("Application startup complete.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    warmup_task = getattr(app.state, "warmup_task", None)
+    if warmup_task is not None:
+        warmup_task.cancel()
+    compaction_task = getattr(app.state, "compaction_task", None)
+    if compaction_task is not None:
+        compaction_task.cancel()
+    from app.crud.storage import close_gcs_client
+    from app.services.enrichment import stop_enrichment_worker
+    from app.services.maps import close_http_client
+    await stop_enrichment_worker() # Writes back finished results before the clients close
+    await close_http_client()
+    close_gcs_client()
+
+
 app.include_router(locations.router, prefix="/api/v1", tags=["Locations"])
 app.include_router(filters.router, prefix="/api/v1", tags=["Filters"])
+app.include_router(enrichment.router, prefix="/api/v1", tags=["Enrichment"])
 
 @app.get("/health", tags=["Health"])
 async def health_check():
     return {"status": "ok"}
+
+@app.get("/ready", tags=["Health"])
+async def readiness_check():
+    # Unlike /health (the process is up), ready means warm-up is done: Maps key fetched, data loaded.
+    # The body is the cold-start report (import, startup hook and per-step warm-up times).
+    return JSONResponse(startup_report.as_dict(), status_code=200 if startup_report.ready else 503)
+
+@app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+record_import_time(time.perf_counter() - _import_started)
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Prometheus' default latency buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "where_to_live_"
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+def _get_server_timing_enabled() -> bool:
+    return os.environ.get("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+class RequestMetrics:
+    """Timings and counters collected while handling one request.
+
+    Storage work runs on worker threads that inherit the request's context, so updates are locked.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings: Dict[str, Tuple[float, int]] = {} # operation -> (total seconds, calls)
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_timing(self, operation: str, seconds: float) -> None:
+        with self._lock:
+            total, calls = self.timings.get(operation, (0.0, 0))
+            self.timings[operation] = (total + seconds, calls + 1)
+
+    def add_count(self, name: str, value: float) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def server_timing(self) -> str:
+        """Renders the Server-Timing header value ("storage_read;dur=12.3;desc=\"1 call\", ...")."""
+        with self._lock:
+            entries = [f'{operation};dur={total * 1000:.1f};desc="{calls} call{"s" if calls != 1 else ""}"' for operation, (total, calls) in self.timings.items()]
+            entries += [f'{name};desc="{value:g}"' for name, value in self.counters.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_request: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot is +Inf
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelSet, float]] = {}
+        self._histograms: Dict[str, Dict[LabelSet, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(DEFAULT_BUCKETS)
+            histogram.observe(value)
+
+    @staticmethod
+    def _labels(labels: LabelSet, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                full_name = f"{METRIC_PREFIX}{name}_total"
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{full_name}{self._labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                full_name = f"{METRIC_PREFIX}{name}"
+                if name in self._help:
+                    lines.append(f"# HELP {full_name} {self._help[name]}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{full_name}_bucket{self._labels(labels, ('le', le))} {cumulative}")
+                    lines.append(f"{full_name}_sum{self._labels(labels)} {histogram.total:.6f}")
+                    lines.append(f"{full_name}_count{self._labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("http_request_duration_seconds", "Request latency by route.")
+registry.describe("operation_duration_seconds", "Latency of storage, serialisation and Maps operations.")
+registry.describe("maps_requests", "Requests sent to the Google Maps web services.")
+registry.describe("maps_elements", "Distance Matrix elements requested (billed per element).")
+registry.describe("locations_cache", "Location snapshot reads: hits (no download), misses (downloaded and parsed) and revalidations (metadata-only version checks).")
+registry.describe("storage_bytes_read", "Bytes downloaded from location storage.")
+registry.describe("storage_bytes_written", "Bytes uploaded to location storage.")
+registry.describe("enrichment_locations", "Locations processed by background enrichment, by outcome.")
+registry.describe("distance_matrix_requests_cancelled", "Distance Matrix requests cancelled because a streaming client disconnected or its limit was reached.")
+
+
+@contextmanager
+def timed(operation: str) -> Iterator[None]:
+    """Times a block into the operation latency histogram and the current request's Server-Timing."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe("operation_duration_seconds", elapsed, operation=operation)
+        request = _current_request.get()
+        if request is not None:
+            request.add_timing(operation, elapsed)
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Increments a process-wide counter (exported as <name>_total) and the current request's counter."""
+    registry.inc(name, value, **labels)
+    request = _current_request.get()
+    if request is not None:
+        request.add_count("_".join([name, *labels.values()]), value)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-request metrics context, latency histogram and Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+        self.server_timing = _get_server_timing_enabled()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = RequestMetrics()
+        token = _current_request.set(request)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", request.server_timing().encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_request.reset(token)
+            route = scope.get("route")
+            # The route template keeps label cardinality bounded (no IDs in labels)
+            path = getattr(route, "path", None) or "unmatched"
+            elapsed = time.perf_counter() - request.started
+            registry.observe("http_request_duration_seconds", elapsed, method=scope["method"], route=path, status=str(status_code))
@@ -1,4 +1,5 @@
 import uuid
+from datetime import datetime
 from typing import Optional, Dict, List
 from pydantic import BaseModel, Field
 
@@ -30,3 +31,40 @@ class LocationUpdate(BaseModel): # For updating, all fields are optional
     latitude: Optional[float] = None
     longitude: Optional[float] = None
     enrichment_data: Optional[Dict] = None
+
+
+class LocationBatchUpdate(LocationUpdate): # One item of a batch partial update
+    id: uuid.UUID
+
+class BatchItemResult(BaseModel):
+    index: int # Position of the item in the request
+    id: Optional[uuid.UUID] = None
+    status: str # "created", "updated", "unchanged", "deleted", "not_found" or "invalid"
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BatchItemResult]
+
+class NearbyLocation(LocationModel): # Result of a radius / bounding-box query
+    distance_km: float # Straight-line (great-circle) distance from the query point
+
+class EnrichmentJobRequest(BaseModel):
+    location_ids: Optional[List[uuid.UUID]] = None # Omit to enrich every location that still needs it
+    tasks: Optional[List[str]] = None # Enrichment tasks to run; omit for the configured defaults (ENRICHMENT_TASKS)
+    force: bool = False # Re-run tasks whose results are already stored
+
+class EnrichmentJobStatus(BaseModel):
+    id: uuid.UUID
+    status: str # "queued", "running", "completed" or "failed"
+    tasks: List[str]
+    total: int # Locations submitted to the job
+    processed: int
+    geocoded: int # Locations that got coordinates
+    enriched: int # Locations that got new enrichment_data
+    skipped: int # Already enriched, deleted, or queued by another job
+    failed: int
+    errors: List[str] = [] # First few error messages
+    created_at: datetime
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,50 @@
+import uuid
+from typing import List
+from fastapi import APIRouter, HTTPException, status
+from app.models.location import EnrichmentJobRequest, EnrichmentJobStatus
+from app.services.enrichment import EnrichmentWorker, available_tasks, get_enrichment_worker
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def _require_worker() -> EnrichmentWorker:
+    worker = get_enrichment_worker()
+    if worker is None or not worker.running:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Background enrichment is disabled (ENRICHMENT_WORKERS=0).")
+    return worker
+
+
+@router.post("/enrichment/jobs", response_model=EnrichmentJobStatus, status_code=status.HTTP_202_ACCEPTED)
+async def submit_enrichment_job(job_request: EnrichmentJobRequest):
+    """Queue geocoding and enrichment for some or all locations; poll the returned job for progress."""
+    worker = _require_worker()
+    try:
+        job = await worker.submit(job_request.location_ids, job_request.tasks, job_request.force)
+    except ValueError as ve:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(ve))
+    except Exception as e:
+        logger.error(f"Unexpected error submitting enrichment job: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while submitting enrichment job.")
+    return job.to_status()
+
+
+@router.get("/enrichment/jobs", response_model=List[EnrichmentJobStatus])
+async def list_enrichment_jobs():
+    """Recent jobs on this instance, newest first."""
+    return [job.to_status() for job in _require_worker().list_jobs()]
+
+
+@router.get("/enrichment/jobs/{job_id}", response_model=EnrichmentJobStatus)
+async def read_enrichment_job(job_id: uuid.UUID):
+    job = _require_worker().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Enrichment job not found")
+    return job.to_status()
+
+
+@router.get("/enrichment/tasks", response_model=List[str])
+async def list_enrichment_tasks():
+    """Names of the registered enrichment tasks (usable in a job's `tasks`)."""
+    return available_tasks()
@@ -1,12 +1,26 @@
+import asyncio
+import json
 import logging
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException, Depends, Body, status
-from pydantic import BaseModel
-import googlemaps
+import os
+import uuid
+from typing import AsyncIterator, Dict, List, Literal, Optional, Set, Tuple
+from fastapi import APIRouter, HTTPException, Depends, Body, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter
 
 from app.models.location import LocationModel
 from app.crud import locations as crud_locations
-from app.main import _get_google_maps_api_key # Import the getter from main
+from app.crud.geocode_cache import get_geocode_cache, normalise_address
+from app.crud.serialization import locations_to_json
+from app.crud.storage import run_storage_io, snapshot_epoch
+from app.crud.travel_times import TravelTimeStore, get_travel_time_store
+from app.dependencies import _get_google_maps_api_key
+from app.metrics import count, timed
+from app.singleflight import SingleFlight
+from app.services.enrichment import get_enrichment_worker
+from app.services.maps import MAX_ORIGINS_PER_REQUEST, REQUEST_FAILED, UNROUTABLE_STATUSES, AsyncMapsClient, geocode_address, get_driving_matrix, get_driving_results, get_http_client, schedule_driving_results
+from app.services.prefilter import CoordinateTable, haversine_km, reachable_mask
+from app.routers.locations import NDJSON_MEDIA_TYPES
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -14,96 +28,521 @@ router = APIRouter()
 class FilterRequest(BaseModel):
     source_address: str
     max_driving_time_minutes: int
+    sort_by_driving_time: bool = False # Fastest first instead of catalogue order
+    limit: Optional[int] = Field(None, ge=1) # Return at most this many matches (top-k when sorting)
 
 class FilteredLocationResponse(LocationModel):
     # This inherits from LocationModel and can add/override fields if needed for the response
     # For now, driving_time_to_target_seconds is already in LocationModel
     pass
 
+class FilterOrigin(BaseModel):
+    source_address: str
+    max_driving_time_minutes: Optional[int] = Field(None, ge=0) # Limit for this origin alone
+
+class MultiOriginFilterRequest(BaseModel):
+    origins: List[FilterOrigin] = Field(..., min_length=1, max_length=MAX_ORIGINS_PER_REQUEST)
+    aggregate: Literal["max", "sum", "mean"] = "max" # How per-origin driving times combine into the score
+    max_aggregate_minutes: Optional[int] = Field(None, ge=0) # Limit on the combined score
+    limit: Optional[int] = Field(None, ge=1) # Return at most this many matches (best scores first)
+
+class MultiOriginLocationResponse(LocationModel):
+    driving_times_seconds: List[int] # Per origin, in request order
+    aggregate_driving_time_seconds: int
+
+_multi_origin_adapter = TypeAdapter(List[MultiOriginLocationResponse])
+
+
+def _get_geocode_concurrency() -> int:
+    # Maximum number of location addresses geocoded concurrently per request
+    return max(1, int(os.environ.get("GEOCODE_MAX_CONCURRENCY", "8")))
+
+
+def _get_filter_coalesce_timeout_seconds() -> float:
+    # Upper bound on a filter computation shared by identical concurrent requests
+    return float(os.environ.get("SINGLEFLIGHT_FILTER_TIMEOUT_SECONDS", "60"))
+
 
 def get_maps_client(api_key: str = Depends(_get_google_maps_api_key)):
     if not api_key: # Should be handled by _get_google_maps_api_key raising HTTPException
         raise HTTPException(status_code=500, detail="Maps API key not available.")
     try:
-        return googlemaps.Client(key=api_key)
+        return AsyncMapsClient(api_key, get_http_client()) # Cheap: the connection pool is shared
     except Exception as e:
         logger.error(f"Failed to initialize Google Maps client: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to initialize Maps client.")
 
 
+async def _persist_geocoding(resolved_coordinates: Dict[uuid.UUID, Tuple[float, float]]) -> None:
+    # Save newly resolved coordinates with the locations (one batched write) and persist the
+    # geocode cache, so repeat requests don't geocode at all. Failures only cost a re-geocode later.
+    try:
+        if resolved_coordinates:
+            await crud_locations.set_location_coordinates(resolved_coordinates)
+    except Exception as e:
+        logger.error(f"Error saving geocoded coordinates for {len(resolved_coordinates)} locations: {e}", exc_info=True)
+    await run_storage_io(get_geocode_cache().flush)
+
+
+async def _geocode_missing_coordinates(gmaps: AsyncMapsClient, locations: List[LocationModel]) -> Dict[uuid.UUID, Tuple[float, float]]:
+    # Geocodes locations without coordinates concurrently (bounded); returns id -> coords for the ones resolved
+    semaphore = asyncio.Semaphore(_get_geocode_concurrency())
+
+    async def geocode(loc: LocationModel) -> Optional[Tuple[float, float]]:
+        async with semaphore:
+            try:
+                return await geocode_address(gmaps, loc.address)
+            except Exception as e:
+                logger.error(f"Error geocoding address '{loc.address}' for location '{loc.name}': {e}", exc_info=True)
+                return None
+
+    if not locations:
+        return {}
+    logger.info(f"Geocoding {len(locations)} locations that are missing coordinates.")
+    results = await asyncio.gather(*(geocode(loc) for loc in locations))
+    resolved = {loc.id: coords for loc, coords in zip(locations, results) if coords}
+    if len(resolved) < len(locations):
+        # One summary line; the per-location detail is only formatted when debugging
+        logger.warning(f"Could not geocode {len(locations) - len(resolved)} of {len(locations)} location addresses; they are skipped for distance calculation.")
+        if logger.isEnabledFor(logging.DEBUG):
+            for loc in locations:
+                if loc.id not in resolved:
+                    logger.debug(f"Could not geocode address '{loc.address}' for location '{loc.name}' (ID: {loc.id}).")
+    return resolved
+
+
+async def _geocode_source_address(gmaps: AsyncMapsClient, source_address: str) -> Tuple[float, float]:
+    try:
+        source_coords = await geocode_address(gmaps, source_address)
+        if source_coords is None:
+            logger.warning(f"Could not geocode source address: {source_address}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Could not geocode source address: {source_address}")
+
+        logger.info(f"Source address '{source_address}' geocoded to: {source_coords}")
+        return source_coords
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error geocoding source address '{source_address}': {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error geocoding source address. {e}")
+
+
+async def _routable_destinations(gmaps: AsyncMapsClient, all_locations: List[LocationModel]) -> Tuple[List[LocationModel], Dict[uuid.UUID, Tuple[float, float]], Dict[uuid.UUID, Tuple[float, float]], int]:
+    # Returns (routable locations in catalogue order, id -> coords to route to, id -> coords geocoded
+    # during this request, number of locations left to background geocoding)
+    missing_coordinates = [loc for loc in all_locations if loc.latitude is None or loc.longitude is None]
+    enrichment_worker = get_enrichment_worker()
+    if enrichment_worker is not None and enrichment_worker.running:
+        # Geocoded by the background worker (normally long before now); they join results once written back
+        resolved_coordinates = {}
+        new_ids = [loc.id for loc in missing_coordinates if not enrichment_worker.is_active(loc.id)]
+        if new_ids:
+            await enrichment_worker.submit(new_ids)
+        if missing_coordinates:
+            logger.info(f"{len(missing_coordinates)} locations without coordinates left to background geocoding.")
+    else:
+        # location id -> coords geocoded during this request, saved back below
+        resolved_coordinates = await _geocode_missing_coordinates(gmaps, missing_coordinates)
+
+    routable_locations = []
+    # location id -> coords to route to. The shared cached models are never copied or mutated here;
+    # per-request values are overlaid onto the few matches when the response is built.
+    destinations = {}
+    for loc in all_locations:
+        coords = resolved_coordinates.get(loc.id) or (loc.latitude, loc.longitude)
+        if coords[0] is None or coords[1] is None: # Check again after attempt
+            continue # Already reported (as a summary) by _geocode_missing_coordinates
+
+        routable_locations.append(loc)
+        destinations[loc.id] = coords
+
+    await _persist_geocoding(resolved_coordinates)
+    return routable_locations, destinations, resolved_coordinates, len(missing_coordinates) - len(resolved_coordinates)
+
+
 @router.post("/filter_by_driving_time", response_model=List[FilteredLocationResponse])
-def filter_locations_by_driving_time(
+async def filter_locations_by_driving_time(
     filter_request: FilterRequest,
-    gmaps: googlemaps.Client = Depends(get_maps_client)
+    request: Request,
+    gmaps: AsyncMapsClient = Depends(get_maps_client)
 ):
+    """Filter locations by driving time from one address.
+
+    With `Accept: application/x-ndjson` or `text/event-stream` the matches are streamed as soon as
+    their driving times are known, followed by a summary record (see _stream_filter_results).
+    """
     logger.info(f"Filtering locations by driving time from '{filter_request.source_address}' within {filter_request.max_driving_time_minutes} minutes.")
 
+    stream_format = _stream_format(request)
+    if stream_format is not None:
+        if filter_request.sort_by_driving_time:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="sort_by_driving_time is not supported when streaming; matches are sent as they are found.")
+        return await _filter_by_driving_time(filter_request, gmaps, request, stream_format) # Streams are per connection, never shared
+
+    # Identical concurrent requests (same normalised address and parameters, same catalogue
+    # writes seen) share one computation; errors reach every caller.
+    flight_key = (
+        normalise_address(filter_request.source_address), filter_request.max_driving_time_minutes,
+        filter_request.sort_by_driving_time, filter_request.limit, snapshot_epoch(),
+    )
     try:
-        geocode_result = gmaps.geocode(filter_request.source_address)
-        if not geocode_result:
-            logger.warn(f"Could not geocode source address: {filter_request.source_address}")
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Could not geocode source address: {filter_request.source_address}")
+        shared = await _filter_computations.do(flight_key, lambda: _filter_by_driving_time(filter_request, gmaps), timeout=_get_filter_coalesce_timeout_seconds())
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Timed out computing driving times.")
+    # Every caller gets its own Response; the shared one is only read
+    return Response(content=shared.body, status_code=shared.status_code, headers=dict(shared.headers))
 
-        source_coords = (geocode_result[0]['geometry']['location']['lat'], geocode_result[0]['geometry']['location']['lng'])
-        logger.info(f"Source address '{filter_request.source_address}' geocoded to: {source_coords}")
 
-    except Exception as e:
-        logger.error(f"Error geocoding source address '{filter_request.source_address}': {e}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Error geocoding source address. {e}")
+_filter_computations = SingleFlight("filter_by_driving_time")
 
-    all_locations = crud_locations.get_all_locations()
-    if not all_locations:
+async def _filter_by_driving_time(filter_request: FilterRequest, gmaps: AsyncMapsClient, request: Optional[Request] = None, stream_format: Optional[str] = None) -> Response:
+    source_coords = await _geocode_source_address(gmaps, filter_request.source_address)
+
+    all_locations = await crud_locations.get_all_locations()
+    if not all_locations and stream_format is None: # A stream still sends its summary
         logger.info("No locations available to filter.")
-        return []
+        await run_storage_io(get_geocode_cache().flush) # Still keep the source address geocode
+        return Response(content=locations_to_json([]), media_type="application/json")
 
-    filtered_locations = []
     max_driving_time_seconds = filter_request.max_driving_time_minutes * 60
+    routable_locations, destinations, resolved_coordinates, pending_geocoding = await _routable_destinations(gmaps, all_locations)
 
-    for loc_original in all_locations:
-        # Create a copy to avoid modifying the original data in memory/GCS for this transient calculation
-        loc = loc_original.model_copy(deep=True)
+    travel_times = get_travel_time_store()
+    await travel_times.ensure_loaded([source_coords])
+    known_durations, ids_to_route = travel_times.lookup(source_coords, destinations)
+    count("travel_time_lookups", len(known_durations), result="known")
+    count("travel_time_lookups", len(ids_to_route), result="missing")
+    logger.info(f"{len(known_durations)} driving times served from the travel-time store; {len(ids_to_route)} locations need routing.")
 
-        if loc.latitude is None or loc.longitude is None:
-            logger.info(f"Location '{loc.name}' (ID: {loc.id}) is missing coordinates. Attempting to geocode address: {loc.address}")
-            try:
-                loc_geocode_result = gmaps.geocode(loc.address)
-                if loc_geocode_result:
-                    loc.latitude = loc_geocode_result[0]['geometry']['location']['lat']
-                    loc.longitude = loc_geocode_result[0]['geometry']['location']['lng']
-                    logger.info(f"Geocoded '{loc.name}' to ({loc.latitude}, {loc.longitude}).")
-                    # Note: This geocoded result is NOT saved back to GCS by this filter endpoint.
-                    # This should be part of the CRUD for locations if persistence of geocoded data is desired.
-                else:
-                    logger.warning(f"Could not geocode address '{loc.address}' for location '{loc.name}'. Skipping this location for distance calculation.")
-                    continue # Skip if cannot geocode
-            except Exception as e:
-                logger.error(f"Error geocoding address '{loc.address}' for location '{loc.name}': {e}", exc_info=True)
-                continue # Skip on error
+    # Drop locations that are out of range even in a straight line at the maximum road speed,
+    # before spending any Distance Matrix elements on them
+    catalogue_coordinates = await crud_locations.get_location_coordinates()
+    if ids_to_route:
+        mask = reachable_mask(source_coords, catalogue_coordinates.select(ids_to_route, destinations), filter_request.max_driving_time_minutes)
+        pruned_count = len(ids_to_route) - int(mask.sum())
+        ids_to_route = [location_id for location_id, reachable in zip(ids_to_route, mask) if reachable]
+    else:
+        pruned_count = 0
+    count("prefilter_pruned", pruned_count)
+    logger.info(f"Straight-line prefilter pruned {pruned_count} locations; {len(ids_to_route)} left to route.")
 
-        if loc.latitude is None or loc.longitude is None: # Check again after attempt
-            logger.warning(f"Skipping location '{loc.name}' as it has no coordinates after geocoding attempt.")
-            continue
+    if stream_format is not None:
+        known_matches = [(location_id, seconds) for location_id, seconds in known_durations.items() if seconds is not None and seconds <= max_driving_time_seconds]
+        return _stream_filter_results(
+            request, gmaps, stream_format, filter_request, source_coords, routable_locations, destinations, catalogue_coordinates,
+            resolved_coordinates, known_matches, ids_to_route, travel_times, pruned_count, pending_geocoding,
+        )
+
+    # One batched, concurrent pass over the Distance Matrix API instead of one request per location
+    route_results = await get_driving_results(gmaps, source_coords, [destinations[location_id] for location_id in ids_to_route])
+    new_durations = {}
+    unroutable = {}
+    for location_id, (route_status, duration_seconds) in zip(ids_to_route, route_results):
+        if route_status == 'OK':
+            new_durations[location_id] = duration_seconds
+        elif route_status in UNROUTABLE_STATUSES:
+            unroutable[location_id] = destinations[location_id]
+    travel_times.record(source_coords, new_durations, unroutable, destinations)
+    await run_storage_io(travel_times.flush)
 
-        destination_coords = (loc.latitude, loc.longitude)
+    durations = {location_id: seconds for location_id, seconds in known_durations.items() if seconds is not None}
+    durations.update(new_durations)
 
+    # Threshold query is a binary search over the origin's sorted durations (fastest first);
+    # entries are kept only if they are the ones validated against current coordinates above.
+    await travel_times.ensure_loaded([source_coords]) # Reloads it if other requests' origins evicted it meanwhile
+    matches = [(location_id, seconds) for location_id, seconds in travel_times.within(source_coords, max_driving_time_seconds) if durations.get(location_id) == seconds]
+    if not filter_request.sort_by_driving_time:
+        catalogue_order = {loc.id: position for position, loc in enumerate(routable_locations)}
+        matches.sort(key=lambda match: catalogue_order[match[0]])
+    if filter_request.limit is not None:
+        matches = matches[:filter_request.limit]
+
+    routable_by_id = {loc.id: loc for loc in routable_locations}
+    filtered_locations = []
+    for location_id, duration_seconds in matches:
+        loc = routable_by_id[location_id]
+        # Shallow overlay of the per-request values; nested data is shared with the cache, not copied
+        overlay = {"driving_time_to_target_seconds": duration_seconds}
+        if location_id in resolved_coordinates:
+            overlay["latitude"], overlay["longitude"] = resolved_coordinates[location_id]
+        filtered_locations.append(loc.model_copy(update=overlay))
+
+    logger.info(f"Found {len(filtered_locations)} locations matching the criteria.")
+    # Serialised in one pass; the models are already valid, so skip FastAPI's response re-validation
+    return Response(content=locations_to_json(filtered_locations), media_type="application/json", headers={"X-Prefilter-Pruned": str(pruned_count), "X-Pending-Geocoding": str(pending_geocoding)})
+
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+def _stream_format(request: Request) -> Optional[str]:
+    # Media type of the streaming response the client asked for, or None for a plain JSON array
+    accept = request.headers.get("accept", "").lower()
+    if SSE_MEDIA_TYPE in accept:
+        return SSE_MEDIA_TYPE
+    if any(media_type in accept for media_type in NDJSON_MEDIA_TYPES):
+        return "application/x-ndjson"
+    return None
+
+
+_background_flushes: Set[asyncio.Task] = set() # Strong references until they finish
+
+def _flush_in_background(travel_times: TravelTimeStore) -> None:
+    # Persists routes already paid for without holding up (or depending on) a response whose client is gone
+    task = asyncio.create_task(run_storage_io(travel_times.flush))
+    _background_flushes.add(task)
+    task.add_done_callback(_background_flushes.discard)
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    # The request body has been read, so the next ASGI message is the client going away
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+def _stream_filter_results(
+    request: Request,
+    gmaps: AsyncMapsClient,
+    stream_format: str,
+    filter_request: FilterRequest,
+    source_coords: Tuple[float, float],
+    routable_locations: List[LocationModel],
+    destinations: Dict[uuid.UUID, Tuple[float, float]],
+    catalogue_coordinates: CoordinateTable,
+    resolved_coordinates: Dict[uuid.UUID, Tuple[float, float]],
+    known_matches: List[Tuple[uuid.UUID, int]],
+    ids_to_route: List[uuid.UUID],
+    travel_times: TravelTimeStore,
+    pruned_count: int,
+    pending_geocoding: int,
+) -> StreamingResponse:
+    """Streams matches as their driving times become known, then a summary record.
+
+    Matches from the travel-time store go out first, then each Distance Matrix chunk's matches as
+    soon as that request completes. Destinations are routed nearest first, so the first routed
+    matches arrive after about one Maps round trip whatever the catalogue size. NDJSON sends one
+    location per line and ends with {"summary": {...}}; SSE sends "locations" events (JSON arrays)
+    and a final "summary" event. If the client disconnects, or `limit` matches have been sent,
+    the Maps requests still outstanding are cancelled.
+    """
+    max_driving_time_seconds = filter_request.max_driving_time_minutes * 60
+    routable_by_id = {loc.id: loc for loc in routable_locations}
+    if ids_to_route:
+        distances = haversine_km(source_coords, catalogue_coordinates.select(ids_to_route, destinations))
+        ids_to_route = [ids_to_route[position] for position in distances.argsort(kind="stable")]
+
+    def encode(batch: List[Tuple[uuid.UUID, int]]) -> str:
+        matches = []
+        for location_id, duration_seconds in batch:
+            overlay = {"driving_time_to_target_seconds": duration_seconds}
+            if location_id in resolved_coordinates:
+                overlay["latitude"], overlay["longitude"] = resolved_coordinates[location_id]
+            matches.append(routable_by_id[location_id].model_copy(update=overlay))
+        if stream_format == SSE_MEDIA_TYPE:
+            return f"event: locations\ndata: {locations_to_json(matches).decode()}\n\n"
+        return "".join(loc.model_dump_json() + "\n" for loc in matches)
+
+    def encode_summary(summary: Dict) -> str:
+        if stream_format == SSE_MEDIA_TYPE:
+            return f"event: summary\ndata: {json.dumps(summary)}\n\n"
+        return json.dumps({"summary": summary}) + "\n"
+
+    async def stream() -> AsyncIterator[str]:
+        summary = {
+            "matched": 0, "from_store": len(known_matches), "routed": 0, "unroutable": 0, "failed": 0,
+            "pruned": pruned_count, "pending_geocoding": pending_geocoding, "cancelled_requests": 0, "complete": False,
+        }
+        limit = filter_request.limit
+        batch = known_matches[:limit] if limit is not None else known_matches
+        if batch:
+            summary["matched"] += len(batch)
+            yield encode(batch)
+
+        pending = set()
+        flushed = False
+        disconnected = asyncio.create_task(_wait_for_disconnect(request))
         try:
-            logger.debug(f"Calculating distance matrix for {source_coords} to {destination_coords} for location '{loc.name}'.")
-            matrix = gmaps.distance_matrix(origins=[source_coords], destinations=[destination_coords], mode="driving")
-
-            if matrix['rows'][0]['elements'][0]['status'] == 'OK':
-                duration_seconds = matrix['rows'][0]['elements'][0]['duration']['value']
-                loc.driving_time_to_target_seconds = duration_seconds # Set on the copy
-                logger.info(f"Driving time from '{filter_request.source_address}' to '{loc.name}': {duration_seconds}s.")
-                if duration_seconds <= max_driving_time_seconds:
-                    filtered_locations.append(FilteredLocationResponse.model_validate(loc)) # Validate before appending
+            if limit is None or summary["matched"] < limit:
+                pending = set(schedule_driving_results(gmaps, source_coords, [destinations[location_id] for location_id in ids_to_route]))
+            while pending:
+                done, _ = await asyncio.wait([*pending, disconnected], return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    logger.info(f"Client disconnected; cancelling {len(pending)} outstanding Distance Matrix requests.")
+                    return
+                new_durations, unroutable, batch = {}, {}, []
+                for task in done:
+                    pending.discard(task)
+                    offset, results = task.result()
+                    for location_id, (route_status, duration_seconds) in zip(ids_to_route[offset:], results):
+                        if route_status == 'OK':
+                            new_durations[location_id] = duration_seconds
+                            if duration_seconds <= max_driving_time_seconds:
+                                batch.append((location_id, duration_seconds))
+                        elif route_status in UNROUTABLE_STATUSES:
+                            unroutable[location_id] = destinations[location_id]
+                        elif route_status == REQUEST_FAILED:
+                            summary["failed"] += 1
+                travel_times.record(source_coords, new_durations, unroutable, destinations)
+                summary["routed"] += len(new_durations)
+                summary["unroutable"] += len(unroutable)
+                if limit is not None:
+                    batch = batch[:limit - summary["matched"]]
+                if batch:
+                    summary["matched"] += len(batch)
+                    yield encode(batch)
+                if limit is not None and summary["matched"] >= limit:
+                    break
+
+            summary["complete"] = not pending
+            summary["cancelled_requests"] = len(pending)
+            await run_storage_io(travel_times.flush)
+            flushed = True
+            logger.info(f"Streamed {summary['matched']} locations matching the criteria.")
+            yield encode_summary(summary)
+        finally:
+            disconnected.cancel()
+            for task in pending:
+                task.cancel()
+            if pending:
+                count("distance_matrix_requests_cancelled", len(pending))
+            if not flushed: # Disconnected (or failed) part-way: keep the durations recorded so far
+                _flush_in_background(travel_times)
+
+    headers = {"X-Prefilter-Pruned": str(pruned_count), "X-Pending-Geocoding": str(pending_geocoding), "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(stream(), media_type=stream_format, headers=headers)
+
+
+def _aggregate_seconds(durations: List[int], mode: str) -> float:
+    if mode == "max":
+        return max(durations)
+    if mode == "sum":
+        return sum(durations)
+    return sum(durations) / len(durations)
+
+
+def _origin_limit_seconds(origin: FilterOrigin, filter_request: MultiOriginFilterRequest) -> float:
+    # Longest driving time from this origin that can still pass: its own limit, and whatever the
+    # aggregate limit implies for a single origin (every mode is >= each term's share of it)
+    limit = float("inf")
+    if origin.max_driving_time_minutes is not None:
+        limit = origin.max_driving_time_minutes * 60
+    if filter_request.max_aggregate_minutes is not None:
+        share = len(filter_request.origins) if filter_request.aggregate == "mean" else 1
+        limit = min(limit, filter_request.max_aggregate_minutes * 60 * share)
+    return limit
+
+
+@router.post("/filter_by_driving_time/multi", response_model=List[MultiOriginLocationResponse])
+async def filter_locations_by_multi_origin_driving_time(
+    filter_request: MultiOriginFilterRequest,
+    gmaps: AsyncMapsClient = Depends(get_maps_client)
+):
+    """Filter by driving time from several origins at once, ranked by an aggregate score.
+
+    A location matches if it is within every origin's own limit and its aggregate (max, sum or
+    mean of the per-origin times) is within `max_aggregate_minutes`. Stored travel times and the
+    straight-line bound rule locations out before routing; the rest go through one
+    origins x destinations Distance Matrix pass.
+    """
+    logger.info(f"Filtering locations by driving time from {len(filter_request.origins)} origins ({filter_request.aggregate} <= {filter_request.max_aggregate_minutes} minutes).")
+
+    origins = await asyncio.gather(*(_geocode_source_address(gmaps, origin.source_address) for origin in filter_request.origins))
+
+    all_locations = await crud_locations.get_all_locations()
+    if not all_locations:
+        logger.info("No locations available to filter.")
+        await run_storage_io(get_geocode_cache().flush) # Still keep the source address geocodes
+        return []
+
+    routable_locations, destinations, resolved_coordinates, pending_geocoding = await _routable_destinations(gmaps, all_locations)
+    aggregate_limit = filter_request.max_aggregate_minutes * 60 if filter_request.max_aggregate_minutes is not None else float("inf")
+    origin_limits = [_origin_limit_seconds(origin, filter_request) for origin in filter_request.origins]
+
+    # Candidates shrink origin by origin: a location is dropped as soon as any origin rules it out
+    candidates = dict(destinations)
+    durations: List[Dict[uuid.UUID, int]] = [{} for _ in origins]
+    to_route: List[Set[uuid.UUID]] = []
+    pruned_count = 0
+    catalogue_coordinates = await crud_locations.get_location_coordinates()
+    travel_times = get_travel_time_store()
+    await travel_times.ensure_loaded(origins)
+    for index, (origin, origin_limit) in enumerate(zip(origins, origin_limits)):
+        known, ids_to_route = travel_times.lookup(origin, candidates)
+        count("travel_time_lookups", len(known), result="known")
+        count("travel_time_lookups", len(ids_to_route), result="missing")
+        for location_id, seconds in known.items():
+            if seconds is None or seconds > origin_limit:
+                del candidates[location_id]
             else:
-                status_msg = matrix['rows'][0]['elements'][0]['status']
-                logger.warning(f"Distance Matrix API returned status '{status_msg}' for destination '{loc.name}'. Skipping.")
+                durations[index][location_id] = seconds
+        if ids_to_route and origin_limit != float("inf"):
+            mask = reachable_mask(origin, catalogue_coordinates.select(ids_to_route, candidates), origin_limit / 60)
+            for location_id, reachable in zip(ids_to_route, mask):
+                if not reachable:
+                    del candidates[location_id]
+                    pruned_count += 1
+        to_route.append({location_id for location_id in ids_to_route if location_id in candidates})
 
-        except Exception as e:
-            logger.error(f"Error calculating driving time for location '{loc.name}': {e}", exc_info=True)
-            # Decide if you want to skip this location or halt the request
-            # For now, skip the location on error to make the endpoint more resilient
+    # Unknown times count as 0, so the aggregate of the known ones is a lower bound on the final score
+    if aggregate_limit != float("inf"):
+        for location_id in list(candidates):
+            partial = [origin_durations.get(location_id, 0) for origin_durations in durations]
+            if _aggregate_seconds(partial, filter_request.aggregate) > aggregate_limit:
+                del candidates[location_id]
+    count("prefilter_pruned", pruned_count)
 
-    logger.info(f"Found {len(filtered_locations)} locations matching the criteria.")
-    return filtered_locations
+    # Route each remaining candidate from the origins it has no stored time for. Candidates are grouped
+    # by that set of origins (normally one group: all of them) so no element is spent on a known pair.
+    groups: Dict[Tuple[int, ...], List[uuid.UUID]] = {}
+    for location_id in candidates:
+        needed = tuple(index for index, ids in enumerate(to_route) if location_id in ids)
+        if needed:
+            groups.setdefault(needed, []).append(location_id)
+    logger.info(f"Straight-line and stored-time checks left {len(candidates)} of {len(destinations)} locations; {sum(len(group) for group in groups.values())} need routing.")
+
+    group_items = list(groups.items())
+    matrices = await asyncio.gather(*(
+        get_driving_matrix(gmaps, [origins[index] for index in needed], [destinations[location_id] for location_id in ids])
+        for needed, ids in group_items
+    ))
+    new_durations: List[Dict[uuid.UUID, int]] = [{} for _ in origins]
+    unroutable: List[Dict[uuid.UUID, Tuple[float, float]]] = [{} for _ in origins]
+    for (needed, ids), matrix in zip(group_items, matrices):
+        for index, row in zip(needed, matrix):
+            for location_id, (route_status, duration_seconds) in zip(ids, row):
+                if route_status == 'OK':
+                    new_durations[index][location_id] = duration_seconds
+                elif route_status in UNROUTABLE_STATUSES:
+                    unroutable[index][location_id] = destinations[location_id]
+    for index, origin in enumerate(origins):
+        travel_times.record(origin, new_durations[index], unroutable[index], destinations)
+        durations[index].update(new_durations[index])
+    await run_storage_io(travel_times.flush)
+
+    ranked = []
+    catalogue_order = {loc.id: position for position, loc in enumerate(routable_locations)}
+    for location_id in candidates:
+        per_origin = [origin_durations.get(location_id) for origin_durations in durations]
+        if any(seconds is None or seconds > origin_limit for seconds, origin_limit in zip(per_origin, origin_limits)):
+            continue
+        score = _aggregate_seconds(per_origin, filter_request.aggregate)
+        if score <= aggregate_limit:
+            ranked.append((score, catalogue_order[location_id], location_id, per_origin))
+    ranked.sort()
+    if filter_request.limit is not None:
+        ranked = ranked[:filter_request.limit]
+
+    routable_by_id = {loc.id: loc for loc in routable_locations}
+    filtered_locations = []
+    for score, _, location_id, per_origin in ranked:
+        fields = dict(routable_by_id[location_id]) # Shallow: nested data is shared with the cache, not copied
+        overlay = {"driving_times_seconds": per_origin, "aggregate_driving_time_seconds": round(score)}
+        if location_id in resolved_coordinates:
+            overlay["latitude"], overlay["longitude"] = resolved_coordinates[location_id]
+        filtered_locations.append(MultiOriginLocationResponse.model_construct(**{**fields, **overlay}))
+
+    logger.info(f"Found {len(filtered_locations)} locations matching the multi-origin criteria.")
+    with timed("serialize"):
+        content = _multi_origin_adapter.dump_json(filtered_locations)
+    return Response(content=content, media_type="application/json", headers={"X-Prefilter-Pruned": str(pruned_count), "X-Pending-Geocoding": str(pending_geocoding)})
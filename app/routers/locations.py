@@ -1,19 +1,114 @@
+import hashlib
+import json
+import os
 import uuid
-from typing import List
-from fastapi import APIRouter, HTTPException, status, Depends
-from app.models.location import LocationModel, LocationCreate, LocationUpdate
+from typing import Any, AsyncIterator, Callable, List, Optional, Set, Tuple
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status, Depends
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from app.models.location import LocationModel, LocationCreate, LocationUpdate, LocationBatchUpdate, BatchItemResult, BatchResponse, NearbyLocation
 from app.crud import locations as crud_locations
+from app.crud.serialization import locations_to_json
+from app.services.enrichment import get_enrichment_worker
+from app.services.location_query import parse_fields, parse_predicates, select_page
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+NDJSON_STREAM_CHUNK_SIZE = 200 # Locations serialised per chunk written to a streaming response
+
+_uuid_adapter = TypeAdapter(uuid.UUID)
+
+
+def _get_batch_max_items() -> int:
+    return int(os.environ.get("LOCATIONS_BATCH_MAX_ITEMS", "10000"))
+
+def _get_page_max_limit() -> int:
+    return int(os.environ.get("LOCATIONS_PAGE_MAX_LIMIT", "1000"))
+
+
+async def _read_batch_items(request: Request) -> List[Any]:
+    """Reads a batch request body: a JSON array, or NDJSON (one JSON value per line) streamed in.
+
+    NDJSON lines that aren't valid JSON are returned as exceptions so they can be reported per item.
+    """
+    max_items = _get_batch_max_items()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    if content_type in NDJSON_MEDIA_TYPES:
+        items: List[Any] = []
+        buffer = b""
+
+        def parse_line(line: bytes) -> None:
+            if not line.strip():
+                return
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+            if len(items) > max_items:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Batch exceeds {max_items} items.")
+
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                parse_line(line)
+        parse_line(buffer)
+        return items
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Request body is not valid JSON: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Request body must be a JSON array (or NDJSON).")
+    if len(items) > max_items:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Batch exceeds {max_items} items.")
+    return items
+
+
+def _validate_batch(items: List[Any], validate: Callable[[Any], Any]) -> Tuple[List[Tuple[int, Any]], List[BatchItemResult]]:
+    """Validates every item in one pass. Returns ([(index, parsed item)], [results for invalid items])."""
+    valid = []
+    invalid = []
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            invalid.append(BatchItemResult(index=index, status="invalid", error=f"Invalid JSON: {item}"))
+            continue
+        try:
+            valid.append((index, validate(item)))
+        except ValidationError as e:
+            invalid.append(BatchItemResult(index=index, status="invalid", error=str(e)))
+    return valid, invalid
+
+
+async def _enqueue_enrichment(location_ids: List[uuid.UUID], force: bool = False) -> None:
+    # New or re-addressed locations are geocoded and enriched in the background, not on this request.
+    # force re-runs tasks after an address change, whose stored results describe the old address.
+    worker = get_enrichment_worker()
+    if worker is None or not worker.running or not location_ids:
+        return
+    try:
+        await worker.submit(location_ids, force=force)
+    except Exception as e: # The startup backfill or a filter request picks them up later
+        logger.error(f"Could not queue enrichment for {len(location_ids)} locations: {e}", exc_info=True)
+
+
+def _batch_response(results: List[BatchItemResult]) -> BatchResponse:
+    results.sort(key=lambda result: result.index)
+    failed = sum(1 for result in results if result.status in ("invalid", "not_found"))
+    return BatchResponse(succeeded=len(results) - failed, failed=failed, results=results)
+
 @router.post("/locations", response_model=LocationModel, status_code=status.HTTP_201_CREATED)
-def create_new_location(location_data: LocationCreate):
+async def create_new_location(location_data: LocationCreate):
     try:
         logger.info(f"Attempting to create location: {location_data.name}")
-        created_location = crud_locations.create_location(location_data)
+        created_location = await crud_locations.create_location(location_data)
         logger.info(f"Successfully created location ID {created_location.id} with name {created_location.name}")
+        await _enqueue_enrichment([created_location.id])
         return created_location
     except ValueError as ve: # Catch specific errors from CRUD if any defined
         logger.error(f"ValueError during location creation: {ve}", exc_info=True)
@@ -23,22 +118,189 @@ def create_new_location(location_data: LocationCreate):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while creating location.")
 
 
+@router.post("/locations/batch", response_model=BatchResponse)
+async def create_locations_batch(request: Request):
+    """Create many locations with a single storage write.
+
+    Body: a JSON array of `LocationCreate` objects, or NDJSON (`Content-Type: application/x-ndjson`).
+    Invalid items are reported per item and the valid ones are still created.
+    """
+    items = await _read_batch_items(request)
+    valid, results = _validate_batch(items, LocationCreate.model_validate)
+    logger.info(f"Batch create: {len(valid)} valid and {len(results)} invalid items.")
+    try:
+        created = await crud_locations.create_locations([item for _, item in valid])
+    except Exception as e:
+        logger.error(f"Unexpected error in batch create of {len(valid)} locations: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while creating locations.")
+    results.extend(BatchItemResult(index=index, id=location.id, status="created") for (index, _), location in zip(valid, created))
+    await _enqueue_enrichment([location.id for location in created])
+    return _batch_response(results)
+
+
+@router.patch("/locations/batch", response_model=BatchResponse)
+async def update_locations_batch(request: Request):
+    """Partially update many locations with one read and one write.
+
+    Body: a JSON array (or NDJSON) of `LocationUpdate` objects that also carry the location `id`.
+    """
+    items = await _read_batch_items(request)
+    valid, results = _validate_batch(items, LocationBatchUpdate.model_validate)
+    logger.info(f"Batch update: {len(valid)} valid and {len(results)} invalid items.")
+    try:
+        updated = await crud_locations.update_locations([item for _, item in valid])
+    except Exception as e:
+        logger.error(f"Unexpected error in batch update of {len(valid)} locations: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while updating locations.")
+    await _enqueue_enrichment([item.id for (_, item), location in zip(valid, updated) if location is not None and "address" in item.model_fields_set], force=True)
+    for (index, item), location in zip(valid, updated):
+        if location is None:
+            results.append(BatchItemResult(index=index, id=item.id, status="not_found", error="Location not found"))
+        else:
+            results.append(BatchItemResult(index=index, id=item.id, status="updated" if item.model_fields_set - {"id"} else "unchanged"))
+    return _batch_response(results)
+
+
+@router.post("/locations/batch/delete", response_model=BatchResponse)
+async def delete_locations_batch(request: Request):
+    """Delete many locations with one read and one write.
+
+    Body: a JSON array (or NDJSON) of location IDs.
+    """
+    items = await _read_batch_items(request)
+    valid, results = _validate_batch(items, _uuid_adapter.validate_python)
+    logger.info(f"Batch delete: {len(valid)} valid and {len(results)} invalid items.")
+    try:
+        deleted = await crud_locations.delete_locations([location_id for _, location_id in valid])
+    except Exception as e:
+        logger.error(f"Unexpected error in batch delete of {len(valid)} locations: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while deleting locations.")
+    for (index, location_id), was_deleted in zip(valid, deleted):
+        if was_deleted:
+            results.append(BatchItemResult(index=index, id=location_id, status="deleted"))
+        else:
+            results.append(BatchItemResult(index=index, id=location_id, status="not_found", error="Location not found"))
+    return _batch_response(results)
+
+
+def _wants_ndjson(request: Request) -> bool:
+    accept = request.headers.get("accept", "").lower()
+    return any(media_type in accept for media_type in NDJSON_MEDIA_TYPES)
+
+
+def _list_etag(version: Optional[str], request: Request, ndjson: bool) -> str:
+    # Changes whenever the stored data does, and differs per query and representation
+    key = json.dumps([version, ndjson, sorted(request.query_params.multi_items())])
+    return f'"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+async def _ndjson_chunks(locations: List[LocationModel], include: Optional[Set[str]]) -> AsyncIterator[str]:
+    # Serialise lazily, a chunk at a time, so the first bytes go out before the whole page is encoded
+    for start in range(0, len(locations), NDJSON_STREAM_CHUNK_SIZE):
+        chunk = locations[start:start + NDJSON_STREAM_CHUNK_SIZE]
+        yield "".join(loc.model_dump_json(include=include) + "\n" for loc in chunk)
+
+
 @router.get("/locations", response_model=List[LocationModel])
-def read_all_locations():
+async def read_all_locations(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, description="Page size. Omit to return every matching location."),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page."),
+    fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. 'id,name,latitude,longitude'."),
+    where: Optional[List[str]] = Query(None, description="enrichment_data filter, repeatable: 'population>=5000', 'region==Otago'."),
+):
+    try:
+        include = parse_fields(fields)
+        predicates = parse_predicates(where)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    max_limit = _get_page_max_limit()
+    if limit is not None and limit > max_limit:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"limit may be at most {max_limit}.")
+
     try:
         logger.info("Fetching all locations.")
-        all_locations = crud_locations.get_all_locations()
-        logger.info(f"Retrieved {len(all_locations)} locations.")
-        return all_locations
+        all_locations, version = await crud_locations.get_all_locations_with_version()
     except Exception as e:
         logger.error(f"Error reading all locations: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while fetching locations.")
 
+    ndjson = _wants_ndjson(request)
+    etag = _list_etag(version, request, ndjson)
+    headers = {"ETag": etag, "Vary": "Accept", "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        logger.info(f"Locations unchanged since version {version}; returning 304.")
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        page, next_cursor = select_page(all_locations, predicates, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    logger.info(f"Retrieved {len(page)} of {len(all_locations)} locations.")
+
+    if ndjson:
+        return StreamingResponse(_ndjson_chunks(page, include), media_type="application/x-ndjson", headers=headers)
+    return Response(content=locations_to_json(page, include), media_type="application/json", headers=headers)
+
+
+def _parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    try:
+        south, west, north, east = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="bbox must be 'south,west,north,east' in degrees.")
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="bbox out of range: need -90 <= south <= north <= 90 and longitudes within [-180, 180].")
+    return south, west, north, east
+
+
+# Declared before /locations/{location_id} so "nearby" isn't parsed as an ID
+@router.get("/locations/nearby", response_model=List[NearbyLocation])
+async def read_nearby_locations(
+    lat: Optional[float] = Query(None, ge=-90, le=90, description="Query point latitude."),
+    lng: Optional[float] = Query(None, ge=-180, le=180, description="Query point longitude."),
+    radius_km: Optional[float] = Query(None, gt=0, description="Return locations within this distance of (lat, lng)."),
+    bbox: Optional[str] = Query(None, description="Return locations inside 'south,west,north,east' (west > east crosses the antimeridian)."),
+    limit: Optional[int] = Query(None, ge=1, description="Return at most this many (nearest first)."),
+):
+    """Radius or bounding-box query answered from the in-memory spatial index, nearest first.
+
+    Distances are straight-line, from (lat, lng) or, for a bbox without a point, the box centre.
+    Locations without coordinates are never returned. No Maps API calls are made.
+    """
+    if (radius_km is None) == (bbox is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Provide either radius_km (with lat and lng) or bbox.")
+    if (lat is None) != (lng is None) or (radius_km is not None and lat is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="lat and lng must be given together (and are required with radius_km).")
+    center = (lat, lng) if lat is not None else None
+
+    try:
+        index = await crud_locations.get_location_index()
+    except Exception as e:
+        logger.error(f"Error loading location index: {e}", exc_info=True)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error while fetching locations.")
+
+    if radius_km is not None:
+        matches = index.within_radius(center, radius_km, limit)
+    else:
+        matches = index.within_bbox(*_parse_bbox(bbox), center=center, limit=limit)
+    logger.info(f"Spatial query matched {len(matches)} of {len(index)} locations.")
+    return [NearbyLocation(**loc.model_dump(), distance_km=round(distance, 3)) for loc, distance in matches]
+
 
 @router.get("/locations/{location_id}", response_model=LocationModel)
-def read_location_by_id(location_id: uuid.UUID):
+async def read_location_by_id(location_id: uuid.UUID):
     logger.info(f"Fetching location with ID: {location_id}")
-    location = crud_locations.get_location_by_id(location_id)
+    location = await crud_locations.get_location_by_id(location_id)
     if location is None:
         logger.warning(f"Location with ID {location_id} not found.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Location not found")
@@ -47,20 +309,22 @@ def read_location_by_id(location_id: uuid.UUID):
 
 
 @router.put("/locations/{location_id}", response_model=LocationModel)
-def update_existing_location(location_id: uuid.UUID, location_update_data: LocationUpdate):
+async def update_existing_location(location_id: uuid.UUID, location_update_data: LocationUpdate):
     logger.info(f"Attempting to update location ID: {location_id}")
-    updated_location = crud_locations.update_location(location_id, location_update_data)
+    updated_location = await crud_locations.update_location(location_id, location_update_data)
     if updated_location is None:
         logger.warning(f"Update failed: Location with ID {location_id} not found.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Location not found for update")
     logger.info(f"Successfully updated location ID {location_id}.")
+    if "address" in location_update_data.model_fields_set:
+        await _enqueue_enrichment([location_id], force=True)
     return updated_location
 
 
 @router.delete("/locations/{location_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_existing_location(location_id: uuid.UUID):
+async def delete_existing_location(location_id: uuid.UUID):
     logger.info(f"Attempting to delete location ID: {location_id}")
-    deleted = crud_locations.delete_location(location_id)
+    deleted = await crud_locations.delete_location(location_id)
     if not deleted:
         logger.warning(f"Deletion failed: Location with ID {location_id} not found.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Location not found for deletion")
@@ -0,0 +1,413 @@
+import os
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.crud import locations as crud_locations
+from app.crud.geocode_cache import get_geocode_cache
+from app.crud.storage import run_storage_io
+from app.metrics import count, timed
+from app.models.location import EnrichmentJobStatus, LocationModel
+
+logger = logging.getLogger(__name__)
+
+LatLng = Tuple[float, float]
+
+MAX_JOB_ERRORS = 10 # Error messages kept per job for the status endpoint
+MAPS_CLIENT_RETRY_SECONDS = 30 # After the Maps client can't be created, fail fast for this long before trying again
+
+
+def _get_worker_count() -> int:
+    # 0 disables the background worker (filter requests then geocode inline)
+    return int(os.environ.get("ENRICHMENT_WORKERS", "4"))
+
+def _get_rate_per_second() -> float:
+    # Keep this below the project's Maps quota, leaving headroom for user-facing requests
+    return float(os.environ.get("ENRICHMENT_MAPS_QPS", "10"))
+
+def _get_burst() -> int:
+    return int(os.environ.get("ENRICHMENT_MAPS_BURST", "20"))
+
+def _get_batch_size() -> int:
+    return int(os.environ.get("ENRICHMENT_BATCH_SIZE", "50"))
+
+def _get_flush_interval_seconds() -> float:
+    return float(os.environ.get("ENRICHMENT_FLUSH_INTERVAL_SECONDS", "2"))
+
+def _get_job_history() -> int:
+    return int(os.environ.get("ENRICHMENT_JOB_HISTORY", "100"))
+
+def _get_default_tasks() -> List[str]:
+    return [task.strip() for task in os.environ.get("ENRICHMENT_TASKS", "place").split(",") if task.strip()]
+
+
+class TokenBucket:
+    """Async token bucket: refills at `rate` tokens per second and banks at most `capacity`.
+
+    Waiters are served in arrival order, so a burst of workers can't starve one another.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class EnrichmentContext:
+    """What an enrichment task gets besides the location: rate-limited Maps access.
+
+    Geocoding results are memoised per address, so the coordinates step and tasks that read
+    address components share a single API call. The Maps client is only created once needed.
+    """
+
+    def __init__(self, maps_client: Callable[[], Awaitable[Any]], rate_limiter: TokenBucket):
+        self.maps_client = maps_client
+        self.rate_limiter = rate_limiter
+        self._geocode_results: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def geocode(self, address: str) -> List[Dict[str, Any]]:
+        if address not in self._geocode_results:
+            await self.rate_limiter.acquire()
+            gmaps = await self.maps_client()
+            self._geocode_results[address] = await gmaps.geocode(address)
+        return self._geocode_results[address]
+
+
+# An enrichment task returns the value stored under its name in enrichment_data (None: nothing to store)
+EnrichmentTask = Callable[[LocationModel, EnrichmentContext], Awaitable[Optional[Any]]]
+
+_tasks: Dict[str, EnrichmentTask] = {}
+
+def register_enrichment_task(name: str, task: EnrichmentTask) -> None:
+    """Makes `task` available to enrichment jobs; its result is stored as enrichment_data[name]."""
+    _tasks[name] = task
+
+def available_tasks() -> List[str]:
+    return sorted(_tasks)
+
+
+# Geocoding address component type -> key stored by the "place" task
+_PLACE_COMPONENTS = {
+    "locality": "locality",
+    "sublocality": "suburb",
+    "administrative_area_level_1": "region",
+    "postal_code": "postal_code",
+}
+
+async def _place_task(location: LocationModel, context: EnrichmentContext) -> Optional[Dict[str, Any]]:
+    # Normalised address and its locality / region / postcode, from the Geocoding API
+    results = await context.geocode(location.address)
+    if not results:
+        return None
+    place = {"formatted_address": results[0].get("formatted_address")}
+    for component in results[0].get("address_components", []):
+        for component_type in component.get("types", []):
+            key = _PLACE_COMPONENTS.get(component_type)
+            if key and key not in place:
+                place[key] = component.get("long_name")
+    return place
+
+register_enrichment_task("place", _place_task)
+
+
+def _needs_coordinates(location: LocationModel) -> bool:
+    return location.latitude is None or location.longitude is None
+
+def _pending_tasks(location: LocationModel, tasks: Iterable[str], force: bool) -> List[str]:
+    enrichment_data = location.enrichment_data or {}
+    return [task for task in tasks if force or task not in enrichment_data]
+
+
+class EnrichmentJob:
+    def __init__(self, tasks: List[str], force: bool):
+        self.id = uuid.uuid4()
+        self.tasks = tasks
+        self.force = force
+        self.status = "queued"
+        self.total = 0
+        self.processed = 0
+        self.geocoded = 0
+        self.enriched = 0
+        self.skipped = 0
+        self.failed = 0 # Locations, not errors: one location can report several errors
+        self.unsaved = 0 # Results processed but not yet written back
+        self.errors: List[str] = []
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+
+    def record_error(self, message: str) -> None:
+        if len(self.errors) < MAX_JOB_ERRORS:
+            self.errors.append(message)
+
+    def record_failure(self, message: str) -> None:
+        # A location that produced nothing (or whose results were lost)
+        self.failed += 1
+        self.record_error(message)
+
+    def check_finished(self) -> None:
+        if self.finished_at is None and self.processed >= self.total and self.unsaved == 0:
+            self.status = "failed" if self.total and self.failed == self.total else "completed"
+            self.finished_at = datetime.now(timezone.utc)
+            logger.info(f"Enrichment job {self.id} {self.status}: {self.geocoded} geocoded, {self.enriched} enriched, {self.skipped} skipped, {self.failed} failed.")
+
+    def to_status(self) -> EnrichmentJobStatus:
+        return EnrichmentJobStatus(
+            id=self.id, status=self.status, tasks=self.tasks, total=self.total, processed=self.processed,
+            geocoded=self.geocoded, enriched=self.enriched, skipped=self.skipped, failed=self.failed,
+            errors=self.errors, created_at=self.created_at, finished_at=self.finished_at,
+        )
+
+
+class EnrichmentWorker:
+    """Background pool that geocodes locations and runs enrichment tasks off the request path.
+
+    Jobs enqueue location ids; `workers` tasks process them, with every Maps call passing
+    through one token bucket sized to the API quota. Results are buffered and written back
+    in batches (one storage write per `batch_size` results or `flush_interval` seconds).
+    Jobs and the queue are per process and do not survive a restart.
+    """
+
+    def __init__(self, maps_client_factory: Callable[[], Awaitable[Any]], workers: int, rate_limiter: TokenBucket,
+                 batch_size: int, flush_interval: float, job_history: int):
+        self.maps_client_factory = maps_client_factory
+        self.workers = workers
+        self.rate_limiter = rate_limiter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.job_history = job_history
+        self._queue: "asyncio.Queue[Tuple[EnrichmentJob, uuid.UUID]]" = asyncio.Queue()
+        self._jobs: "OrderedDict[uuid.UUID, EnrichmentJob]" = OrderedDict()
+        self._active: Set[uuid.UUID] = set() # Queued, being processed, or waiting to be written
+        # location id -> (address, coords, enrichment_data entries, jobs waiting on it)
+        self._results: Dict[uuid.UUID, Tuple[str, Optional[LatLng], Dict[str, Any], List[EnrichmentJob]]] = {}
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._gmaps = None
+        self._gmaps_lock = asyncio.Lock()
+        self._gmaps_error: Optional[Tuple[float, Exception]] = None # (monotonic time, error) of the last failed creation
+        self._running: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._running)
+
+    def start(self) -> None:
+        if self._running:
+            return
+        self._running = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._running.append(asyncio.create_task(self._flush_periodically()))
+        logger.info(f"Started enrichment worker pool ({self.workers} workers, {self.rate_limiter.rate:g} Maps requests/s).")
+
+    async def stop(self) -> None:
+        for task in self._running:
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._running = []
+        await self.flush() # Keep work that was already done
+
+    async def _maps_client(self):
+        # Created on first use. A failure is re-raised to every caller for MAPS_CLIENT_RETRY_SECONDS
+        # instead of fetching the API key again for each location.
+        async with self._gmaps_lock:
+            if self._gmaps is None:
+                if self._gmaps_error is not None and time.monotonic() - self._gmaps_error[0] < MAPS_CLIENT_RETRY_SECONDS:
+                    raise self._gmaps_error[1]
+                try:
+                    self._gmaps = await self.maps_client_factory()
+                except Exception as e:
+                    self._gmaps_error = (time.monotonic(), e)
+                    raise
+                self._gmaps_error = None
+            return self._gmaps
+
+    async def submit(self, location_ids: Optional[Iterable[uuid.UUID]] = None, tasks: Optional[List[str]] = None, force: bool = False) -> EnrichmentJob:
+        """Creates a job for the given locations (default: every location that still needs enrichment)."""
+        tasks = _get_default_tasks() if tasks is None else tasks
+        unknown = [task for task in tasks if task not in _tasks]
+        if unknown:
+            raise ValueError(f"Unknown enrichment tasks: {', '.join(unknown)}. Available: {', '.join(available_tasks())}.")
+
+        job = EnrichmentJob(tasks, force)
+        if location_ids is None:
+            locations = await crud_locations.get_all_locations()
+            location_ids = [loc.id for loc in locations if _needs_coordinates(loc) or _pending_tasks(loc, tasks, force)]
+
+        for location_id in dict.fromkeys(location_ids): # Drop repeats, keep order
+            job.total += 1
+            if location_id in self._active:
+                job.processed += 1
+                job.skipped += 1 # Another job will take care of it
+                continue
+            self._active.add(location_id)
+            self._queue.put_nowait((job, location_id))
+
+        self._jobs[job.id] = job
+        self._trim_jobs()
+        job.check_finished()
+        logger.info(f"Enrichment job {job.id} queued for {job.total} locations (tasks: {', '.join(tasks) or 'none'}).")
+        return job
+
+    def _trim_jobs(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(self._jobs) - self.job_history)]:
+            del self._jobs[job_id]
+
+    def is_active(self, location_id: uuid.UUID) -> bool:
+        """Whether the location is queued, being processed, or has results waiting to be written."""
+        return location_id in self._active
+
+    def get_job(self, job_id: uuid.UUID) -> Optional[EnrichmentJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[EnrichmentJob]:
+        return list(reversed(self._jobs.values())) # Newest first
+
+    async def _work(self) -> None:
+        while True:
+            job, location_id = await self._queue.get()
+            try:
+                if job.status == "queued":
+                    job.status = "running"
+                await self._process(job, location_id)
+            except Exception as e:
+                logger.error(f"Error enriching location {location_id} (job {job.id}): {e}", exc_info=True)
+                job.record_failure(f"{location_id}: {e}")
+                count("enrichment_locations", result="failed")
+                self._active.discard(location_id)
+            finally:
+                job.processed += 1
+                job.check_finished()
+                self._queue.task_done()
+
+    async def _process(self, job: EnrichmentJob, location_id: uuid.UUID) -> None:
+        location = (await crud_locations.get_location_index()).get(location_id)
+        tasks = _pending_tasks(location, job.tasks, job.force) if location is not None else []
+        if location is None or not (_needs_coordinates(location) or tasks):
+            job.skipped += 1
+            count("enrichment_locations", result="skipped")
+            self._active.discard(location_id)
+            return
+
+        context = EnrichmentContext(self._maps_client, self.rate_limiter)
+        coords = None
+        if _needs_coordinates(location):
+            cache = get_geocode_cache()
+            if not cache.loaded:
+                await run_storage_io(cache.ensure_loaded)
+            coords = cache.get(location.address)
+            if coords is None:
+                results = await context.geocode(location.address)
+                if results:
+                    geometry = results[0]["geometry"]["location"]
+                    coords = (geometry["lat"], geometry["lng"])
+                    cache.put(location.address, coords)
+            if coords is None:
+                job.record_error(f"{location_id}: could not geocode address '{location.address}'")
+
+        enrichment = {}
+        for task in tasks:
+            try:
+                value = await _tasks[task](location, context)
+            except Exception as e:
+                logger.error(f"Enrichment task '{task}' failed for location {location_id}: {e}", exc_info=True)
+                job.record_error(f"{location_id}: task '{task}' failed: {e}")
+                continue
+            if value is not None:
+                enrichment[task] = value
+
+        if coords is None and not enrichment:
+            job.failed += 1 # The reasons were recorded above
+            count("enrichment_locations", result="failed")
+            self._active.discard(location_id)
+            return
+        if coords is not None:
+            job.geocoded += 1
+        if enrichment:
+            job.enriched += 1
+        count("enrichment_locations", result="enriched")
+
+        job.unsaved += 1
+        _, _, _, jobs = self._results.get(location_id, (None, None, None, []))
+        self._results[location_id] = (location.address, coords, enrichment, jobs + [job])
+        if len(self._results) >= self.batch_size:
+            self._flush_requested.set()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Enrichment: periodic flush failed: {e}", exc_info=True) # Keep flushing later results
+
+    async def flush(self) -> None:
+        """Writes buffered results back with one storage write and persists the geocode cache."""
+        async with self._flush_lock:
+            if not self._results:
+                return
+            results, self._results = self._results, {}
+            try:
+                try:
+                    with timed("enrichment_write"):
+                        saved = await crud_locations.apply_enrichment_results({location_id: result[:3] for location_id, result in results.items()})
+                    logger.info(f"Enrichment: wrote back {saved} of {len(results)} results.")
+                except Exception as e:
+                    logger.error(f"Error writing back {len(results)} enrichment results: {e}", exc_info=True)
+                    for location_id, (_, _, _, jobs) in results.items():
+                        for job in jobs:
+                            job.record_failure(f"{location_id}: write-back failed: {e}")
+                await run_storage_io(get_geocode_cache().flush)
+            finally:
+                # Jobs finish and locations can be queued again even if persisting failed
+                for location_id, (_, _, _, jobs) in results.items():
+                    self._active.discard(location_id)
+                    for job in jobs:
+                        job.unsaved -= 1
+                        job.check_finished()
+
+
+_worker: Optional[EnrichmentWorker] = None
+
+def get_enrichment_worker() -> Optional[EnrichmentWorker]:
+    """The running worker pool, or None if it is disabled or not started."""
+    return _worker
+
+def start_enrichment_worker(maps_client_factory: Callable[[], Awaitable[Any]]) -> Optional[EnrichmentWorker]:
+    """Starts the worker pool (called from the startup hook). Returns None if ENRICHMENT_WORKERS is 0."""
+    global _worker
+    workers = _get_worker_count()
+    if workers <= 0:
+        logger.info("Background enrichment disabled (ENRICHMENT_WORKERS=0).")
+        return None
+    if _worker is None:
+        rate_limiter = TokenBucket(_get_rate_per_second(), _get_burst())
+        _worker = EnrichmentWorker(maps_client_factory, workers, rate_limiter, _get_batch_size(), _get_flush_interval_seconds(), _get_job_history())
+    _worker.start()
+    return _worker
+
+async def stop_enrichment_worker() -> None:
+    global _worker
+    if _worker is not None:
+        await _worker.stop()
+        _worker = None
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+import operator
+import re
+import uuid
+from typing import Any, Callable, List, Optional, Sequence, Set, Tuple
+
+from app.models.location import LocationModel
+
+Predicate = Callable[[LocationModel], bool]
+
+_PREDICATE_RE = re.compile(r"^\s*([^<>=!\s]+)\s*(==|!=|>=|<=|=|>|<)\s*(.*?)\s*$")
+_RANGE_OPERATORS = {">=": operator.ge, "<=": operator.le, ">": operator.gt, "<": operator.lt}
+_MISSING = object()
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Set[str]]:
+    """Parses a comma separated field list ("id,name,latitude") into a projection set (None = all fields)."""
+    if not fields:
+        return None
+    selected = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = selected - LocationModel.model_fields.keys()
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}. Valid fields: {', '.join(LocationModel.model_fields)}.")
+    return selected or None
+
+
+def _coerce(raw: str) -> Any:
+    # "1000" -> 1000, "true" -> True, "Otago" -> "Otago"
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _enrichment_value(loc: LocationModel, path: Sequence[str]) -> Any:
+    value: Any = loc.enrichment_data or {}
+    for key in path:
+        if not isinstance(value, dict):
+            return _MISSING
+        value = value.get(key, _MISSING)
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def parse_predicate(expression: str) -> Predicate:
+    """Parses one enrichment_data filter, e.g. "population>=5000", "region==Otago" or "schools.count<3".
+
+    Dotted keys reach into nested objects. <, <=, >, >= compare numerically and never match
+    non-numeric values; == and != compare with the value parsed as JSON where possible.
+    Locations without the key only match !=.
+    """
+    match = _PREDICATE_RE.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter '{expression}'. Expected <key><op><value> with op one of ==, !=, >=, <=, >, <.")
+    key, op, raw_value = match.groups()
+    path = key.split(".")
+    expected = _coerce(raw_value)
+
+    if op in _RANGE_OPERATORS:
+        if not _is_number(expected):
+            raise ValueError(f"Filter '{expression}' needs a numeric value for '{op}'.")
+        compare = _RANGE_OPERATORS[op]
+        return lambda loc: _is_number(value := _enrichment_value(loc, path)) and compare(value, expected)
+
+    negate = op == "!="
+    return lambda loc: (_enrichment_value(loc, path) == expected) != negate
+
+
+def parse_predicates(expressions: Optional[List[str]]) -> List[Predicate]:
+    return [parse_predicate(expression) for expression in expressions or []]
+
+
+def encode_cursor(location_id: uuid.UUID, position: int) -> str:
+    payload = json.dumps({"after": str(location_id), "pos": position}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[uuid.UUID, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        location_id, position = uuid.UUID(payload["after"]), int(payload["pos"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if position < 0:
+        raise ValueError("Invalid cursor.")
+    return location_id, position
+
+
+def _start_position(locations: Sequence[LocationModel], cursor: Optional[str]) -> int:
+    if not cursor:
+        return 0
+    after_id, position = _decode_cursor(cursor)
+    # Fast path: the cursor's location is still where it was
+    if position < len(locations) and locations[position].id == after_id:
+        return position + 1
+    for i, loc in enumerate(locations):
+        if loc.id == after_id:
+            return i + 1
+    # The location was deleted since; the next one has moved up into its position
+    return min(position, len(locations))
+
+
+def select_page(
+    locations: Sequence[LocationModel],
+    predicates: Sequence[Predicate] = (),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> Tuple[List[LocationModel], Optional[str]]:
+    """Applies filters and cursor pagination in a single pass over the catalogue (in catalogue order).
+
+    Returns (page, cursor for the next page or None if this is the last one). Cursors point
+    after a location ID, so pages stay consistent while locations are added or updated.
+    """
+    page: List[LocationModel] = []
+    last_position = -1
+    for position in range(_start_position(locations, cursor), len(locations)):
+        loc = locations[position]
+        if not all(predicate(loc) for predicate in predicates):
+            continue
+        if limit is not None and len(page) == limit:
+            # Only hand out a cursor when another match actually exists
+            return page, encode_cursor(page[-1].id, last_position)
+        page.append(loc)
+        last_position = position
+    return page, None
@@ -0,0 +1,273 @@
+import os
+import asyncio
+import logging
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import anyio
+import httpx
+
+from app.crud.geocode_cache import get_geocode_cache, normalise_address
+from app.crud.storage import run_storage_io
+from app.metrics import count, timed
+from app.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+LatLng = Tuple[float, float]
+
+MAPS_API_BASE_URL = "https://maps.googleapis.com/maps/api"
+
+# Distance Matrix API limits: at most 25 origins or 25 destinations, and 100 elements, per request.
+MAX_ORIGINS_PER_REQUEST = 25
+MAX_DESTINATIONS_PER_REQUEST = 25
+MAX_ELEMENTS_PER_REQUEST = 100
+
+# Statuses worth retrying after a backoff rather than failing straight away
+_RETRYABLE_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR", "HTTP_ERROR"}
+
+# Metric names per web service path
+_API_NAMES = {"/geocode/json": "geocode", "/distancematrix/json": "distance_matrix"}
+
+
+def _get_max_workers() -> int:
+    # Maximum number of Distance Matrix requests in flight per call
+    return max(1, int(os.environ.get("DISTANCE_MATRIX_MAX_WORKERS", "8")))
+
+def _get_http_max_connections() -> int:
+    return int(os.environ.get("MAPS_HTTP_MAX_CONNECTIONS", "100"))
+
+def _get_http_timeout_seconds() -> float:
+    return float(os.environ.get("MAPS_HTTP_TIMEOUT_SECONDS", "10"))
+
+def _get_max_attempts() -> int:
+    return int(os.environ.get("MAPS_MAX_ATTEMPTS", "3"))
+
+def _get_geocode_coalesce_timeout_seconds() -> float:
+    # Upper bound on a shared geocode (including retries) that concurrent callers wait for
+    return float(os.environ.get("SINGLEFLIGHT_GEOCODE_TIMEOUT_SECONDS", "30"))
+
+
+def _chunk(items: Sequence, size: int) -> List[Sequence]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def destinations_per_request(num_origins: int) -> int:
+    return max(1, min(MAX_DESTINATIONS_PER_REQUEST, MAX_ELEMENTS_PER_REQUEST // max(1, num_origins)))
+
+
+def _format_latlng(coords: LatLng) -> str:
+    return f"{coords[0]:.6f},{coords[1]:.6f}"
+
+
+class MapsApiError(Exception):
+    """The Maps web service returned an error status (REQUEST_DENIED, INVALID_REQUEST, ...)."""
+
+    def __init__(self, status: str, message: Optional[str] = None):
+        super().__init__(f"{status}: {message}" if message else status)
+        self.status = status
+
+
+class AsyncMapsClient:
+    """Minimal async client for the Geocoding and Distance Matrix web services.
+
+    Returns the same shapes as the googlemaps package (geocode -> list of results,
+    distance_matrix -> full response body). It runs on the shared, connection-pooled
+    httpx.AsyncClient, so requests reuse keep-alive connections instead of paying a
+    TLS handshake each time.
+    """
+
+    def __init__(self, api_key: str, http_client: httpx.AsyncClient, base_url: str = MAPS_API_BASE_URL):
+        self.api_key = api_key
+        self.http_client = http_client
+        self.base_url = base_url
+
+    async def _request_once(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        api = _API_NAMES.get(path, path)
+        status = "TRANSPORT_ERROR"
+        try:
+            with timed(f"maps_{api}"):
+                response = await self.http_client.get(f"{self.base_url}{path}", params=params)
+            if response.status_code >= 500:
+                status = "HTTP_ERROR"
+                raise MapsApiError("HTTP_ERROR", f"HTTP {response.status_code}")
+            response.raise_for_status()
+            body = response.json()
+            status = body.get("status") or "UNKNOWN"
+            if status not in ("OK", "ZERO_RESULTS"):
+                raise MapsApiError(body.get("status"), body.get("error_message"))
+            return body
+        finally:
+            count("maps_requests", api=api, status=status)
+
+    async def _request(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        params = dict(params, key=self.api_key)
+        max_attempts = _get_max_attempts()
+        for attempt in range(1, max_attempts + 1):
+            try:
+                return await self._request_once(path, params)
+            except (httpx.TransportError, MapsApiError) as e:
+                retryable = isinstance(e, httpx.TransportError) or e.status in _RETRYABLE_STATUSES
+                if not retryable or attempt == max_attempts:
+                    raise
+                delay = 0.2 * (2 ** (attempt - 1)) * (1 + random.random())
+                logger.warning(f"Maps request {path} failed ({e}); retrying in {delay:.2f}s (attempt {attempt}/{max_attempts}).")
+                await asyncio.sleep(delay)
+
+    async def geocode(self, address: str) -> List[Dict[str, Any]]:
+        body = await self._request("/geocode/json", {"address": address})
+        return body.get("results", [])
+
+    async def distance_matrix(self, origins: Sequence[LatLng], destinations: Sequence[LatLng], mode: str = "driving") -> Dict[str, Any]:
+        count("maps_elements", len(origins) * len(destinations))
+        return await self._request("/distancematrix/json", {
+            "origins": "|".join(_format_latlng(origin) for origin in origins),
+            "destinations": "|".join(_format_latlng(destination) for destination in destinations),
+            "mode": mode,
+        })
+
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def init_http_client() -> httpx.AsyncClient:
+    """Creates the shared HTTP connection pool used for Maps requests (called at startup)."""
+    global _http_client
+    if _http_client is None:
+        max_connections = _get_http_max_connections()
+        _http_client = httpx.AsyncClient(
+            timeout=_get_http_timeout_seconds(),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        logger.info(f"Created shared Maps HTTP client (max {max_connections} connections).")
+    return _http_client
+
+def get_http_client() -> httpx.AsyncClient:
+    return init_http_client() # Normally already created by the startup hook
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+        logger.info("Closed shared Maps HTTP client.")
+
+
+# Element statuses meaning the destination can't be driven to (as opposed to a failed request)
+UNROUTABLE_STATUSES = {"NOT_FOUND", "ZERO_RESULTS", "MAX_ROUTE_LENGTH_EXCEEDED"}
+REQUEST_FAILED = "REQUEST_FAILED"
+
+RouteResult = Tuple[str, Optional[int]] # (element status, duration in seconds if status is OK)
+
+
+async def _fetch_chunk(gmaps: AsyncMapsClient, origins: Sequence[LatLng], destinations: Sequence[LatLng]) -> List[List[RouteResult]]:
+    # One Distance Matrix request; results[i][j] is origins[i] -> destinations[j]
+    try:
+        matrix = await gmaps.distance_matrix(origins=list(origins), destinations=list(destinations), mode="driving")
+    except Exception as e:
+        logger.error(f"Distance Matrix request for {len(origins)}x{len(destinations)} elements failed: {e}", exc_info=True)
+        return [[(REQUEST_FAILED, None)] * len(destinations) for _ in origins]
+
+    results: List[List[RouteResult]] = []
+    not_ok = []
+    for row in matrix['rows']:
+        row_results: List[RouteResult] = []
+        for destination, element in zip(destinations, row['elements']):
+            if element['status'] == 'OK':
+                row_results.append(('OK', element['duration']['value']))
+            else:
+                row_results.append((element['status'], None))
+                not_ok.append((destination, element['status']))
+        results.append(row_results)
+    # One summary line per request instead of a log call (and string formatting) per element
+    if not_ok:
+        logger.info(f"Distance Matrix returned no route for {len(not_ok)} of {len(origins) * len(destinations)} elements (e.g. {not_ok[0][0]}: {not_ok[0][1]}).")
+    return results
+
+
+async def get_driving_matrix(gmaps: AsyncMapsClient, origins: Sequence[LatLng], destinations: Sequence[LatLng]) -> List[List[RouteResult]]:
+    """Returns (status, duration in seconds) for every origin x destination pair.
+
+    `result[i][j]` is origins[i] -> destinations[j]. All origins go into each request (the API
+    allows up to 25), so destinations are packed MAX_ELEMENTS_PER_REQUEST // len(origins) per
+    request. Requests run concurrently, at most DISTANCE_MATRIX_MAX_WORKERS at a time. Pairs
+    in a request that failed get the REQUEST_FAILED status.
+    """
+    if not origins:
+        return []
+    if not destinations:
+        return [[] for _ in origins]
+
+    origin_chunks = _chunk(origins, MAX_ORIGINS_PER_REQUEST)
+    chunks = _chunk(destinations, destinations_per_request(len(origin_chunks[0])))
+    limiter = anyio.CapacityLimiter(_get_max_workers())
+    logger.debug(f"Requesting driving times for {len(origins)}x{len(destinations)} pairs in {len(origin_chunks) * len(chunks)} Distance Matrix requests.")
+
+    async def fetch(origin_chunk: Sequence[LatLng], chunk: Sequence[LatLng]) -> List[List[RouteResult]]:
+        async with limiter:
+            return await _fetch_chunk(gmaps, origin_chunk, chunk)
+
+    results = await asyncio.gather(*(fetch(origin_chunk, chunk) for origin_chunk in origin_chunks for chunk in chunks))
+    rows: List[List[RouteResult]] = []
+    for origin_index, origin_chunk in enumerate(origin_chunks):
+        chunk_results = results[origin_index * len(chunks):(origin_index + 1) * len(chunks)]
+        for row in range(len(origin_chunk)):
+            rows.append([result for block in chunk_results for result in block[row]])
+    return rows
+
+
+async def get_driving_results(gmaps: AsyncMapsClient, origin: LatLng, destinations: Sequence[LatLng]) -> List[RouteResult]:
+    """Returns (status, duration in seconds) from origin to each destination, in input order.
+
+    Destinations are packed into as few Distance Matrix requests as the API allows (see
+    get_driving_matrix). Destinations in a chunk whose request failed get the REQUEST_FAILED status.
+    """
+    if not destinations:
+        return []
+    return (await get_driving_matrix(gmaps, [origin], destinations))[0]
+
+
+def schedule_driving_results(gmaps: AsyncMapsClient, origin: LatLng, destinations: Sequence[LatLng]) -> List["asyncio.Task[Tuple[int, List[RouteResult]]]"]:
+    """Starts the Distance Matrix requests from origin to destinations without waiting for them.
+
+    Each task resolves to (offset into destinations, results for that chunk), so callers can use
+    results as they arrive (asyncio.wait / as_completed). Requests are sent in chunk order, at most
+    DISTANCE_MATRIX_MAX_WORKERS at a time. Callers must cancel the tasks they stop waiting for;
+    a cancelled task still waiting for a slot never sends its request.
+    """
+    chunk_size = destinations_per_request(1)
+    limiter = anyio.CapacityLimiter(_get_max_workers())
+
+    async def fetch(offset: int) -> Tuple[int, List[RouteResult]]:
+        async with limiter:
+            return offset, (await _fetch_chunk(gmaps, [origin], destinations[offset:offset + chunk_size]))[0]
+
+    return [asyncio.create_task(fetch(offset)) for offset in range(0, len(destinations), chunk_size)]
+
+
+_geocodes = SingleFlight("geocode")
+
+async def _geocode_uncached(gmaps: AsyncMapsClient, address: str) -> Optional[LatLng]:
+    geocode_result = await gmaps.geocode(address)
+    if not geocode_result:
+        return None
+    location = geocode_result[0]['geometry']['location']
+    coords = (location['lat'], location['lng'])
+    get_geocode_cache().put(address, coords)
+    return coords
+
+
+async def geocode_address(gmaps: AsyncMapsClient, address: str) -> Optional[LatLng]:
+    """Geocodes an address through the geocode cache; only cache misses reach the Geocoding API.
+
+    Concurrent misses for the same (normalised) address share one API request. Returns None if
+    the API has no result for the address. API errors propagate to the caller (to every caller
+    sharing the request).
+    """
+    cache = get_geocode_cache()
+    if not cache.loaded:
+        await run_storage_io(cache.ensure_loaded)
+    coords = cache.get(address)
+    count("geocode_cache", result="hit" if coords is not None else "miss")
+    if coords is not None:
+        return coords
+    return await _geocodes.do(normalise_address(address), lambda: _geocode_uncached(gmaps, address), timeout=_get_geocode_coalesce_timeout_seconds())
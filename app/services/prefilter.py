@@ -0,0 +1,78 @@
+import os
+import logging
+from typing import Any, Dict, Hashable, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _get_max_road_speed_kmh() -> float:
+    # Upper bound on average road speed. A location further (in a straight line) than this speed
+    # can cover within the time limit can't be reached by road either. NZ open road limit is 110 km/h.
+    return float(os.environ.get("PREFILTER_MAX_ROAD_SPEED_KMH", "110"))
+
+
+def coordinates_array(coords: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Packs (lat, lng) pairs into a contiguous (n, 2) float64 array."""
+    return np.ascontiguousarray(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+
+
+class CoordinateTable:
+    """Catalogue coordinates packed once into a contiguous (n, 2) array, with each location's row.
+
+    Built once per catalogue version (cached next to the LocationIndex), so requests index into it
+    instead of packing Python tuples into a new array every time.
+    """
+
+    def __init__(self, location_ids: Sequence[Hashable], coords: Sequence[Tuple[float, float]]):
+        self.coords = coordinates_array(coords)
+        self._rows: Dict[Any, Tuple[int, float, float]] = {location_id: (row, lat, lng) for row, (location_id, (lat, lng)) in enumerate(zip(location_ids, coords))}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def select(self, location_ids: Sequence[Hashable], destinations: Dict[Any, Tuple[float, float]]) -> np.ndarray:
+        """(len(location_ids), 2) array of destinations[location_id], in order.
+
+        Rows come from the cached array wherever its coordinates match destinations; the rest (e.g.
+        addresses geocoded during this request, or a newer catalogue version) are packed separately.
+        """
+        if not len(self._rows):
+            return coordinates_array([destinations[location_id] for location_id in location_ids])
+        rows = np.empty(len(location_ids), dtype=np.intp)
+        other = []
+        for position, location_id in enumerate(location_ids):
+            entry = self._rows.get(location_id)
+            if entry is not None and (entry[1], entry[2]) == destinations[location_id]:
+                rows[position] = entry[0]
+            else:
+                rows[position] = 0
+                other.append(position)
+        selected = self.coords[rows]
+        if other:
+            selected[other] = coordinates_array([destinations[location_ids[position]] for position in other])
+        return selected
+
+
+def haversine_km(origin: Tuple[float, float], coords: np.ndarray) -> np.ndarray:
+    """Great-circle distances in km from origin to every row of an (n, 2) lat/lng array, in one pass."""
+    lat1, lng1 = np.radians(origin[0]), np.radians(origin[1])
+    lat2 = np.radians(coords[:, 0])
+    lng2 = np.radians(coords[:, 1])
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def reachable_mask(origin: Tuple[float, float], coords: np.ndarray, max_driving_time_minutes: float) -> np.ndarray:
+    """Boolean mask of rows that could possibly be reached within the time limit.
+
+    Uses straight-line distance as a lower bound on road distance and the configured maximum
+    road speed as an upper bound on speed, so it never discards a location that is reachable.
+    """
+    if coords.shape[0] == 0:
+        return np.zeros(0, dtype=bool)
+    max_distance_km = _get_max_road_speed_kmh() * max_driving_time_minutes / 60.0
+    return haversine_km(origin, coords) <= max_distance_km
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+from app.metrics import count, registry
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+registry.describe("singleflight_calls", "Calls through a single-flight group: leaders ran the work, coalesced calls shared it.")
+registry.describe("singleflight_failures", "Shared computations that failed or timed out (every waiter gets the error).")
+
+
+class SingleFlight:
+    """Coalesces identical concurrent async operations.
+
+    The first caller for a key (the leader) starts the work; callers arriving with the same key
+    while it runs wait for that result instead of repeating it, and all of them get the same
+    value or exception. The work runs in its own task, so a caller that goes away (e.g. a client
+    disconnect) doesn't cancel it for the others. A timeout bounds the shared work: when it
+    expires the work is cancelled and every waiter gets TimeoutError. Only in-flight calls are
+    shared; nothing is cached once the work finishes.
+
+    Event-loop only (not thread safe).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, "asyncio.Task"] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """Returns func()'s result, sharing one execution among concurrent callers with the same key.
+
+        `timeout` (seconds, None: no limit) only applies when this call starts the work.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            count("singleflight_calls", group=self.name, result="leader")
+            task = asyncio.create_task(self._run(key, func, timeout))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            count("singleflight_calls", group=self.name, result="coalesced")
+            logger.debug(f"Single-flight '{self.name}': joined in-flight call for {key!r}.")
+        # shield: a waiter being cancelled must not cancel the shared task
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, func: Callable[[], Awaitable[T]], timeout: Optional[float]) -> T:
+        try:
+            if timeout is None:
+                return await func()
+            return await asyncio.wait_for(func(), timeout)
+        except asyncio.TimeoutError:
+            count("singleflight_failures", group=self.name, reason="timeout")
+            logger.warning(f"Single-flight '{self.name}': call for {key!r} timed out after {timeout}s.")
+            raise
+        except Exception:
+            count("singleflight_failures", group=self.name, reason="error")
+            raise
+
+    def _forget(self, key: Hashable, task: "asyncio.Task") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception() # Marks it retrieved, so an error nobody waited for isn't logged as unhandled
@@ -0,0 +1,133 @@
+import os
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import anyio
+
+logger = logging.getLogger(__name__)
+
+
+def _get_warmup_mode() -> str:
+    # "background": serve immediately, /ready turns 200 once warm | "blocking": finish before serving | "off"
+    return os.environ.get("STARTUP_WARMUP", "background").lower()
+
+def _get_warmup_steps() -> List[str]:
+    return [step.strip() for step in os.environ.get("STARTUP_WARMUP_STEPS", "maps_key,locations,geocode_cache").split(",") if step.strip()]
+
+def _get_warmup_timeout_seconds() -> float:
+    return float(os.environ.get("STARTUP_WARMUP_TIMEOUT_SECONDS", "30"))
+
+
+async def _warm_maps_key() -> None:
+    from app.dependencies import _get_google_maps_api_key
+    await anyio.to_thread.run_sync(_get_google_maps_api_key) # Blocking Secret Manager call (and client import)
+
+async def _warm_locations() -> None:
+    from app.crud.storage import load_location_index_async
+    await load_location_index_async() # Downloads the snapshot and builds the id / spatial indexes
+
+async def _warm_geocode_cache() -> None:
+    from app.crud.geocode_cache import get_geocode_cache
+    from app.crud.storage import run_storage_io
+    await run_storage_io(get_geocode_cache().ensure_loaded)
+
+WARMUP_STEPS: Dict[str, Callable[[], Awaitable[None]]] = {
+    "maps_key": _warm_maps_key,
+    "locations": _warm_locations,
+    "geocode_cache": _warm_geocode_cache,
+}
+
+
+class StartupReport:
+    """Where cold-start time goes: module imports, the startup hook and each warm-up step."""
+
+    def __init__(self):
+        self.import_seconds: Optional[float] = None
+        self.startup_hook_seconds: Optional[float] = None
+        self.warmup_mode = "off"
+        self.warmup_seconds: Optional[float] = None
+        self.steps: Dict[str, Dict[str, Any]] = {} # step -> {"seconds": ..., "error": ...}
+        self.ready = False
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "import_seconds": self.import_seconds,
+            "startup_hook_seconds": self.startup_hook_seconds,
+            "warmup_mode": self.warmup_mode,
+            "warmup_seconds": self.warmup_seconds,
+            "steps": self.steps,
+        }
+
+    def summary(self) -> str:
+        def seconds(value: Optional[float]) -> str:
+            return "-" if value is None else f"{value:.3f}s"
+        steps = ", ".join(f"{name} {seconds(step['seconds'])}{' (failed)' if step.get('error') else ''}" for name, step in self.steps.items())
+        return f"imports {seconds(self.import_seconds)}, startup hook {seconds(self.startup_hook_seconds)}, warm-up {seconds(self.warmup_seconds)}" + (f" ({steps})" if steps else "")
+
+
+report = StartupReport()
+
+
+def record_import_time(seconds: float) -> None:
+    report.import_seconds = round(seconds, 4)
+
+
+async def _run_step(name: str) -> None:
+    started = time.perf_counter()
+    error = None
+    try:
+        await WARMUP_STEPS[name]()
+    except asyncio.CancelledError:
+        error = "timed out"
+        raise
+    except Exception as e:
+        # Not fatal: the first request that needs it retries (and reports) the same work
+        error = getattr(e, "detail", None) or str(e) or type(e).__name__
+        logger.warning(f"Warm-up step '{name}' failed: {error}")
+    finally:
+        report.steps[name] = {"seconds": round(time.perf_counter() - started, 4), "error": error}
+
+
+async def run_warmup() -> None:
+    """Runs the configured warm-up steps concurrently, then marks the app ready.
+
+    Failed or timed-out steps don't keep the app from becoming ready; they are reported in the
+    startup report and /ready.
+    """
+    steps = [step for step in _get_warmup_steps() if step in WARMUP_STEPS]
+    unknown = set(_get_warmup_steps()) - set(steps)
+    if unknown:
+        logger.warning(f"Ignoring unknown warm-up steps: {', '.join(sorted(unknown))}. Available: {', '.join(WARMUP_STEPS)}.")
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(_run_step(step)) for step in steps]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=_get_warmup_timeout_seconds())
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    report.warmup_seconds = round(time.perf_counter() - started, 4)
+    report.ready = True
+    logger.info(f"Warm-up complete. Cold start: {report.summary()}.")
+
+
+async def start_warmup() -> Optional[asyncio.Task]:
+    """Starts warm-up according to STARTUP_WARMUP (called from the startup hook).
+
+    Returns the background task in "background" mode; otherwise warm-up is finished (or skipped)
+    when this returns.
+    """
+    mode = _get_warmup_mode()
+    report.warmup_mode = mode
+    if mode == "blocking":
+        await run_warmup()
+        return None
+    if mode == "background":
+        return asyncio.create_task(run_warmup())
+    if mode != "off":
+        logger.warning(f"Unknown STARTUP_WARMUP mode '{mode}'; skipping warm-up.")
+    report.ready = True
+    logger.info(f"Warm-up disabled. Cold start: {report.summary()}.")
+    return None
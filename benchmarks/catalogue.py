@@ -0,0 +1,66 @@
+"""Synthetic New Zealand location catalogues for benchmarks."""
+import random
+import uuid
+from typing import List
+
+from app.models.location import LocationModel
+
+# Population centres locations are clustered around: (name, lat, lng, weight)
+_TOWNS = [
+    ("Auckland", -36.85, 174.76, 34),
+    ("Wellington", -41.29, 174.78, 11),
+    ("Christchurch", -43.53, 172.63, 8),
+    ("Hamilton", -37.79, 175.28, 5),
+    ("Tauranga", -37.69, 176.17, 4),
+    ("Dunedin", -45.87, 170.50, 3),
+    ("Palmerston North", -40.35, 175.61, 2),
+    ("Nelson", -41.27, 173.28, 2),
+    ("Napier", -39.49, 176.91, 2),
+    ("New Plymouth", -39.06, 174.08, 2),
+    ("Queenstown", -45.03, 168.66, 1),
+    ("Whangarei", -35.73, 174.32, 1),
+    ("Invercargill", -46.41, 168.35, 1),
+    ("Gisborne", -38.66, 178.02, 1),
+]
+_STREETS = ["Main", "High", "Victoria", "Queen", "King", "Church", "Station", "Beach", "Hill", "Park", "Ridge", "Bay"]
+_SUFFIXES = ["Street", "Road", "Avenue", "Terrace", "Crescent", "Drive", "Lane"]
+_REGIONS = ["Northland", "Auckland", "Waikato", "Bay of Plenty", "Wellington", "Canterbury", "Otago", "Southland"]
+
+
+def generate_catalogue(size: int, seed: int = 0, missing_coordinates_fraction: float = 0.05) -> List[LocationModel]:
+    """Builds `size` locations clustered around NZ towns, with some enrichment data.
+
+    A fraction of locations have no coordinates, so filter requests exercise the geocoding path
+    (their addresses resolve through FakeMapsClient). The same seed gives the same catalogue.
+    """
+    rng = random.Random(seed)
+    weights = [town[3] for town in _TOWNS]
+    locations = []
+    for i in range(size):
+        town, lat, lng, _ = rng.choices(_TOWNS, weights)[0]
+        address = f"{rng.randint(1, 400)} {rng.choice(_STREETS)} {rng.choice(_SUFFIXES)}, {town} #{i}"
+        if rng.random() < missing_coordinates_fraction:
+            latitude = longitude = None
+        else:
+            latitude, longitude = lat + rng.gauss(0, 0.15), lng + rng.gauss(0, 0.15)
+        locations.append(LocationModel(
+            id=uuid.UUID(int=rng.getrandbits(128), version=4),
+            name=f"Candidate {i} ({town})",
+            address=address,
+            latitude=latitude,
+            longitude=longitude,
+            notes=rng.choice([None, "Close to the beach", "Needs work", "Good schools"]),
+            enrichment_data={
+                "population": rng.randint(500, 200000),
+                "region": rng.choice(_REGIONS),
+                "median_rent": rng.randint(350, 900),
+            },
+        ))
+    return locations
+
+
+def source_addresses(count: int, seed: int = 0) -> List[str]:
+    """Distinct source addresses for filter requests (each resolves to a different origin)."""
+    rng = random.Random(seed + 1)
+    return [f"{rng.randint(1, 400)} {rng.choice(_STREETS)} {rng.choice(_SUFFIXES)}, Origin {i}" for i in range(count)]
+
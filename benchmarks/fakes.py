@@ -0,0 +1,134 @@
+"""Local stand-ins for GCS and the Google Maps web services, with configurable latency."""
+import asyncio
+import hashlib
+import math
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.crud.backends.base import LocationStorageBackend, PreconditionFailedError, Record, decode_snapshot, encode_json
+
+LatLng = Tuple[float, float]
+
+# Rough bounding box of the New Zealand mainland
+NZ_SOUTH, NZ_NORTH = -46.6, -34.4
+NZ_WEST, NZ_EAST = 166.4, 178.6
+
+
+class FakeStorageBackend(LocationStorageBackend):
+    """In-memory single-document backend that behaves like GCSSnapshotBackend.
+
+    Every call sleeps for its configured latency (in the calling storage worker thread, like a
+    real blocking GCS request) and is counted in `calls`. Documents are encoded and decoded as
+    they would be on GCS, so serialisation cost is measured too.
+    """
+
+    def __init__(self, read_latency: float = 0.0, write_latency: float = 0.0, metadata_latency: float = 0.0):
+        self.read_latency = read_latency
+        self.write_latency = write_latency
+        self.metadata_latency = metadata_latency
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._data: Optional[bytes] = None
+        self._generation = 0
+        self._sidecars: Dict[str, bytes] = {}
+
+    def _call(self, name: str, latency: float) -> None:
+        with self._lock:
+            self.calls[name] += 1
+        if latency:
+            time.sleep(latency)
+
+    def describe(self) -> str:
+        return "fake://locations.json"
+
+    def get_version(self) -> Optional[str]:
+        self._call("get_version", self.metadata_latency)
+        return str(self._generation) if self._generation else None
+
+    def read(self) -> Tuple[List[Record], Optional[str]]:
+        self._call("read", self.read_latency)
+        with self._lock:
+            data, generation = self._data, self._generation
+        records, _ = decode_snapshot(data)
+        return records, str(generation) if generation else None
+
+    def write_snapshot(self, records: List[Record], if_version_match: Optional[str] = None) -> Optional[str]:
+        self._call("write_snapshot", self.write_latency)
+        data = encode_json(records)
+        with self._lock:
+            current = str(self._generation) if self._generation else None
+            if current != if_version_match:
+                raise PreconditionFailedError(f"Generation mismatch (expected {if_version_match}, found {current})")
+            self._data = data
+            self._generation += 1
+            return str(self._generation)
+
+    def seed(self, records: List[Record]) -> None:
+        """Stores a catalogue without counting it as a call or sleeping."""
+        with self._lock:
+            self._data = encode_json(records)
+            self._generation += 1
+
+    def read_sidecar(self, name: str) -> Optional[bytes]:
+        self._call("read_sidecar", self.read_latency)
+        with self._lock:
+            return self._sidecars.get(name)
+
+    def write_sidecar(self, name: str, data: bytes) -> None:
+        self._call("write_sidecar", self.write_latency)
+        with self._lock:
+            self._sidecars[name] = data
+
+
+def fake_coordinates(address: str) -> LatLng:
+    """Deterministic pseudo-random NZ coordinates for an address."""
+    digest = hashlib.sha256(address.encode("utf-8")).digest()
+    fraction_lat = int.from_bytes(digest[:4], "big") / 2**32
+    fraction_lng = int.from_bytes(digest[4:8], "big") / 2**32
+    return NZ_SOUTH + fraction_lat * (NZ_NORTH - NZ_SOUTH), NZ_WEST + fraction_lng * (NZ_EAST - NZ_WEST)
+
+
+def _fake_duration_seconds(origin: LatLng, destination: LatLng) -> int:
+    # Straight-line distance * 1.3 road factor at 80 km/h
+    lat1, lat2 = math.radians(origin[0]), math.radians(destination[0])
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(destination[1] - origin[1]) / 2) ** 2
+    distance_km = 2 * 6371.0088 * math.asin(math.sqrt(min(1.0, h)))
+    return int(distance_km * 1.3 / 80 * 3600)
+
+
+class FakeMapsClient:
+    """Drop-in for AsyncMapsClient returning deterministic results after a configurable delay.
+
+    Roughly 2% of destinations come back as ZERO_RESULTS, so the unroutable path is exercised.
+    Counts requests and Distance Matrix elements in `calls`.
+    """
+
+    def __init__(self, geocode_latency: float = 0.0, matrix_latency: float = 0.0):
+        self.geocode_latency = geocode_latency
+        self.matrix_latency = matrix_latency
+        self.calls: Counter = Counter()
+
+    async def geocode(self, address: str) -> List[Dict[str, Any]]:
+        self.calls["geocode"] += 1
+        if self.geocode_latency:
+            await asyncio.sleep(self.geocode_latency)
+        lat, lng = fake_coordinates(address)
+        return [{"geometry": {"location": {"lat": lat, "lng": lng}}}]
+
+    async def distance_matrix(self, origins: Sequence[LatLng], destinations: Sequence[LatLng], mode: str = "driving") -> Dict[str, Any]:
+        self.calls["distance_matrix"] += 1
+        self.calls["distance_matrix_elements"] += len(origins) * len(destinations)
+        if self.matrix_latency:
+            await asyncio.sleep(self.matrix_latency)
+        rows = []
+        for origin in origins:
+            elements = []
+            for destination in destinations:
+                if hashlib.sha256(repr(destination).encode()).digest()[0] < 5: # ~2%
+                    elements.append({"status": "ZERO_RESULTS"})
+                else:
+                    elements.append({"status": "OK", "duration": {"value": _fake_duration_seconds(origin, destination)}})
+            rows.append({"elements": elements})
+        return {"status": "OK", "rows": rows}
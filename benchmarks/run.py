@@ -0,0 +1,279 @@
+"""Benchmark harness: drives the FastAPI app in-process against local stand-ins for GCS and Maps.
+
+Nothing external is contacted: storage is FakeStorageBackend and Maps is FakeMapsClient, both
+with configurable latency. Results (throughput, latency percentiles, external call counts,
+peak memory) are written as JSON so runs can be compared between commits.
+
+Run from the repository root:
+
+    python -m benchmarks.run --sizes 10,1000,100000 --scenarios crud,list,filter
+    python -m benchmarks.run --output benchmarks/results/$(git rev-parse --short HEAD).json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.catalogue import generate_catalogue, source_addresses
+from benchmarks.fakes import FakeMapsClient, FakeStorageBackend
+
+logger = logging.getLogger("benchmarks")
+
+API = "/api/v1"
+SCENARIOS = {
+    "crud": ["crud_mixed"],
+    "list": ["list_full", "list_page", "list_not_modified"],
+    "filter": ["filter_cold", "filter_warm"],
+}
+
+RequestFactory = Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+
+
+def _git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _reset_app_state(backend: FakeStorageBackend) -> None:
+    # Fresh backend, snapshot cache and persisted-tier caches, so scenarios don't warm each other
+    from app.crud import geocode_cache, storage, travel_times
+    storage.set_storage_backend(backend)
+    geocode_cache._geocode_cache = None
+    travel_times._travel_time_store = None
+
+
+async def _drive(client: httpx.AsyncClient, factories: List[RequestFactory], concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(factory: RequestFactory) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await factory(client)
+                statuses[str(response.status_code)] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(factory) for factory in factories))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if not (status.isdigit() and int(status) < 400))
+    return {
+        "requests": len(factories),
+        "errors": errors,
+        "status_counts": dict(statuses),
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(len(factories) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None,
+            "p50": round(_percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+            "p90": round(_percentile(latencies, 0.90) * 1000, 3) if latencies else None,
+            "p99": round(_percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            "max": round(latencies[-1] * 1000, 3) if latencies else None,
+        },
+    }
+
+
+def _crud_requests(ids: List[str], count: int, rng: random.Random) -> List[RequestFactory]:
+    # 50% reads, 20% creates, 20% updates, 10% deletes. Deletes use their own slice of IDs so
+    # reads and updates never race them into 404s.
+    delete_pool = ids[: max(1, len(ids) // 10)]
+    live_ids = ids[len(delete_pool):] or ids
+    factories: List[RequestFactory] = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < 0.5:
+            location_id = rng.choice(live_ids)
+            factories.append(lambda c, location_id=location_id: c.get(f"{API}/locations/{location_id}"))
+        elif roll < 0.7:
+            body = {"name": f"Bench {i}", "address": f"{i} Benchmark Road, Wellington", "latitude": -41.29, "longitude": 174.78}
+            factories.append(lambda c, body=body: c.post(f"{API}/locations", json=body))
+        elif roll < 0.9:
+            location_id = rng.choice(live_ids)
+            factories.append(lambda c, location_id=location_id, i=i: c.put(f"{API}/locations/{location_id}", json={"notes": f"note {i}"}))
+        elif delete_pool:
+            location_id = delete_pool.pop()
+            factories.append(lambda c, location_id=location_id: c.delete(f"{API}/locations/{location_id}"))
+        else:
+            factories.append(lambda c: c.get(f"{API}/locations/{live_ids[0]}"))
+    return factories
+
+
+async def _scenario_requests(name: str, client: httpx.AsyncClient, ids: List[str], args: argparse.Namespace, rng: random.Random) -> List[RequestFactory]:
+    count = args.requests
+    if name == "crud_mixed":
+        return _crud_requests(ids, count, rng)
+    if name == "list_full":
+        return [lambda c: c.get(f"{API}/locations")] * count
+    if name == "list_page":
+        params = {"limit": 100, "fields": "id,name,latitude,longitude"}
+        return [lambda c: c.get(f"{API}/locations", params=params)] * count
+    if name == "list_not_modified":
+        etag = (await client.get(f"{API}/locations")).headers.get("etag", "")
+        return [lambda c: c.get(f"{API}/locations", headers={"If-None-Match": etag})] * count
+    body = {"max_driving_time_minutes": args.max_driving_minutes, "sort_by_driving_time": True, "limit": 50}
+    if name == "filter_cold":
+        # Every request comes from a new origin: geocoding and Distance Matrix calls on each
+        addresses = source_addresses(args.filter_requests, args.seed)
+        return [lambda c, address=address: c.post(f"{API}/filter_by_driving_time", json=dict(body, source_address=address)) for address in addresses]
+    if name == "filter_warm":
+        # Same origin every time, after one untimed request that fills the caches
+        warm_body = dict(body, source_address="1 Lambton Quay, Wellington")
+        await client.post(f"{API}/filter_by_driving_time", json=warm_body)
+        return [lambda c: c.post(f"{API}/filter_by_driving_time", json=warm_body)] * args.filter_requests
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+async def _run_scenario(app, client: httpx.AsyncClient, name: str, size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    from app.crud.serialization import locations_to_records
+    from app.routers import filters
+
+    locations = generate_catalogue(size, seed=args.seed)
+    backend = FakeStorageBackend(args.storage_read_latency_ms / 1000, args.storage_write_latency_ms / 1000, args.storage_metadata_latency_ms / 1000)
+    backend.seed(locations_to_records(locations))
+    maps = FakeMapsClient(args.maps_latency_ms / 1000, args.maps_latency_ms / 1000)
+    app.dependency_overrides[filters.get_maps_client] = lambda: maps
+    _reset_app_state(backend)
+
+    rng = random.Random(args.seed)
+    factories = await _scenario_requests(name, client, [str(loc.id) for loc in locations], args, rng)
+    backend.calls.clear()
+    maps.calls.clear()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    result = await _drive(client, factories, args.concurrency)
+    if args.trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result["peak_traced_memory_mb"] = round(peak / (1024 * 1024), 2)
+    result["peak_rss_mb"] = round(_peak_rss_mb(), 2)
+    result.update({
+        "scenario": name,
+        "catalogue_size": size,
+        "storage_calls": dict(backend.calls),
+        "maps_calls": dict(maps.calls),
+    })
+    return result
+
+
+def _print_result(result: Dict[str, Any]) -> None:
+    latency = result["latency_ms"]
+    external = sum(result["storage_calls"].values()) + result["maps_calls"].get("geocode", 0) + result["maps_calls"].get("distance_matrix", 0)
+    print(
+        f"{result['scenario']:<18} {result['catalogue_size']:>7} {result['throughput_rps']:>10} "
+        f"{latency['p50']:>9} {latency['p99']:>9} {result['errors']:>6} {external:>9} {result['peak_rss_mb']:>9}"
+    )
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    from app.main import app
+    logging.getLogger().setLevel(args.log_level)
+
+    scenario_names = [name for group in args.scenarios for name in SCENARIOS[group]]
+    results = []
+    print(f"{'scenario':<18} {'size':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'errors':>6} {'ext calls':>9} {'rss MB':>9}")
+
+    _reset_app_state(FakeStorageBackend())
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False) # Unhandled errors become 500s, as behind a server
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for size in args.sizes:
+                for name in scenario_names:
+                    result = await _run_scenario(app, client, name, size, args)
+                    _print_result(result)
+                    results.append(result)
+    finally:
+        await app.router.shutdown()
+        app.dependency_overrides.clear()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items()},
+        },
+        "results": results,
+    }
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the Where To Live API against local GCS / Maps stand-ins.")
+    parser.add_argument("--sizes", default="10,1000,10000", type=lambda value: [int(size) for size in value.split(",")], help="Catalogue sizes (comma separated, e.g. 10,1000,100000)")
+    parser.add_argument("--scenarios", default="crud,list,filter", type=lambda value: value.split(","), help=f"Scenario groups: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per CRUD / list scenario")
+    parser.add_argument("--filter-requests", type=int, default=20, help="Requests per filter scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--max-driving-minutes", type=int, default=60)
+    parser.add_argument("--storage-read-latency-ms", type=float, default=30.0)
+    parser.add_argument("--storage-write-latency-ms", type=float, default=50.0)
+    parser.add_argument("--storage-metadata-latency-ms", type=float, default=10.0)
+    parser.add_argument("--maps-latency-ms", type=float, default=80.0)
+    parser.add_argument("--cache-ttl", type=float, default=None, help="Overrides LOCATIONS_CACHE_TTL_SECONDS")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure peak Python heap with tracemalloc (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmarks/results/latest.json", help="Where to write the JSON results")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - SCENARIOS.keys()
+    if unknown:
+        parser.error(f"Unknown scenario group(s): {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = _parse_args(argv)
+    # Storage is the fake backend regardless of the environment, but the app still reads these
+    os.environ.setdefault("GCS_BUCKET_NAME", "benchmark")
+    # Filter scenarios measure the request path; background enrichment would compete with it
+    os.environ.setdefault("ENRICHMENT_WORKERS", "0")
+    if args.cache_ttl is not None:
+        os.environ["LOCATIONS_CACHE_TTL_SECONDS"] = str(args.cache_ttl)
+
+    report = asyncio.run(_run(args))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
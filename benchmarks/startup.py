@@ -0,0 +1,186 @@
+"""Cold-start report: import time, startup hook and warm-up, and the first request after each.
+
+Every measurement runs in a fresh interpreter, as a new Cloud Run instance would. Storage is
+FakeStorageBackend (seeded with a synthetic catalogue, with configurable latency), so no GCP
+project is needed. The Maps key warm-up step needs Secret Manager and is left out.
+
+Run from the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --output benchmarks/results/startup-$(git rev-parse --short HEAD).json
+    python -m benchmarks.startup --compare benchmarks/results/startup-abc1234.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# Client libraries that should only be imported when first used
+LAZY_MODULES = ["google.cloud.secretmanager", "google.cloud.storage", "google.api_core"]
+
+WARMUP_MODES = ["off", "blocking"]
+
+
+def _child_env(args: argparse.Namespace) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("GCS_BUCKET_NAME", "benchmark")
+    env["ENRICHMENT_WORKERS"] = "0"
+    env["STARTUP_WARMUP_STEPS"] = "locations,geocode_cache"
+    return env
+
+
+def _import_profile(args: argparse.Namespace) -> Dict[str, Any]:
+    """`python -X importtime -c "import app.main"`: total, self time per top-level package, lazy modules loaded."""
+    code = f"import json, sys, app.main; print(json.dumps([name for name in {LAZY_MODULES!r} if name in sys.modules]))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=_child_env(args), check=True)
+    by_package: Counter = Counter()
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        by_package[name.split(".")[0]] += int(self_us)
+        if name == "app.main":
+            total_us = int(cumulative_us)
+    return {
+        "app_main_seconds": total_us / 1e6,
+        "top_packages_seconds": {package: us / 1e6 for package, us in by_package.most_common(args.top)},
+        "lazy_modules_imported": json.loads(result.stdout.strip().splitlines()[-1]),
+    }
+
+
+def _child(args: argparse.Namespace) -> None:
+    # Runs in the fresh interpreter: import the app first, so nothing below skews its import time
+    import time
+    started = time.perf_counter()
+    from app.main import app
+    import_seconds = time.perf_counter() - started
+
+    import asyncio
+    import httpx
+    from app.crud import storage
+    from app.crud.serialization import locations_to_records
+    from app.startup import report
+    from benchmarks.catalogue import generate_catalogue
+    from benchmarks.fakes import FakeStorageBackend
+
+    backend = FakeStorageBackend(args.storage_read_latency_ms / 1000, 0, args.storage_metadata_latency_ms / 1000)
+    backend.seed(locations_to_records(generate_catalogue(args.size, seed=0)))
+    storage.set_storage_backend(backend)
+
+    async def run() -> Dict[str, Any]:
+        started = time.perf_counter()
+        await app.router.startup()
+        startup_seconds = time.perf_counter() - started
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            started = time.perf_counter()
+            response = await client.get("/api/v1/locations/nearby", params={"lat": -41.29, "lng": 174.78, "radius_km": 5, "limit": 10})
+            first_request_seconds = time.perf_counter() - started
+        await app.router.shutdown()
+        return {
+            "import_seconds": import_seconds,
+            "startup_seconds": startup_seconds,
+            "first_request_seconds": first_request_seconds,
+            "first_request_status": response.status_code,
+            "report": report.as_dict(),
+        }
+
+    print(json.dumps(asyncio.run(run())))
+
+
+def _run_child(args: argparse.Namespace, mode: str) -> Dict[str, Any]:
+    env = _child_env(args)
+    env["STARTUP_WARMUP"] = mode
+    command = [
+        sys.executable, "-m", "benchmarks.startup", "--child", "--size", str(args.size),
+        "--storage-read-latency-ms", str(args.storage_read_latency_ms), "--storage-metadata-latency-ms", str(args.storage_metadata_latency_ms),
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, env=env, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _median(runs: List[Dict[str, Any]], key: str) -> float:
+    return round(statistics.median(run[key] for run in runs), 4)
+
+
+def _compare(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({(baseline['meta'].get('git') or {}).get('commit')}):")
+    rows = [("import (app.main)", current["imports"]["app_main_seconds"], baseline["imports"]["app_main_seconds"])]
+    for mode, result in current["modes"].items():
+        if mode in baseline["modes"]:
+            for key in ("startup_seconds", "first_request_seconds"):
+                rows.append((f"{mode} {key}", result[key], baseline["modes"][mode][key]))
+    for label, now, before in rows:
+        change = (now - before) / before * 100 if before else 0.0
+        print(f"  {label:<32} {before:>8.3f}s -> {now:>8.3f}s  ({change:+.0f}%)")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Measure cold-start import, startup and warm-up time in fresh interpreters.")
+    parser.add_argument("--size", type=int, default=10000, help="Catalogue size in the fake storage")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh processes per measurement (medians are reported)")
+    parser.add_argument("--storage-read-latency-ms", type=float, default=150.0)
+    parser.add_argument("--storage-metadata-latency-ms", type=float, default=30.0)
+    parser.add_argument("--top", type=int, default=10, help="Packages listed in the import profile")
+    parser.add_argument("--output", default="benchmarks/results/startup.json")
+    parser.add_argument("--compare", default=None, help="Earlier results JSON to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        _child(args)
+        return
+
+    from benchmarks.run import _git_revision
+
+    profiles = [_import_profile(args) for _ in range(args.repeat)]
+    imports = {
+        "app_main_seconds": round(statistics.median(profile["app_main_seconds"] for profile in profiles), 4),
+        "top_packages_seconds": profiles[-1]["top_packages_seconds"],
+        "lazy_modules_imported": profiles[-1]["lazy_modules_imported"],
+    }
+    print(f"import app.main: {imports['app_main_seconds']:.3f}s (median of {args.repeat})")
+    for package, seconds in imports["top_packages_seconds"].items():
+        print(f"  {package:<24} {seconds:.3f}s")
+    if imports["lazy_modules_imported"]:
+        print(f"  WARNING: imported at startup although they should be lazy: {', '.join(imports['lazy_modules_imported'])}")
+
+    modes = {}
+    print(f"\n{'warm-up':<10} {'startup s':>10} {'1st request s':>14} {'warm-up s':>10}")
+    for mode in WARMUP_MODES:
+        runs = [_run_child(args, mode) for _ in range(args.repeat)]
+        modes[mode] = {
+            "startup_seconds": _median(runs, "startup_seconds"),
+            "first_request_seconds": _median(runs, "first_request_seconds"),
+            "warmup_seconds": runs[-1]["report"]["warmup_seconds"],
+            "steps": runs[-1]["report"]["steps"],
+        }
+        print(f"{mode:<10} {modes[mode]['startup_seconds']:>10.3f} {modes[mode]['first_request_seconds']:>14.3f} {modes[mode]['warmup_seconds'] or 0:>10.3f}")
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": _git_revision(),
+            "python": sys.version.split()[0],
+            "args": {key: value for key, value in vars(args).items() if key != "child"},
+        },
+        "imports": imports,
+        "modes": modes,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        _compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import asyncio
+import unittest
+import uuid
+from unittest import mock
+
+from app.crud import locations as crud_locations
+from app.services.enrichment import EnrichmentJob, EnrichmentWorker, TokenBucket
+
+
+async def _no_maps_client():
+    raise AssertionError("Maps should not be needed")
+
+
+class FlushFailureTest(unittest.TestCase):
+    def test_failed_write_back_finishes_jobs_and_releases_locations(self):
+        async def scenario():
+            worker = EnrichmentWorker(_no_maps_client, 1, TokenBucket(10, 10), 50, 0.01, 10)
+            job = EnrichmentJob(["place"], False)
+            location_id = uuid.uuid4()
+            job.total = job.processed = job.unsaved = 1
+            worker._active.add(location_id)
+            worker._results[location_id] = ("1 Test Street", (-41.29, 174.78), {}, [job])
+            failing = mock.AsyncMock(side_effect=RuntimeError("storage unavailable"))
+            with mock.patch.object(crud_locations, "apply_enrichment_results", failing):
+                await worker.flush()
+            return worker, job, location_id
+
+        worker, job, location_id = asyncio.run(scenario())
+
+        self.assertFalse(worker.is_active(location_id))
+        self.assertEqual(job.unsaved, 0)
+        self.assertEqual(job.failed, 1)
+        self.assertEqual(job.status, "failed")
+        self.assertIn(str(location_id), job.errors[0])
+
+    def test_periodic_flush_survives_a_failed_flush(self):
+        async def scenario():
+            worker = EnrichmentWorker(_no_maps_client, 1, TokenBucket(10, 10), 50, 0.01, 10)
+            flushes = 0
+            async def flaky_flush():
+                nonlocal flushes
+                flushes += 1
+                if flushes == 1:
+                    raise RuntimeError("storage unavailable")
+            worker.flush = flaky_flush
+            task = asyncio.create_task(worker._flush_periodically())
+            await asyncio.sleep(0.1)
+            alive = not task.done()
+            task.cancel()
+            return alive, flushes
+
+        alive, flushes = asyncio.run(scenario())
+
+        self.assertTrue(alive)
+        self.assertGreater(flushes, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
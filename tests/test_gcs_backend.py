@@ -0,0 +1,44 @@
+import unittest
+from unittest import mock
+
+from google.api_core import exceptions as gcs_exceptions
+
+from app.crud.backends.base import encode_json
+from app.crud.backends.gcs import GCSSnapshotBackend
+
+
+def _blob(generation: int, data: bytes = b"", error: Exception = None) -> mock.Mock:
+    blob = mock.Mock(generation=generation)
+    blob.download_as_bytes.side_effect = error or (lambda **kwargs: data)
+    return blob
+
+
+class ReadRaceTest(unittest.TestCase):
+    """Another instance replaces the blob between the metadata lookup and the download."""
+
+    def setUp(self):
+        self.backend = GCSSnapshotBackend(mock.Mock(), "bucket", "locations.json")
+        self.bucket = self.backend.bucket
+        sleep = mock.patch("app.crud.backends.base.time.sleep")
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def test_read_retries_when_the_generation_changes(self):
+        current = encode_json([{"id": "b"}])
+        self.bucket.get_blob.side_effect = [
+            _blob(1, error=gcs_exceptions.PreconditionFailed("generation changed")),
+            _blob(2, current),
+        ]
+
+        records, version = self.backend.read()
+
+        self.assertEqual((records, version), ([{"id": "b"}], "2"))
+
+    def test_sidecar_read_retries_when_the_blob_is_replaced(self):
+        self.bucket.get_blob.side_effect = [_blob(1, error=gcs_exceptions.NotFound("gone")), _blob(2, b"{}")]
+
+        self.assertEqual(self.backend.read_sidecar("geocode_cache.json"), b"{}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from app.crud import locations as crud_locations
+from app.crud import storage
+from app.crud.backends.local import LocalLogBackend
+from app.crud.serialization import locations_to_records
+from app.models.location import LocationModel, LocationUpdate
+from benchmarks.fakes import FakeStorageBackend
+
+WRITERS = 8
+WRITES_PER_WRITER = 25
+
+
+def _location(i: int) -> LocationModel:
+    return LocationModel(name=f"Location {i}", address=f"{i} Test Street, Wellington")
+
+
+class ConcurrentChangesTest(unittest.TestCase):
+    def tearDown(self):
+        storage.set_storage_backend(None)
+
+    def _apply_concurrently(self, locations):
+        with ThreadPoolExecutor(max_workers=WRITERS) as pool:
+            list(pool.map(lambda loc: storage.apply_location_changes(upserts=[loc]), locations))
+
+    def _stored_ids(self, backend):
+        records, _ = backend.read()
+        return {record["id"] for record in records}
+
+    def test_single_blob_writes_from_one_process_do_not_conflict(self):
+        backend = FakeStorageBackend()
+        storage.set_storage_backend(backend)
+        locations = [_location(i) for i in range(WRITERS * WRITES_PER_WRITER)]
+
+        self._apply_concurrently(locations)
+
+        self.assertEqual(self._stored_ids(backend), {str(loc.id) for loc in locations})
+        self.assertEqual(backend.calls["write_snapshot"], len(locations)) # No precondition retries
+
+    def test_single_blob_write_retries_after_another_instance_wrote(self):
+        backend = FakeStorageBackend()
+        storage.set_storage_backend(backend)
+        first, other, second = _location(1), _location(2), _location(3)
+        storage.apply_location_changes(upserts=[first])
+        # Another instance writes; our cached snapshot is now stale
+        backend.seed(locations_to_records([first, other]))
+
+        storage.apply_location_changes(upserts=[second])
+
+        self.assertEqual(self._stored_ids(backend), {str(first.id), str(other.id), str(second.id)})
+
+    @mock.patch.dict(os.environ, {"LOCATIONS_LOG_COMPACT_THRESHOLD": "1000000"}) # No background compaction racing the cleanup
+    def test_log_backend_concurrent_changes(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            backend = LocalLogBackend(data_dir, "locations.json")
+            storage.set_storage_backend(backend)
+            locations = [_location(i) for i in range(WRITERS * WRITES_PER_WRITER)]
+
+            self._apply_concurrently(locations)
+
+            self.assertEqual(self._stored_ids(backend), {str(loc.id) for loc in locations})
+
+
+class StaleCacheUpdateTest(unittest.TestCase):
+    """Another instance changes the catalogue while this one still serves its cached snapshot."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(os.environ, {"LOCATIONS_CACHE_TTL_SECONDS": "60", "LOCATIONS_LOG_COMPACT_THRESHOLD": "1000000"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(storage.set_storage_backend, None)
+        self.a, self.b = _location(1), _location(2)
+
+    def _single_blob(self):
+        backend = FakeStorageBackend()
+        storage.set_storage_backend(backend)
+        storage.apply_location_changes(upserts=[self.a, self.b])
+        return backend, lambda records: backend.seed(records)
+
+    def _log(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        backend = LocalLogBackend(data_dir.name, "locations.json")
+        storage.set_storage_backend(backend)
+        storage.apply_location_changes(upserts=[self.a, self.b])
+        asyncio.run(storage.load_location_index_async()) # Cache the catalogue
+        other_instance = LocalLogBackend(data_dir.name, "locations.json")
+        def write(records):
+            current, _ = other_instance.read()
+            ids = {record["id"] for record in records}
+            other_instance.append_changes(records, [record["id"] for record in current if record["id"] not in ids])
+        return backend, write
+
+    def _stored(self, backend):
+        records, _ = backend.read()
+        return {record["id"]: record for record in records}
+
+    def _check_update_of_deleted_location(self, backend, other_write):
+        other_write(locations_to_records([self.b])) # Deletes a
+
+        updated = asyncio.run(crud_locations.update_location(self.a.id, LocationUpdate(notes="edited")))
+
+        self.assertIsNone(updated)
+        self.assertEqual(set(self._stored(backend)), {str(self.b.id)})
+
+    def _check_concurrent_field_edits(self, backend, other_write):
+        other_write(locations_to_records([self.a.model_copy(update={"name": "Renamed elsewhere"}), self.b]))
+
+        updated = asyncio.run(crud_locations.update_location(self.a.id, LocationUpdate(notes="edited")))
+
+        stored = self._stored(backend)[str(self.a.id)]
+        self.assertEqual((stored["name"], stored["notes"]), ("Renamed elsewhere", "edited"))
+        self.assertEqual((updated.name, updated.notes), ("Renamed elsewhere", "edited"))
+
+    def test_single_blob_update_does_not_recreate_deleted_location(self):
+        self._check_update_of_deleted_location(*self._single_blob())
+
+    def test_single_blob_update_keeps_other_fields(self):
+        self._check_concurrent_field_edits(*self._single_blob())
+
+    def test_log_update_does_not_recreate_deleted_location(self):
+        self._check_update_of_deleted_location(*self._log())
+
+    def test_log_update_keeps_other_fields(self):
+        self._check_concurrent_field_edits(*self._log())
+
+    def test_enrichment_results_are_dropped_after_an_address_change(self):
+        backend, other_write = self._log()
+        other_write(locations_to_records([self.a.model_copy(update={"address": "Moved"}), self.b]))
+
+        saved = asyncio.run(crud_locations.apply_enrichment_results({self.a.id: (self.a.address, (-41.0, 174.0), {"place": {}})}))
+
+        self.assertEqual(saved, 0)
+        stored = self._stored(backend)[str(self.a.id)]
+        self.assertEqual((stored["latitude"], stored["enrichment_data"]), (None, {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import asyncio
+import unittest
+import uuid
+
+from app.crud import storage
+from app.crud.travel_times import TravelTimeStore
+from benchmarks.fakes import FakeStorageBackend
+
+ORIGIN_A = (-41.29, 174.78)
+ORIGIN_B = (-36.85, 174.76)
+
+
+class EvictedOriginTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeStorageBackend()
+        storage.set_storage_backend(self.backend)
+        self.addCleanup(storage.set_storage_backend, None)
+        self.store = TravelTimeStore("travel_times/", max_origins=1)
+        self.location_id = uuid.uuid4()
+        self.destinations = {self.location_id: (-41.0, 175.0)}
+
+    def test_sync_calls_never_read_storage(self):
+        self.store.record(ORIGIN_A, {self.location_id: 600}, {}, self.destinations)
+        self.store.flush()
+        asyncio.run(self.store.ensure_loaded([ORIGIN_B])) # Evicts A
+        reads = self.backend.calls["read_sidecar"]
+
+        known, missing = self.store.lookup(ORIGIN_A, self.destinations)
+        self.store.record(ORIGIN_A, {}, {uuid.uuid4(): (-40.0, 175.0)}, self.destinations)
+        self.store.within(ORIGIN_A, 3600)
+
+        self.assertEqual(self.backend.calls["read_sidecar"], reads)
+        self.assertEqual((known, missing), ({}, [self.location_id]))
+
+    def test_flush_merges_an_origin_recorded_after_eviction(self):
+        self.store.record(ORIGIN_A, {self.location_id: 600}, {}, self.destinations)
+        self.store.flush()
+        asyncio.run(self.store.ensure_loaded([ORIGIN_B]))
+        other_id = uuid.uuid4()
+
+        self.store.record(ORIGIN_A, {other_id: 900}, {}, {other_id: (-40.0, 175.0)})
+        self.store.flush()
+        asyncio.run(self.store.ensure_loaded([ORIGIN_A]))
+
+        self.assertEqual(self.store.within(ORIGIN_A, 3600), [(self.location_id, 600), (other_id, 900)])
+
+
+if __name__ == "__main__":
+    unittest.main()